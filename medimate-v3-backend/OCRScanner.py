@@ -1,9 +1,15 @@
 import os
+import asyncio
+import json
+import hashlib
 from dotenv import load_dotenv
 import google.generativeai as genai
 import base64
 from PIL import Image
 from io import BytesIO
+from ocr_cache import OCRResultCache
+import tracing
+from metrics import gemini_call
 
 class OCRScanner:
     def __init__(self):
@@ -16,31 +22,28 @@ class OCRScanner:
         # Configure Gemini
         genai.configure(api_key=api_key)
         # Use the latest model version
-        self.model = genai.GenerativeModel("gemini-2.0-flash")
+        self.model_name = "gemini-2.0-flash"
+        self.model = genai.GenerativeModel(self.model_name)
 
-    def process_image(self, image_path: str) -> dict:
-        """
-        Process an image containing a medication label using Gemini Vision.
-        
-        Args:
-            image_path: Path to the image file
-            
-        Returns:
-            dict: Extracted medication information
-        """
-        try:
-            # Read and prepare the image
-            with Image.open(image_path) as img:
-                # Convert to RGB if needed
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                # Create a BytesIO object to store the image data
-                img_byte_arr = BytesIO()
-                img.save(img_byte_arr, format='JPEG')
-                img_byte_arr = img_byte_arr.getvalue()
-            
-            # Create the prompt for Gemini
-            prompt = """
+        # Cache of results keyed by image content, so rescans skip the Gemini round trip
+        self.cache = None
+        if os.getenv("OCR_CACHE_ENABLED", "true").lower() in ("1", "true", "yes"):
+            phash_distance = os.getenv("OCR_CACHE_PHASH_DISTANCE")
+            self.cache = OCRResultCache(
+                cache_dir=os.getenv("OCR_CACHE_DIR", "ocr_cache"),
+                max_memory_entries=int(os.getenv("OCR_CACHE_MEMORY_ENTRIES", "256")),
+                max_disk_bytes=int(os.getenv("OCR_CACHE_DISK_MB", "200")) * 1024 * 1024,
+                ttl=float(os.getenv("OCR_CACHE_TTL_SECONDS", str(7 * 24 * 3600))),
+                phash_distance=int(phash_distance) if phash_distance else None,
+                # Cached results are only reused by the same model, prompt and parser
+                namespace=f"{self.model_name}:{hashlib.sha256(self.PROMPT.encode()).hexdigest()[:16]}:v{self.RESULT_FORMAT_VERSION}",
+            )
+
+    # Bump when _parse_response changes the shape of its result, so cached results are not reused
+    RESULT_FORMAT_VERSION = 1
+
+    # Prompt sent alongside every label image
+    PROMPT = """
             You are a medical OCR expert. Please analyze this medication label image and extract the following information:
             - Medication Name
             - Description
@@ -57,59 +60,183 @@ class OCRScanner:
             Be precise and only include information that is clearly visible in the image.
             """
 
+    def process_image(self, image_path: str) -> dict:
+        """
+        Process an image containing a medication label using Gemini Vision.
+        
+        Args:
+            image_path: Path to the image file
+            
+        Returns:
+            dict: Extracted medication information
+        """
+        try:
+            with open(image_path, "rb") as f:
+                image_data = f.read()
+        except Exception as e:
+            return self._error_result(e)
+        return self.process_image_bytes(image_data)
+
+    def process_image_bytes(self, image_data: bytes) -> dict:
+        """
+        Process an in-memory medication label image using Gemini Vision.
+
+        Args:
+            image_data: Encoded image bytes (JPEG, PNG, ...)
+
+        Returns:
+            dict: Extracted medication information
+        """
+        try:
+            img_byte_arr, phash = self._prepare_image(image_data)
+
+            cache_key = None
+            if self.cache is not None:
+                cache_key = self.cache.key(img_byte_arr)
+                cached = self.cache.get(cache_key, phash)
+                if cached is not None:
+                    return dict(cached)
+
             # Generate content with Gemini Vision
-            response = self.model.generate_content([
-                prompt,
-                {"mime_type": "image/jpeg", "data": img_byte_arr}
-            ])
+            with gemini_call("ocr"):
+                response = self.model.generate_content([
+                    self.PROMPT,
+                    {"mime_type": "image/jpeg", "data": img_byte_arr}
+                ])
+            result = self._parse_response(response)
+
+            if cache_key is not None and self._is_cacheable(result):
+                self.cache.put(cache_key, result, phash)
+            return result
+
+        except Exception as e:
+            return self._error_result(e)
+
+    async def process_image_async(self, image_path: str) -> dict:
+        """Async variant of process_image."""
+        try:
+            image_data = await asyncio.to_thread(self._read_file, image_path)
+        except Exception as e:
+            return self._error_result(e)
+        return await self.process_image_bytes_async(image_data)
+
+    async def process_image_bytes_async(self, image_data: bytes) -> dict:
+        """
+        Async variant of process_image_bytes. Image decoding runs in a worker thread and
+        the Gemini call uses the native async client, so the event loop is never blocked.
+        """
+        try:
+            with tracing.span("ocr.prepare_image", **{"image.bytes": len(image_data)}):
+                img_byte_arr, phash = await asyncio.to_thread(self._prepare_image, image_data)
+
+            cache_key = None
+            if self.cache is not None:
+                with tracing.span("ocr.cache_lookup") as span:
+                    cache_key = self.cache.key(img_byte_arr)
+                    cached = await asyncio.to_thread(self.cache.get, cache_key, phash)
+                    span.set_attribute("ocr.cache_hit", cached is not None)
+                if cached is not None:
+                    return dict(cached)
+
+            with gemini_call("ocr"):
+                response = await self.model.generate_content_async([
+                    self.PROMPT,
+                    {"mime_type": "image/jpeg", "data": img_byte_arr}
+                ])
+            result = self._parse_response(response)
+
+            if cache_key is not None and self._is_cacheable(result):
+                with tracing.span("ocr.cache_store"):
+                    await asyncio.to_thread(self.cache.put, cache_key, result, phash)
+            return result
+
+        except Exception as e:
+            tracing.current_span().set_error(str(e))
+            return self._error_result(e)
+
+    @staticmethod
+    def _read_file(image_path: str) -> bytes:
+        with open(image_path, "rb") as f:
+            return f.read()
+
+    def _prepare_image(self, image_data: bytes) -> tuple[bytes, int | None]:
+        """
+        Return RGB JPEG bytes for the image, plus the perceptual hash used for
+        near-duplicate cache lookups if that is enabled.
+
+        JPEGs that are already RGB (or greyscale) are passed through untouched;
+        anything else is decoded and re-encoded.
+        """
+        with Image.open(BytesIO(image_data)) as img:
+            # Image.open only parses the header, so this check does not decode pixels
+            passthrough = img.format == 'JPEG' and img.mode in ('RGB', 'L')
+            phash = None
+            if self.cache is not None and self.cache.phash_distance is not None:
+                phash = OCRResultCache.perceptual_hash(img)
+            if passthrough:
+                return image_data, phash
+
+            # Convert to RGB if needed
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            # Create a BytesIO object to store the image data
+            img_byte_arr = BytesIO()
+            img.save(img_byte_arr, format='JPEG')
+            return img_byte_arr.getvalue(), phash
+
+    @staticmethod
+    def _is_cacheable(result: dict) -> bool:
+        """Only successful extractions are cached; errors should be retried upstream."""
+        return "error" not in result and result.get("Medication Name") != "Parsing Error"
+
+    def _parse_response(self, response) -> dict:
+        """Extract the structured medication fields from a Gemini response."""
+        response_text = None
+        try:
+            # Try to extract JSON from the response if it's embedded in markdown
+            response_text = response.text
+            if "```json" in response_text:
+                json_str = response_text.split("```json")[1].split("```")[0].strip()
+                result = json.loads(json_str)
+            else:
+                # Try to parse the entire response as JSON
+                result = json.loads(response_text)
+                
+            # Ensure all expected fields are present
+            expected_fields = [
+                "Medication Name", "Description", "Dosage", "Frequency", 
+                "Time of day", "Start Date", "Duration", "Special Instructions"
+            ]
             
-            # Process response to extract structured data
-            try:
-                # Try to extract JSON from the response if it's embedded in markdown
-                response_text = response.text
-                if "```json" in response_text:
-                    json_str = response_text.split("```json")[1].split("```")[0].strip()
-                    import json
-                    result = json.loads(json_str)
-                else:
-                    # Try to parse the entire response as JSON
-                    import json
-                    result = json.loads(response_text)
+            for field in expected_fields:
+                if field not in result:
+                    result[field] = "Not specified"
                     
-                # Ensure all expected fields are present
-                expected_fields = [
-                    "Medication Name", "Description", "Dosage", "Frequency", 
-                    "Time of day", "Start Date", "Duration", "Special Instructions"
-                ]
-                
-                for field in expected_fields:
-                    if field not in result:
-                        result[field] = "Not specified"
-                        
-                return result
-                
-            except Exception as e:
-                return {
-                    "Medication Name": "Parsing Error",
-                    "Description": f"Could not parse model response: {str(e)}",
-                    "Dosage": "Not specified",
-                    "Frequency": "Not specified",
-                    "Time of day": "Not specified",
-                    "Start Date": "Not specified",
-                    "Duration": "Not specified",
-                    "Special Instructions": "Not specified",
-                    "Raw Response": response_text
-                }
-                
+            return result
+            
         except Exception as e:
             return {
-                "error": str(e),
-                "Medication Name": "Error",
-                "Description": f"Error processing image: {str(e)}",
+                "Medication Name": "Parsing Error",
+                "Description": f"Could not parse model response: {str(e)}",
                 "Dosage": "Not specified",
                 "Frequency": "Not specified",
                 "Time of day": "Not specified",
                 "Start Date": "Not specified",
                 "Duration": "Not specified",
-                "Special Instructions": "Not specified"
+                "Special Instructions": "Not specified",
+                "Raw Response": response_text
             }
+
+    @staticmethod
+    def _error_result(e: Exception) -> dict:
+        return {
+            "error": str(e),
+            "Medication Name": "Error",
+            "Description": f"Error processing image: {str(e)}",
+            "Dosage": "Not specified",
+            "Frequency": "Not specified",
+            "Time of day": "Not specified",
+            "Start Date": "Not specified",
+            "Duration": "Not specified",
+            "Special Instructions": "Not specified"
+        }
@@ -0,0 +1,430 @@
+"""
+In-memory audio decoding for voice analysis.
+
+The container is sniffed from the first bytes. WAV uploads are parsed
+in-process as their chunks arrive; MP4/M4A uploads are decoded by ffmpeg
+through pipes. Either way the result is a float64 NumPy array of shape
+``(channels, samples)`` scaled to [-1, 1] like Praat's own WAV reader, ready
+for ``parselmouth.Sound(values, sampling_frequency=rate)``. Nothing touches
+the disk.
+"""
+import hashlib
+import io
+import logging
+import os
+import shutil
+import struct
+import subprocess
+
+from typing import Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+FFMPEG_TIMEOUT_SECONDS = float(os.getenv("FFMPEG_TIMEOUT_SECONDS", "30"))
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class AudioDecodeError(ValueError):
+    """Raised when uploaded audio cannot be decoded."""
+
+
+class UnsupportedAudioFormat(AudioDecodeError):
+    """Raised when the first bytes of an upload are not a supported container."""
+
+
+class AudioTooLarge(AudioDecodeError):
+    """Raised when an upload exceeds the configured byte or duration limit."""
+
+
+def ffmpeg_path():
+    """Full path of the ffmpeg binary, or None if it is not installed"""
+    return shutil.which(FFMPEG_BINARY)
+
+
+def is_wav(data: bytes) -> bool:
+    return len(data) >= 12 and data[:4] == b"RIFF" and data[8:12] == b"WAVE"
+
+
+def sniff_format(head: bytes) -> Optional[str]:
+    """Container type from the first 12 bytes: 'wav', 'mp4' (m4a/AAC recordings) or None"""
+    if is_wav(head):
+        return "wav"
+    if len(head) >= 12 and head[4:8] == b"ftyp":
+        return "mp4"
+    return None
+
+
+def parse_wav(data: bytes):
+    """
+    Parse a RIFF/WAVE byte string into ``(samples, sample_rate)``.
+    Supports 8/16/24/32-bit integer PCM and 32/64-bit float, including WAVE_FORMAT_EXTENSIBLE.
+    """
+    if not is_wav(data):
+        raise AudioDecodeError("Not a RIFF/WAVE file.")
+
+    fmt = None
+    pcm = None
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_id = data[offset:offset + 4]
+        chunk_size = struct.unpack_from("<I", data, offset + 4)[0]
+        body_start = offset + 8
+        # Streamed WAVs (e.g. ffmpeg writing to a pipe) leave the size unset, so clamp to what we have
+        body_end = min(body_start + chunk_size, len(data))
+        if chunk_id == b"fmt ":
+            fmt = _parse_fmt(data[body_start:body_end])
+        elif chunk_id == b"data":
+            pcm = data[body_start:body_end]
+            break
+        # Chunks are word aligned
+        offset = body_start + chunk_size + (chunk_size & 1)
+
+    if fmt is None:
+        raise AudioDecodeError("WAV file has no fmt chunk.")
+    if pcm is None:
+        raise AudioDecodeError("WAV file has no data chunk.")
+
+    format_tag, channels, sample_rate, block_align, bits = fmt
+    frames = len(pcm) // block_align
+    samples = _pcm_to_float(pcm[:frames * block_align], format_tag, bits)
+    # Interleaved frames -> (channels, samples)
+    return np.ascontiguousarray(samples.reshape(-1, channels).T), sample_rate
+
+
+def _parse_fmt(body: bytes):
+    """Validate a WAV fmt chunk body and return (format_tag, channels, sample_rate, block_align, bits)"""
+    if len(body) < 16:
+        raise AudioDecodeError("Truncated WAV fmt chunk.")
+    format_tag, channels, sample_rate, _, block_align, bits = struct.unpack_from("<HHIIHH", body)
+    if format_tag == WAVE_FORMAT_EXTENSIBLE and len(body) >= 26:
+        # The real format is the first two bytes of the SubFormat GUID
+        format_tag = struct.unpack_from("<H", body, 24)[0]
+    if channels < 1 or sample_rate <= 0:
+        raise AudioDecodeError(f"Invalid WAV header: {channels} channel(s) at {sample_rate} Hz.")
+    if bits % 8 or block_align != channels * (bits // 8):
+        raise AudioDecodeError(f"Unsupported WAV block alignment {block_align} for {channels}x{bits}-bit samples.")
+    if format_tag == WAVE_FORMAT_PCM and bits not in (8, 16, 24, 32):
+        raise AudioDecodeError(f"Unsupported PCM bit depth: {bits}")
+    if format_tag == WAVE_FORMAT_IEEE_FLOAT and bits not in (32, 64):
+        raise AudioDecodeError(f"Unsupported float bit depth: {bits}")
+    if format_tag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT):
+        raise AudioDecodeError(f"Unsupported WAV format tag 0x{format_tag:04x} ({bits}-bit)")
+    return format_tag, channels, sample_rate, block_align, bits
+
+
+def _pcm_to_float(pcm: bytes, format_tag: int, bits: int) -> np.ndarray:
+    """Convert whole interleaved frames of WAV sample data to float64 in [-1, 1]"""
+    if format_tag == WAVE_FORMAT_PCM:
+        if bits == 8:
+            # 8-bit WAV is unsigned
+            samples = (np.frombuffer(pcm, dtype=np.uint8).astype(np.float64) - 128.0) / 128.0
+        elif bits == 16:
+            samples = np.frombuffer(pcm, dtype="<i2") / 32768.0
+        elif bits == 24:
+            raw = np.frombuffer(pcm, dtype=np.uint8).reshape(-1, 3)
+            ints = (raw[:, 0].astype(np.int32) | (raw[:, 1].astype(np.int32) << 8) | (raw[:, 2].astype(np.int32) << 16))
+            ints = np.where(ints >= 1 << 23, ints - (1 << 24), ints)
+            samples = ints / float(1 << 23)
+        else:
+            samples = np.frombuffer(pcm, dtype="<i4") / float(1 << 31)
+    else:
+        samples = np.frombuffer(pcm, dtype="<f4" if bits == 32 else "<f8").astype(np.float64)
+    return samples
+
+
+def _open_spool():
+    if hasattr(os, "memfd_create"):
+        return os.memfd_create("medimate-audio")
+    return io.BytesIO()
+
+
+def _spool_write(spool, data: bytes):
+    if isinstance(spool, int):
+        with os.fdopen(spool, "wb", closefd=False) as memfile:
+            memfile.write(data)
+    else:
+        spool.write(data)
+
+
+def _close_spool(spool):
+    if isinstance(spool, int):
+        os.close(spool)
+
+
+def _run_ffmpeg(spool, max_seconds: Optional[float] = None):
+    """
+    Decode spooled audio with ffmpeg into ``(samples, sample_rate)``.
+
+    The input is handed over as an in-memory file (memfd) so ffmpeg can seek to an MP4 'moov' atom stored at
+    the end, which is common for phone recordings; where memfd is unavailable it is streamed on stdin.
+    The output is float WAV on stdout, cut at ``max_seconds`` when given.
+    """
+    binary = ffmpeg_path()
+    if binary is None:
+        raise AudioDecodeError("ffmpeg is not installed; only WAV uploads can be decoded.")
+
+    output_args = ["-vn", "-f", "wav", "-acodec", "pcm_f32le"]
+    if max_seconds:
+        output_args += ["-t", str(max_seconds)]
+    output_args.append("pipe:1")
+    try:
+        if isinstance(spool, int):
+            os.lseek(spool, 0, os.SEEK_SET)
+            command = [binary, "-nostdin", "-loglevel", "error", "-i", f"/dev/fd/{spool}", *output_args]
+            result = subprocess.run(command, pass_fds=(spool,), capture_output=True, timeout=FFMPEG_TIMEOUT_SECONDS)
+        else:
+            command = [binary, "-loglevel", "error", "-i", "pipe:0", *output_args]
+            result = subprocess.run(command, input=spool.getvalue(), capture_output=True, timeout=FFMPEG_TIMEOUT_SECONDS)
+    except subprocess.TimeoutExpired as e:
+        raise AudioDecodeError(f"ffmpeg did not finish decoding within {FFMPEG_TIMEOUT_SECONDS}s") from e
+
+    if result.returncode != 0 or not result.stdout:
+        message = result.stderr.decode(errors="replace").strip() or f"exit code {result.returncode}"
+        raise AudioDecodeError(f"ffmpeg could not decode the audio: {message}")
+    return parse_wav(result.stdout)
+
+
+class StreamingAudioDecoder:
+    """
+    Decodes an upload chunk by chunk with bounded memory.
+
+    ``feed()`` takes chunks as they arrive from the network. The container is
+    sniffed from the first 12 bytes, whatever the filename says. WAV sample
+    data is kept as raw bytes and converted to float once in ``decode()``; its
+    declared duration is checked as soon as the header is complete. MP4/M4A bytes are spooled into
+    an in-memory file and decoded by ffmpeg in ``decode()``, with the output
+    cut just past ``max_seconds``. ``feed()`` raises AudioTooLarge the moment
+    either limit is crossed, so the rest of an oversized upload is never read.
+    ``digest`` is the SHA-256 of every byte fed.
+    """
+
+    HEADER_LIMIT = 64 * 1024
+    UNKNOWN_SIZES = (0, 0xFFFFFFFF)
+
+    def __init__(self, max_bytes: Optional[int] = None, max_seconds: Optional[float] = None):
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.format = None
+        self.bytes_received = 0
+        self._digest = hashlib.sha256()
+        self._head = bytearray()
+        self._fmt = None
+        self._data_remaining = None
+        self._pcm = bytearray()
+        self._spool = None
+
+    @property
+    def digest(self) -> str:
+        return self._digest.hexdigest()
+
+    def feed(self, chunk: bytes):
+        if not chunk:
+            return
+        self.bytes_received += len(chunk)
+        if self.max_bytes is not None and self.bytes_received > self.max_bytes:
+            raise AudioTooLarge(f"Audio upload exceeds the {self.max_bytes} byte limit.")
+        self._digest.update(chunk)
+
+        if self.format is None:
+            self._head += chunk
+            if len(self._head) < 12:
+                return
+            self.format = sniff_format(bytes(self._head[:12]))
+            if self.format is None:
+                raise UnsupportedAudioFormat("Unrecognised audio format; only WAV and M4A (MP4/AAC) are supported.")
+            chunk, self._head = bytes(self._head), bytearray()
+            if self.format == "mp4":
+                self._spool = _open_spool()
+
+        if self.format == "mp4":
+            _spool_write(self._spool, chunk)
+        elif self._fmt is None:
+            self._feed_wav_header(chunk)
+        else:
+            self._feed_pcm(chunk)
+
+    def decode(self):
+        """Finish decoding and return ``(samples, sample_rate)``; may run ffmpeg, so call it off the event loop"""
+        try:
+            if self.format is None:
+                if self.bytes_received == 0:
+                    raise AudioDecodeError("Received empty audio.")
+                raise UnsupportedAudioFormat("Upload is too short to be an audio file.")
+            if self.format == "mp4":
+                # Decode a little past the limit so an over-long recording can be told apart from one that fits
+                samples, sample_rate = _run_ffmpeg(self._spool, self.max_seconds + 1 if self.max_seconds else None)
+                self._check_duration(samples.shape[1], sample_rate)
+                return samples, sample_rate
+            if self._fmt is None:
+                raise AudioDecodeError("WAV file has no data chunk.")
+            format_tag, channels, sample_rate, block_align, bits = self._fmt
+            frames = len(self._pcm) // block_align
+            samples = _pcm_to_float(memoryview(self._pcm)[:frames * block_align], format_tag, bits)
+            # Release the raw bytes before de-interleaving (a no-op for mono) so at most two copies are alive
+            self._pcm = bytearray()
+            return np.ascontiguousarray(samples.reshape(-1, channels).T), sample_rate
+        finally:
+            self.close()
+
+    def close(self):
+        if self._spool is not None:
+            _close_spool(self._spool)
+            self._spool = None
+        self._pcm = bytearray()
+
+    def _feed_wav_header(self, chunk: bytes):
+        self._head += chunk
+        data = bytes(self._head)
+        fmt = None
+        offset = 12
+        while offset + 8 <= len(data):
+            chunk_id = data[offset:offset + 4]
+            chunk_size = struct.unpack_from("<I", data, offset + 4)[0]
+            body_start = offset + 8
+            if chunk_id == b"data":
+                if fmt is None:
+                    raise AudioDecodeError("WAV file has no fmt chunk before its data.")
+                self._start_data(fmt, chunk_size)
+                self._head = bytearray()
+                self._feed_pcm(data[body_start:])
+                return
+            if body_start + chunk_size > len(data):
+                break
+            if chunk_id == b"fmt ":
+                fmt = _parse_fmt(data[body_start:body_start + chunk_size])
+            offset = body_start + chunk_size + (chunk_size & 1)
+        if len(self._head) > self.HEADER_LIMIT:
+            raise AudioDecodeError("WAV header is too large or has no data chunk.")
+
+    def _start_data(self, fmt, data_size: int):
+        self._fmt = fmt
+        _, _, sample_rate, block_align, _ = fmt
+        if data_size in self.UNKNOWN_SIZES:
+            # Streamed WAVs leave the size unset; the running duration check still applies
+            self._data_remaining = None
+        else:
+            self._data_remaining = data_size
+            self._check_duration(data_size // block_align, sample_rate)
+
+    def _feed_pcm(self, data: bytes):
+        if self._data_remaining is not None:
+            # Anything after the data chunk (LIST/ID3 metadata) is not audio
+            data = data[:self._data_remaining]
+            self._data_remaining -= len(data)
+        _, _, sample_rate, block_align, _ = self._fmt
+        # Raw samples take a quarter of the memory float64 would (16-bit PCM) until decode()
+        self._pcm += data
+        self._check_duration(len(self._pcm) // block_align, sample_rate)
+
+    def _check_duration(self, frames: int, sample_rate: int):
+        if self.max_seconds is not None and frames > self.max_seconds * sample_rate:
+            raise AudioTooLarge(f"Audio is longer than the {self.max_seconds:g} second limit.")
+
+
+def decode_audio(data: bytes, max_bytes: Optional[int] = None, max_seconds: Optional[float] = None):
+    """Decode a complete audio file held in memory into ``(samples, sample_rate)``"""
+    decoder = StreamingAudioDecoder(max_bytes=max_bytes, max_seconds=max_seconds)
+    try:
+        decoder.feed(data)
+    except Exception:
+        decoder.close()
+        raise
+    return decoder.decode()
+
+
+class AudioNormalizer:
+    """
+    Prepares decoded audio for Praat analysis.
+
+    Praat's pitch, harmonicity and point-process cost scales with duration x
+    sample rate, so before analysis the audio is downmixed to mono, trimmed of
+    leading and trailing silence, capped at ``max_seconds`` and resampled to
+    ``target_rate`` (Praat's sinc resampler). Silence is found with an
+    energy VAD: 30 ms frames more than ``threshold_db`` below the loudest
+    frame count as silence, and ``padding_seconds`` is kept around the voiced
+    region. Pauses inside the recording are kept so jitter and shimmer see the
+    same periods as before.
+
+    At 16 kHz, resampling alone keeps the 14 voice features of sample_audio.wav
+    within 1% of the full-rate values. Trimming shifts Praat's analysis frame
+    grid, which jitter is sensitive to; the per-feature tolerances are listed
+    and checked in check_audio_normalization.py.
+    """
+
+    FRAME_SECONDS = 0.03
+    HOP_SECONDS = 0.01
+
+    def __init__(self, target_rate: int = 16000, max_seconds: float = 30.0, trim_silence: bool = True,
+                 threshold_db: float = 40.0, padding_seconds: float = 0.1):
+        self.target_rate = target_rate
+        self.max_seconds = max_seconds
+        self.trim_silence = trim_silence
+        self.threshold_db = threshold_db
+        self.padding_seconds = padding_seconds
+
+    def __call__(self, samples, sample_rate: int):
+        """Return ``(mono_samples, rate, report)``; the report says how much audio was dropped and why"""
+        samples = np.asarray(samples, dtype=np.float64)
+        channels = 1 if samples.ndim == 1 else samples.shape[0]
+        mono = samples if samples.ndim == 1 else samples.mean(axis=0)
+        original_seconds = len(mono) / sample_rate
+
+        # Trim and cap first so only the audio that is analysed gets resampled
+        leading = trailing = 0
+        if self.trim_silence:
+            start, end = self._voiced_bounds(mono, sample_rate)
+            leading, trailing = start, len(mono) - end
+            mono = mono[start:end]
+
+        over_cap = 0
+        if self.max_seconds and len(mono) > self.max_seconds * sample_rate:
+            keep = int(self.max_seconds * sample_rate)
+            over_cap = len(mono) - keep
+            mono = mono[:keep]
+
+        rate = sample_rate
+        if self.target_rate and sample_rate > self.target_rate:
+            import parselmouth
+
+            mono = parselmouth.Sound(mono, sampling_frequency=sample_rate).resample(self.target_rate).values[0]
+            rate = self.target_rate
+
+        report = {
+            "channels": channels,
+            "original_rate": sample_rate,
+            "analysis_rate": rate,
+            "original_seconds": round(original_seconds, 3),
+            "analysed_seconds": round(len(mono) / rate, 3),
+            "dropped_leading_silence_seconds": round(leading / sample_rate, 3),
+            "dropped_trailing_silence_seconds": round(trailing / sample_rate, 3),
+            "dropped_over_cap_seconds": round(over_cap / sample_rate, 3),
+        }
+        return np.ascontiguousarray(mono), rate, report
+
+    def _voiced_bounds(self, mono, rate):
+        frame = max(1, int(self.FRAME_SECONDS * rate))
+        hop = max(1, int(self.HOP_SECONDS * rate))
+        if len(mono) < frame:
+            return 0, len(mono)
+        # Frame energies from a running sum of squares: overlapping frames would hold frame/hop copies of the audio
+        cumulative = np.empty(len(mono) + 1)
+        cumulative[0] = 0.0
+        np.square(mono, out=cumulative[1:])
+        np.cumsum(cumulative[1:], out=cumulative[1:])
+        starts = np.arange(0, len(mono) - frame + 1, hop)
+        # Rounding in the running sum can leave silent frames a hair below zero
+        energy = np.maximum(cumulative[starts + frame] - cumulative[starts], 0.0) / frame
+        energy_db = 10.0 * np.log10(energy + 1e-12)
+        voiced = np.nonzero(energy_db >= energy_db.max() - self.threshold_db)[0]
+        if len(voiced) == 0:
+            return 0, len(mono)
+        padding = int(self.padding_seconds * rate)
+        start = max(0, voiced[0] * hop - padding)
+        end = min(len(mono), voiced[-1] * hop + frame + padding)
+        return start, end
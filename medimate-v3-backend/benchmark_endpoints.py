@@ -0,0 +1,401 @@
+import argparse
+import asyncio
+import base64
+import datetime
+import glob
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import wave
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_DIR = os.path.join(BACKEND_DIR, 'benchmarks')
+SCENARIOS = ['upload-voice-wav', 'upload-voice-m4a', 'ocr', 'chat', 'transcription']
+
+# Metrics compared against a baseline, and whether a larger value is worse
+COMPARED_METRICS = {
+    'p50_ms': True, 'p95_ms': True, 'p99_ms': True, 'ttfb_p95_ms': True,
+    'throughput_rps': False, 'peak_rss_mb': True,
+}
+
+TRANSCRIPT = ("Patient: I've been really tired lately and always thirsty, and I lost some weight without trying. "
+              "Doctor: Sounds like stress. Get some rest and I'll prescribe vitamins.")
+
+
+# --- Request bodies ---
+
+def synthetic_voice(seconds=3.0, rate=44100, f0=140.0, seed=0):
+    """A sustained vowel-like tone: harmonics of a slowly wavering f0 under a syllable envelope, plus breath noise."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * rate)) / rate
+    pitch = f0 * (1.0 + 0.03 * np.sin(2 * np.pi * 5.0 * t)) * (1.0 + 0.01 * rng.standard_normal(len(t)))
+    phase = 2 * np.pi * np.cumsum(pitch) / rate
+    signal = sum(np.sin(k * phase) / k for k in range(1, 12))
+    envelope = np.clip(np.sin(np.pi * t / seconds) * 1.5, 0.0, 1.0)
+    signal = envelope * signal / np.max(np.abs(signal)) * 0.6 + 0.005 * rng.standard_normal(len(t))
+    return (np.clip(signal, -1.0, 1.0) * 32767).astype(np.int16), rate
+
+
+def wav_bytes(samples, rate):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+def m4a_bytes(wav_data):
+    """Encode a WAV recording to AAC in an m4a container, as phones upload it; None without ffmpeg."""
+    from audio_io import ffmpeg_path
+
+    converter = ffmpeg_path()
+    if not converter:
+        return None
+    with tempfile.TemporaryDirectory() as folder:
+        source, target = os.path.join(folder, 'voice.wav'), os.path.join(folder, 'voice.m4a')
+        with open(source, 'wb') as f:
+            f.write(wav_data)
+        subprocess.run([converter, '-y', '-loglevel', 'error', '-i', source, '-c:a', 'aac', '-b:a', '96k', target],
+                       check=True)
+        with open(target, 'rb') as f:
+            return f.read()
+
+
+def label_image_base64():
+    """A PNG medication label (PNG, so the OCR path re-encodes it to JPEG as it does for most phone uploads)."""
+    from PIL import Image, ImageDraw
+
+    image = Image.new('RGB', (900, 420), 'white')
+    draw = ImageDraw.Draw(image)
+    for line, text in enumerate(["METFORMIN 500 MG TABLETS", "Take 1 tablet twice daily with meals",
+                                 "Qty: 60    Refills: 2", "Dr. A. Tan    Rx 0048213"]):
+        draw.text((40, 40 + line * 80), text, fill='black')
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def build_requests(scenarios):
+    """(method, path, httpx keyword arguments, streamed response?) for each scenario that can run here"""
+    with open(os.path.join(BACKEND_DIR, 'sample_audio.wav'), 'rb') as f:
+        sample_wav = f.read()
+    requests = {}
+    for name in scenarios:
+        if name == 'upload-voice-wav':
+            requests[name] = ('POST', '/upload-voice', {'files': {'file': ('sample_audio.wav', sample_wav, 'audio/wav')}}, False)
+        elif name == 'upload-voice-m4a':
+            m4a = m4a_bytes(wav_bytes(*synthetic_voice()))
+            if m4a is None:
+                print("Skipping upload-voice-m4a: ffmpeg not found (set FFMPEG_BINARY)")
+                continue
+            requests[name] = ('POST', '/upload-voice', {'files': {'file': ('voice.m4a', m4a, 'audio/mp4')}}, False)
+        elif name == 'ocr':
+            requests[name] = ('POST', '/process-medication-image', {'json': {'image': label_image_base64()}}, False)
+        elif name == 'chat':
+            requests[name] = ('POST', '/chat', {'json': {'message': "User message: What should I eat before a fasting glucose test?"}}, True)
+        elif name == 'transcription':
+            requests[name] = ('POST', '/analyze-transcription', {'json': {'transcription': TRANSCRIPT}}, False)
+    return requests
+
+
+# --- Measurement ---
+
+class FirstByteTimer:
+    """
+    ASGI wrapper recording when each request's first non-empty body chunk is sent. httpx's
+    ASGITransport hands the response over only once it is complete, so streamed endpoints
+    would otherwise show no time-to-first-byte.
+    """
+
+    HEADER = b'x-benchmark-request'
+
+    def __init__(self, app):
+        self.app = app
+        self.first_byte = {}
+
+    async def __call__(self, scope, receive, send):
+        request_id = dict(scope.get('headers') or []).get(self.HEADER) if scope['type'] == 'http' else None
+        if request_id is None:
+            return await self.app(scope, receive, send)
+
+        async def timed_send(message):
+            if message['type'] == 'http.response.body' and message.get('body') and request_id not in self.first_byte:
+                self.first_byte[request_id] = time.perf_counter()
+            await send(message)
+
+        await self.app(scope, receive, timed_send)
+
+
+def _rss_bytes(pid):
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _child_pids(pid):
+    children = []
+    for path in glob.glob(f'/proc/{pid}/task/*/children'):
+        try:
+            with open(path) as f:
+                children.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return children
+
+
+class RSSSampler:
+    """
+    Peak resident memory of this process and, separately, of its child processes (feature
+    extraction workers, ffmpeg), sampled from /proc. Elsewhere only the process's own peak
+    (getrusage) is available.
+    """
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak = self.peak_children = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._proc = os.path.exists('/proc/self/statm')
+
+    def __enter__(self):
+        if self._proc:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        else:
+            # ru_maxrss is in kilobytes on Linux and bytes on macOS
+            scale = 1 if platform.system() == 'Darwin' else 1024
+            self.peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+    def _run(self):
+        pid = os.getpid()
+        while not self._stop.is_set():
+            self.peak = max(self.peak, _rss_bytes(pid))
+            self.peak_children = max(self.peak_children, sum(_rss_bytes(child) for child in _child_pids(pid)))
+            self._stop.wait(self.interval)
+
+
+def summarize(latencies, first_bytes, errors, wall_seconds, sampler):
+    latencies_ms = np.array(latencies) * 1000.0
+    summary = {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / wall_seconds, 3) if wall_seconds > 0 else None,
+        'peak_rss_mb': round(sampler.peak / 2 ** 20, 1),
+        'peak_children_rss_mb': round(sampler.peak_children / 2 ** 20, 1),
+    }
+    if len(latencies_ms):
+        summary.update({
+            'mean_ms': round(float(latencies_ms.mean()), 2),
+            'p50_ms': round(float(np.percentile(latencies_ms, 50)), 2),
+            'p95_ms': round(float(np.percentile(latencies_ms, 95)), 2),
+            'p99_ms': round(float(np.percentile(latencies_ms, 99)), 2),
+            'max_ms': round(float(latencies_ms.max()), 2),
+        })
+    if first_bytes:
+        first_bytes_ms = np.array(first_bytes) * 1000.0
+        summary['ttfb_p50_ms'] = round(float(np.percentile(first_bytes_ms, 50)), 2)
+        summary['ttfb_p95_ms'] = round(float(np.percentile(first_bytes_ms, 95)), 2)
+    return summary
+
+
+async def run_scenario(client, timer, request, n_requests, concurrency, warmup):
+    """Send ``warmup`` unmeasured requests, then ``n_requests`` with ``concurrency`` in flight."""
+    method, path, kwargs, streamed = request
+    latencies, first_bytes, errors = [], [], []
+
+    async def send(measure):
+        request_id = uuid.uuid4().hex.encode()
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, path, headers={'x-benchmark-request': request_id.decode()}, **kwargs)
+            ok = response.status_code < 400
+            # Stream frames carry failures in-band
+            if ok and streamed:
+                ok = '"error"' not in response.text
+        except Exception as e:
+            ok, response = False, e
+        finished = time.perf_counter()
+        first_byte = timer.first_byte.pop(request_id, None)
+        if not measure:
+            return
+        if not ok:
+            errors.append(getattr(response, 'status_code', repr(response)))
+            return
+        latencies.append(finished - started)
+        if streamed and first_byte is not None:
+            first_bytes.append(first_byte - started)
+
+    for _ in range(warmup):
+        await send(measure=False)
+
+    remaining = iter(range(n_requests))
+
+    async def worker():
+        for _ in remaining:
+            await send(measure=True)
+
+    with RSSSampler() as sampler:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall_seconds = time.perf_counter() - started
+    if errors:
+        print(f"    {len(errors)} failed request(s), e.g. {errors[0]}")
+    return summarize(latencies, first_bytes, len(errors), wall_seconds, sampler)
+
+
+async def run_benchmarks(scenarios, n_requests, concurrency, warmup):
+    import httpx
+    import main as server
+
+    requests = build_requests(scenarios)
+    timer = FirstByteTimer(server.app)
+    results = {}
+    transport = httpx.ASGITransport(app=timer)
+    # The lifespan (subsystem loading and warmup, MEDIMATE_STARTUP_MODE=eager) runs as it would under uvicorn
+    async with server.app.router.lifespan_context(server.app):
+        async with httpx.AsyncClient(transport=transport, base_url='http://benchmark', timeout=300) as client:
+            for name, request in requests.items():
+                print(f"Running {name}: {n_requests} requests, {concurrency} concurrent...")
+                results[name] = await run_scenario(client, timer, request, n_requests, concurrency, warmup)
+                print(f"    {format_result(results[name])}")
+    return results
+
+
+# --- Reporting and baselines ---
+
+def format_result(result):
+    parts = [f"p50 {result.get('p50_ms', '-')}ms", f"p95 {result.get('p95_ms', '-')}ms",
+             f"p99 {result.get('p99_ms', '-')}ms", f"{result['throughput_rps']} req/s"]
+    if 'ttfb_p50_ms' in result:
+        parts.append(f"first byte p50 {result['ttfb_p50_ms']}ms")
+    parts.append(f"peak RSS {result['peak_rss_mb']}MB (+{result['peak_children_rss_mb']}MB workers)")
+    if result['errors']:
+        parts.append(f"{result['errors']} errors")
+    return ", ".join(parts)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def baseline_path(name):
+    return name if name.endswith('.json') else os.path.join(BASELINE_DIR, f'{name}.json')
+
+
+def compare(results, baseline, max_regression):
+    """Print each metric against the baseline; returns the (scenario, metric) pairs that regressed."""
+    regressions = []
+    print(f"\nCompared with baseline '{baseline['name']}' (commit {baseline.get('git_commit')}, {baseline['created_at']}):")
+    for scenario, result in results.items():
+        previous = baseline['results'].get(scenario)
+        if previous is None:
+            print(f"  {scenario}: not in the baseline")
+            continue
+        for metric, larger_is_worse in COMPARED_METRICS.items():
+            if result.get(metric) is None or not previous.get(metric):
+                continue
+            change = (result[metric] - previous[metric]) / previous[metric]
+            worse = change > max_regression if larger_is_worse else change < -max_regression
+            if worse:
+                regressions.append((scenario, metric))
+            print(f"  {scenario:17} {metric:15} {previous[metric]:>10} -> {result[metric]:>10} "
+                  f"({change:+.1%}){'  REGRESSION' if worse else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the API in-process against an offline Gemini stand-in and compare with stored baselines.")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"Comma-separated subset of {SCENARIOS}")
+    parser.add_argument('--requests', type=int, default=30, help="Measured requests per scenario")
+    parser.add_argument('--concurrency', type=int, default=4, help="Requests in flight per scenario")
+    parser.add_argument('--warmup', type=int, default=2, help="Unmeasured requests before each scenario")
+    parser.add_argument('--gemini-first-token-ms', type=float, default=400.0, help="Fake Gemini latency to the first chunk")
+    parser.add_argument('--gemini-tokens-per-second', type=float, default=100.0, help="Fake Gemini streaming rate")
+    parser.add_argument('--gemini-response-tokens', type=int, default=150, help="Length of fake Gemini text answers")
+    parser.add_argument('--gemini-jitter', type=float, default=0.2, help="Fake Gemini latency spread (fraction, uniform)")
+    parser.add_argument('--save', nargs='?', const='', metavar='NAME',
+                        help="Store the results as a baseline in benchmarks/ (default name: the current commit)")
+    parser.add_argument('--compare', metavar='NAME', help="Baseline name (in benchmarks/) or JSON path to diff against")
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help="Relative change counted as a regression when comparing (exit status 1)")
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = sorted(set(scenarios) - set(SCENARIOS))
+    if unknown:
+        parser.error(f"Unknown scenario(s) {unknown}; choose from {SCENARIOS}")
+
+    # Measure the full pipeline: no result caches, everything loaded and warmed before the first request
+    os.environ.setdefault('MEDIMATE_STARTUP_MODE', 'eager')
+    os.environ.setdefault('VOICE_CACHE_ENABLED', 'false')
+    os.environ.setdefault('OCR_CACHE_ENABLED', 'false')
+    os.environ.setdefault('GEMINI_API_KEY', 'offline-benchmark')
+    sys.path.insert(0, BACKEND_DIR)
+
+    from fake_gemini import FakeGemini
+
+    gemini = FakeGemini(first_token_ms=args.gemini_first_token_ms, tokens_per_second=args.gemini_tokens_per_second,
+                        response_tokens=args.gemini_response_tokens, jitter=args.gemini_jitter)
+    with gemini:
+        results = asyncio.run(run_benchmarks(scenarios, args.requests, args.concurrency, args.warmup))
+
+    config = {name: getattr(args, name) for name in ('requests', 'concurrency', 'warmup', 'gemini_first_token_ms',
+                                                     'gemini_tokens_per_second', 'gemini_response_tokens', 'gemini_jitter')}
+    commit = git_commit()
+    report = {
+        'name': args.save or commit or 'unnamed',
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'git_commit': commit,
+        'host': {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()},
+        'config': config,
+        'results': results,
+    }
+
+    exit_code = 0
+    if args.compare:
+        with open(baseline_path(args.compare)) as f:
+            baseline = json.load(f)
+        if baseline.get('config') != config:
+            print(f"Note: the baseline was run with different settings: {baseline.get('config')}")
+        regressions = compare(results, baseline, args.max_regression)
+        if regressions:
+            print(f"{len(regressions)} metric(s) regressed by more than {args.max_regression:.0%}.")
+            exit_code = 1
+        else:
+            print("No regressions beyond the threshold.")
+
+    if args.save is not None:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = baseline_path(report['name'])
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {path}")
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
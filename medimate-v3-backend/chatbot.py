@@ -1,8 +1,17 @@
 import google.generativeai as genai
 from typing import AsyncGenerator
 import os
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
 from dotenv import load_dotenv
-import json
+from streaming import FrameCoalescer
+import tracing
+from metrics import gemini_call
+
+logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv()
@@ -10,6 +19,117 @@ load_dotenv()
 # Configure Gemini
 genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
 
+
+class _ChatSessionEntry:
+    """A single conversation held by the pool, with its bookkeeping."""
+
+    def __init__(self, chat):
+        self.chat = chat
+        self.lock = asyncio.Lock()  # serialises turns within one conversation
+        self.size = 0  # approximate bytes of text kept in the history
+        self.last_used = time.monotonic()
+
+
+class ChatSessionPool:
+    """
+    Bounded pool of per-session Gemini chats.
+
+    Sessions are kept in least-recently-used order and evicted when the pool
+    exceeds ``max_sessions``, when the total history size exceeds
+    ``max_total_bytes``, or when a session has been idle for longer than
+    ``idle_ttl`` seconds. Each session's history is also trimmed to the last
+    ``max_history_turns`` exchanges so that a single long conversation cannot
+    grow without bound.
+    """
+
+    def __init__(self, model, max_sessions: int = 1000, idle_ttl: float = 1800.0,
+                 max_total_bytes: int = 50 * 1024 * 1024, max_history_turns: int = 20):
+        self.model = model
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_total_bytes = max_total_bytes
+        self.max_history_turns = max_history_turns
+        self._sessions: "OrderedDict[str, _ChatSessionEntry]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, session_id: str) -> _ChatSessionEntry:
+        """Return the session's entry, creating it if needed, and mark it as most recently used."""
+        with self._lock:
+            self._evict_idle()
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                entry = _ChatSessionEntry(self.model.start_chat(history=[]))
+                self._sessions[session_id] = entry
+            else:
+                self._sessions.move_to_end(session_id)
+            entry.last_used = time.monotonic()
+            self._evict_over_capacity(keep=session_id)
+            return entry
+
+    def record_exchange(self, session_id: str, entry: _ChatSessionEntry):
+        """Update size accounting after a message/response pair has been added to the history."""
+        with self._lock:
+            max_messages = self.max_history_turns * 2
+            if max_messages and len(entry.chat.history) > max_messages:
+                entry.chat.history = entry.chat.history[-max_messages:]
+            new_size = self._history_size(entry.chat.history)
+            if self._sessions.get(session_id) is entry:
+                self._total_bytes += new_size - entry.size
+            entry.size = new_size
+            entry.last_used = time.monotonic()
+            self._evict_over_capacity(keep=session_id)
+
+    def discard(self, session_id: str):
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            if entry is not None:
+                self._total_bytes -= entry.size
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "total_bytes": self._total_bytes,
+                "max_sessions": self.max_sessions,
+                "max_total_bytes": self.max_total_bytes,
+            }
+
+    def _evict_idle(self):
+        cutoff = time.monotonic() - self.idle_ttl
+        # Entries are in LRU order, so the idle ones are at the front.
+        while self._sessions:
+            session_id, entry = next(iter(self._sessions.items()))
+            if entry.last_used >= cutoff:
+                break
+            self._sessions.popitem(last=False)
+            self._total_bytes -= entry.size
+
+    def _evict_over_capacity(self, keep: str):
+        while self._sessions and (len(self._sessions) > self.max_sessions
+                                  or self._total_bytes > self.max_total_bytes):
+            session_id, entry = next(iter(self._sessions.items()))
+            if session_id == keep:
+                # Never evict the session currently being served.
+                if len(self._sessions) == 1:
+                    break
+                self._sessions.move_to_end(session_id)
+                continue
+            self._sessions.popitem(last=False)
+            self._total_bytes -= entry.size
+
+    @staticmethod
+    def _history_size(history) -> int:
+        size = 0
+        for content in history:
+            for part in content.parts:
+                size += len(getattr(part, "text", "") or "")
+        return size
+
+
 class ChatBot:
     def __init__(self):
         # Initialize the model
@@ -44,12 +164,22 @@ class ChatBot:
             safety_settings=safety_settings
         )
         
-        # Initialize chat history
-        self.chat = self.model.start_chat(history=[])
-        
-    def _chunk_response(self, text: str, chunk_size: int = 4) -> list[str]:
-        """Split response into chunks of specified size."""
-        return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+        # Each session gets its own chat history, held in a bounded pool
+        self.sessions = ChatSessionPool(
+            self.model,
+            max_sessions=int(os.getenv("CHAT_MAX_SESSIONS", "1000")),
+            idle_ttl=float(os.getenv("CHAT_SESSION_TTL_SECONDS", "1800")),
+            max_total_bytes=int(os.getenv("CHAT_MAX_POOL_BYTES", str(50 * 1024 * 1024))),
+            max_history_turns=int(os.getenv("CHAT_MAX_HISTORY_TURNS", "20")),
+        )
+
+        # Streamed text is coalesced into frames of up to N bytes or M milliseconds
+        self.flush_bytes = int(os.getenv("CHAT_FLUSH_BYTES", "256"))
+        self.flush_ms = float(os.getenv("CHAT_FLUSH_MS", "50"))
+
+    def make_writer(self, sse: bool = False) -> FrameCoalescer:
+        """Create a frame writer for one streamed response."""
+        return FrameCoalescer(max_bytes=self.flush_bytes, max_delay_ms=self.flush_ms, sse=sse)
     
     def _extract_user_message(self, message: str) -> tuple[str, str]:
         """
@@ -67,50 +197,64 @@ class ChatBot:
             # If no pattern found, return empty context and the original message
             return "", message
     
-    async def get_response(self, message: str) -> AsyncGenerator[str, None]:
-        """Get streaming response from Gemini."""
-        try:
-            # Extract user health context if present
-            health_context, user_message = self._extract_user_message(message)
-            
-            # Add AI assistant context
-            ai_context = """You are a knowledgeable and empathetic wellness AI assistant. 
+    async def get_response(self, message: str, session_id: str,
+                           writer: FrameCoalescer = None) -> AsyncGenerator[str, None]:
+        """Get streaming response frames from Gemini for the given chat session."""
+        writer = writer or self.make_writer()
+        with tracing.span("chat.get_response") as span:
+            frames = writer.frames(self._stream_text(message, session_id))
+            frame_count = 0
+            try:
+                async for frame in frames:
+                    frame_count += 1
+                    yield frame
+
+                # Send completion signal
+                yield writer.frame({"text": "", "done": True})
+
+            except Exception as e:
+                logger.error(f"Error in get_response: {str(e)}", exc_info=True)
+                span.set_error(str(e))
+                yield writer.frame({"error": str(e), "done": True})
+
+            finally:
+                span.set_attribute("chat.frames", frame_count)
+                # Close the upstream stream (and release the session) if the client went away early
+                await frames.aclose()
+
+    async def _stream_text(self, message: str, session_id: str) -> AsyncGenerator[str, None]:
+        """Yield the raw text of each Gemini chunk as it arrives."""
+        session = self.sessions.get(session_id)
+
+        # Extract user health context if present
+        health_context, user_message = self._extract_user_message(message)
+        
+        # Add AI assistant context
+        ai_context = """You are a knowledgeable and empathetic wellness AI assistant. 
             You help users manage their health conditions, medications, and lifestyle choices.
             Keep responses focused on health and wellness topics.
             Be supportive but maintain professional medical boundaries.
             Always encourage users to consult healthcare providers for medical advice."""
+        
+        # Combine contexts for the model
+        if health_context:
+            context = f"{ai_context}\n\n{health_context}"
+        else:
+            context = ai_context
             
-            # Combine contexts for the model
-            if health_context:
-                context = f"{ai_context}\n\n{health_context}"
-            else:
-                context = ai_context
-                
-            # Generate response with the combined context
-            response = self.chat.send_message(
-                f"{context}\n\nUser message: {user_message}",
-                stream=True
-            )
-            
-            # Process the streaming response
-            accumulated_text = ""
-            
-            # Process each chunk in the response
-            for chunk in response:
-                if hasattr(chunk, 'text') and chunk.text:
-                    accumulated_text += chunk.text
-                    text_chunks = self._chunk_response(accumulated_text)
-                    for text_chunk in text_chunks:
-                        yield json.dumps({"text": text_chunk, "done": False}) + "\n"
-                    accumulated_text = accumulated_text[len(text_chunks) * 4:]
-            
-            # Send any remaining text
-            if accumulated_text:
-                yield json.dumps({"text": accumulated_text, "done": False}) + "\n"
-            
-            # Send completion signal
-            yield json.dumps({"text": "", "done": True}) + "\n"
-            
-        except Exception as e:
-            print(f"Error in get_response: {str(e)}")  # Debug print
-            yield json.dumps({"error": str(e), "done": True}) + "\n" 
\ No newline at end of file
+        # Generate response with the combined context. Turns within one session are
+        # serialised so concurrent requests cannot interleave their history.
+        async with session.lock:
+            with gemini_call("chat") as first_chunk:
+                response = await session.chat.send_message_async(
+                    f"{context}\n\nUser message: {user_message}",
+                    stream=True
+                )
+
+                # Pass each chunk on as it arrives
+                async for chunk in response:
+                    if hasattr(chunk, 'text') and chunk.text:
+                        first_chunk()
+                        yield chunk.text
+
+            self.sessions.record_exchange(session_id, session)
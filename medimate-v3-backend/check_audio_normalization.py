@@ -0,0 +1,102 @@
+import argparse
+import glob
+import logging
+import os
+import sys
+import time
+import numpy as np
+import parselmouth
+from audio_io import AudioNormalizer, decode_audio
+from voice_analyzer import FEATURE_NAMES, compute_voice_features
+
+# Documented tolerance: the largest relative change allowed between a feature computed on the
+# normalised audio and on the untouched full-rate recording.
+#   - Resampling sample_audio.wav to 16 kHz alone moves every feature by at most 1%.
+#   - Trimming silence shifts Praat's analysis frame grid. Jitter depends on that grid: moving the
+#     untouched recording by 2 ms alone changes it by about 5%, and trimming a padded copy changes
+#     it by up to 13%. Shimmer moves by up to about 3% for the same reason.
+#   - Intensity spread depends on how much quiet audio is kept: 0.1 s of padding around the
+#     voiced region moves stdevIntensity by about 5%.
+FEATURE_TOLERANCES = {
+    'meanF0': 0.02, 'stdevF0': 0.02, 'meanIntensity': 0.03, 'stdevIntensity': 0.10, 'HNR': 0.03,
+    'localJitter': 0.15, 'localabsoluteJitter': 0.15, 'rapJitter': 0.15, 'ppq5Jitter': 0.15,
+    'localShimmer': 0.05, 'localdbShimmer': 0.05, 'apq3Shimmer': 0.05, 'aqpq5Shimmer': 0.05, 'apq11Shimmer': 0.05,
+}
+TOLERANCES = np.array([FEATURE_TOLERANCES[name] for name in FEATURE_NAMES])
+# Features this close to zero are compared absolutely instead
+ABSOLUTE_FLOOR = 1e-4
+
+
+def variants(samples, rate, seed=0):
+    """The recording as uploaded plus the shapes phones produce: stereo, 44.1 kHz and padded with room noise."""
+    rng = np.random.default_rng(seed)
+    mono = samples.mean(axis=0)
+    yield "original", samples, rate
+    yield "stereo", np.vstack([mono, mono]), rate
+    if rate != 44100:
+        yield "44.1kHz", parselmouth.Sound(mono, sampling_frequency=rate).resample(44100).values, 44100
+    noise = rng.normal(0.0, 1e-4, int(1.5 * rate))
+    yield "padded-silence", np.concatenate([noise, mono, noise])[np.newaxis, :], rate
+
+
+def relative_error(actual, expected):
+    scale = np.maximum(np.abs(expected), ABSOLUTE_FLOOR)
+    return np.abs(actual - expected) / scale
+
+
+def check_file(path, normalizer):
+    with open(path, 'rb') as f:
+        samples, rate = decode_audio(f.read())
+
+    started = time.perf_counter()
+    expected = compute_voice_features(parselmouth.Sound(samples, sampling_frequency=rate))
+    baseline_seconds = time.perf_counter() - started
+
+    ok = True
+    for name, variant, variant_rate in variants(samples, rate):
+        started = time.perf_counter()
+        mono, analysis_rate, report = normalizer(variant, variant_rate)
+        actual = compute_voice_features(parselmouth.Sound(mono, sampling_frequency=analysis_rate))
+        seconds = time.perf_counter() - started
+
+        errors = relative_error(actual, expected)
+        worst = int(np.argmax(errors / TOLERANCES))
+        passed = bool(np.all(errors <= TOLERANCES))
+        ok = ok and passed
+        dropped = report["original_seconds"] - report["analysed_seconds"]
+        print(f"{os.path.basename(path)} [{name}]: {seconds:.3f}s (full-rate original {baseline_seconds:.3f}s), "
+              f"dropped {dropped:.2f}s, closest to its limit {FEATURE_NAMES[worst]} {errors[worst]:.2%} "
+              f"(limit {TOLERANCES[worst]:.0%}) -> {'OK' if passed else 'FAIL'}")
+        if not passed:
+            for feature, error, tolerance, a, e in zip(FEATURE_NAMES, errors, TOLERANCES, actual, expected):
+                if error > tolerance:
+                    print(f"    {feature}: {a:.6g} vs {e:.6g} ({error:.2%}, limit {tolerance:.0%})")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that audio normalisation keeps the voice features stable.")
+    parser.add_argument('paths', nargs='*', default=['sample_audio.wav'],
+                        help="WAV/m4a files or directories forming the regression corpus")
+    parser.add_argument('--rate', type=int, default=16000, help="Analysis sample rate")
+    parser.add_argument('--threshold-db', type=float, default=40.0, help="Silence threshold below the loudest frame")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    files = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '*.wav')) + glob.glob(os.path.join(path, '*.m4a'))))
+        else:
+            files.append(path)
+
+    normalizer = AudioNormalizer(target_rate=args.rate, threshold_db=args.threshold_db)
+    ok = all([check_file(path, normalizer) for path in files])
+    if not ok:
+        print("Normalisation moved at least one feature beyond its documented tolerance.")
+        sys.exit(1)
+    print(f"All features within their documented tolerances on {len(files)} file(s).")
+
+
+if __name__ == "__main__":
+    main()
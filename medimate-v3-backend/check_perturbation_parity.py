@@ -0,0 +1,106 @@
+import argparse
+import glob
+import logging
+import os
+import sys
+import time
+import numpy as np
+import parselmouth
+from parselmouth.praat import call
+from audio_io import decode_audio
+from voice_perturbation import JITTER_NAMES, SHIMMER_NAMES, perturbation_features, praat_perturbation_features
+
+FEATURE_NAMES = JITTER_NAMES + SHIMMER_NAMES
+
+# (period floor, period ceiling, max period factor, max amplitude factor): the production arguments,
+# tighter limits that reject more periods, and equal bounds, which Praat treats as "no period limits"
+ARGUMENT_SETS = [
+    (0.0001, 0.02, 1.3, 1.6),
+    (0.002, 0.01, 1.1, 1.2),
+    (0.0, 0.0, 1.3, 1.6),
+]
+
+# The engine reproduces Praat's arithmetic, so only floating-point summation order may differ
+RELATIVE_TOLERANCE = 1e-9
+ABSOLUTE_TOLERANCE = 1e-12
+
+
+def variants(samples, rate, seed=0):
+    """The recording plus versions that change the pulse and peak sequences: noise, a lower rate, stereo and a clip."""
+    rng = np.random.default_rng(seed)
+    mono = samples.mean(axis=0)
+    yield "original", parselmouth.Sound(samples, sampling_frequency=rate)
+    yield "noisy", parselmouth.Sound(mono + rng.normal(0.0, 0.02, len(mono)), sampling_frequency=rate)
+    yield "16kHz", parselmouth.Sound(mono, sampling_frequency=rate).resample(16000)
+    yield "stereo", parselmouth.Sound(np.vstack([mono, 0.3 * mono[::-1]]), sampling_frequency=rate)
+    yield "120ms clip", parselmouth.Sound(mono[len(mono) // 2:len(mono) // 2 + int(0.12 * rate)], sampling_frequency=rate)
+
+
+def best_time(function, repeats):
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    return result, min(timings)
+
+
+def check_sound(label, sound, repeats):
+    point_process = call(sound, "To PointProcess (periodic, cc)", 75, 500)
+    ok = True
+    for arguments in ARGUMENT_SETS:
+        expected = np.array(praat_perturbation_features(sound, point_process, *arguments))
+        actual = np.array(perturbation_features(sound, point_process, *arguments))
+        matches = np.isclose(actual, expected, rtol=RELATIVE_TOLERANCE, atol=ABSOLUTE_TOLERANCE, equal_nan=True)
+        if not matches.all():
+            ok = False
+            print(f"{label} {arguments}: FAIL")
+            for feature, a, e in zip(np.array(FEATURE_NAMES)[~matches], actual[~matches], expected[~matches]):
+                print(f"    {feature}: {a:.12g} vs Praat {e:.12g}")
+
+    _, praat_seconds = best_time(lambda: praat_perturbation_features(sound, point_process), repeats)
+    _, engine_seconds = best_time(lambda: perturbation_features(sound, point_process), repeats)
+    pulses = call(point_process, "Get number of points")
+    print(f"{label}: {sound.get_total_duration():.2f}s, {pulses} pulses, "
+          f"Praat {praat_seconds * 1000:.2f}ms vs engine {engine_seconds * 1000:.2f}ms "
+          f"({praat_seconds / engine_seconds:.1f}x) -> {'OK' if ok else 'FAIL'}")
+    return ok, praat_seconds, engine_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check the vectorized jitter/shimmer engine against Praat and benchmark it per recording.")
+    parser.add_argument('paths', nargs='*', default=['sample_audio.wav'],
+                        help="WAV/m4a files or directories forming the corpus")
+    parser.add_argument('--repeats', type=int, default=20, help="Timing repetitions per recording (best is reported)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    files = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '*.wav')) + glob.glob(os.path.join(path, '*.m4a'))))
+        else:
+            files.append(path)
+
+    ok = True
+    praat_total = engine_total = 0.0
+    for path in files:
+        with open(path, 'rb') as f:
+            samples, rate = decode_audio(f.read())
+        for name, sound in variants(samples, rate):
+            passed, praat_seconds, engine_seconds = check_sound(f"{os.path.basename(path)} [{name}]", sound, args.repeats)
+            ok = ok and passed
+            praat_total += praat_seconds
+            engine_total += engine_seconds
+
+    print(f"Jitter + shimmer per corpus pass: Praat {praat_total * 1000:.1f}ms, engine {engine_total * 1000:.1f}ms "
+          f"({praat_total / engine_total:.1f}x faster).")
+    if not ok:
+        print("The vectorized engine disagrees with Praat on at least one measure.")
+        sys.exit(1)
+    print(f"All {len(FEATURE_NAMES)} measures match Praat on {len(files)} file(s).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import argparse
+import os
+import sys
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+from inference_backends import NumpyMLPBackend, TFLiteBackend, ONNXBackend
+from voice_analyzer import FEATURE_NAMES
+
+# Maximum allowed difference between the Keras model and an exported backend
+PARITY_RTOL = 1e-4
+PARITY_ATOL = 1e-3
+
+
+def parity_inputs(csv_path, random_rows=256, seed=0):
+    """Rows from the training data plus random rows spanning the same per-feature range."""
+    df = pd.read_csv(csv_path)
+    X = df[FEATURE_NAMES].values.astype(np.float32)
+    rng = np.random.default_rng(seed)
+    low, high = X.min(axis=0), X.max(axis=0)
+    span = np.where(high > low, high - low, 1.0)
+    X_random = rng.uniform(low - span, high + span, size=(random_rows, X.shape[1])).astype(np.float32)
+    return np.vstack([X, X_random])
+
+
+def check_parity(name, backend, model, X):
+    """Compare a backend's predictions with the Keras model; returns True when they agree."""
+    expected = model.predict(X, verbose=0).reshape(-1)
+    actual = backend.predict(X)
+    max_diff = float(np.max(np.abs(expected - actual)))
+    ok = np.allclose(actual, expected, rtol=PARITY_RTOL, atol=PARITY_ATOL)
+    print(f"{name} parity on {len(X)} rows: max |diff| = {max_diff:.3g} -> {'OK' if ok else 'MISMATCH'}")
+    return ok
+
+
+def export_tflite(model, path):
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    with open(path, 'wb') as f:
+        f.write(converter.convert())
+    print(f"TFLite model saved to {path}")
+
+
+def export_onnx(model, path):
+    import tf2onnx
+
+    spec = (tf.TensorSpec((None, len(FEATURE_NAMES)), tf.float32, name="features"),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, output_path=path)
+    print(f"ONNX model saved to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the Keras voice glucose model for TensorFlow-free serving.")
+    parser.add_argument('--model', default='voice_glucose_model.keras', help="Keras model to export")
+    parser.add_argument('--output', default='voice_glucose_model.npz', help="NumPy weights file to write")
+    parser.add_argument('--tflite', help="Also write a .tflite model to this path")
+    parser.add_argument('--onnx', help="Also write an .onnx model to this path (requires tf2onnx)")
+    parser.add_argument('--data', default='mock_training_data.csv', help="CSV used for the parity check")
+    args = parser.parse_args()
+
+    print(f"Loading Keras model from {args.model}...")
+    model = tf.keras.models.load_model(args.model)
+    X = parity_inputs(args.data)
+
+    backend = NumpyMLPBackend.from_keras_model(model)
+    backend.save(args.output, feature_names=FEATURE_NAMES)
+    print(f"NumPy weights saved to {args.output} ({os.path.getsize(args.output)} bytes)")
+    # Check the file as it will be loaded at serving time
+    ok = check_parity("numpy", NumpyMLPBackend.from_file(args.output), model, X)
+
+    if args.tflite:
+        export_tflite(model, args.tflite)
+        # TensorFlow is already loaded here, so its bundled interpreter can stand in for the runtime
+        ok = check_parity("tflite", TFLiteBackend(args.tflite, interpreter_cls=tf.lite.Interpreter), model, X) and ok
+
+    if args.onnx:
+        export_onnx(model, args.onnx)
+        try:
+            ok = check_parity("onnx", ONNXBackend(args.onnx), model, X) and ok
+        except ImportError as e:
+            print(f"Skipping ONNX parity check: {e}")
+
+    if not ok:
+        print("Export failed the parity check; do not deploy these artifacts.")
+        sys.exit(1)
+    print("Export complete.")
+
+
+if __name__ == "__main__":
+    main()
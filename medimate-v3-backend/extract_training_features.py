@@ -0,0 +1,327 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import signal
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import pandas as pd
+
+# The column order the training script and the server's model expect
+from voice_analyzer import FEATURE_NAMES
+
+OUTPUT_COLUMNS = FEATURE_NAMES + ['glucose_level', 'source', 'sha256']
+
+AUDIO_EXTENSIONS = ('.wav', '.m4a')
+# Default label rule for directory input: the number at the end of the file name, e.g. "subject12_session3_95.wav"
+DEFAULT_LABEL_PATTERN = r'(\d+(?:\.\d+)?)$'
+
+# Normalisation defaults match the server (see main.py), so training features match what inference sees
+VOICE_ANALYSIS_RATE = int(os.getenv("VOICE_ANALYSIS_RATE", "16000"))
+VOICE_MAX_ANALYSIS_SECONDS = float(os.getenv("VOICE_MAX_ANALYSIS_SECONDS", "30"))
+VOICE_TRIM_SILENCE = os.getenv("VOICE_TRIM_SILENCE", "true").lower() in ("1", "true", "yes")
+VOICE_SILENCE_THRESHOLD_DB = float(os.getenv("VOICE_SILENCE_THRESHOLD_DB", "40"))
+VOICE_UPLOAD_MAX_SECONDS = float(os.getenv("VOICE_UPLOAD_MAX_SECONDS", "120"))
+
+
+# --- Worker side ---
+
+_normalizer = None
+_max_seconds = None
+
+
+def _init_worker(normalize: bool, max_seconds: float):
+    """Import the Praat stack once per worker and build the shared normalizer."""
+    global _normalizer, _max_seconds
+    # Leave Ctrl+C to the parent, which saves progress before exiting
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from audio_io import AudioNormalizer
+
+    _max_seconds = max_seconds
+    if normalize:
+        _normalizer = AudioNormalizer(
+            target_rate=VOICE_ANALYSIS_RATE,
+            max_seconds=VOICE_MAX_ANALYSIS_SECONDS,
+            trim_silence=VOICE_TRIM_SILENCE,
+            threshold_db=VOICE_SILENCE_THRESHOLD_DB,
+        )
+
+
+def _extract(path: str):
+    """Decode one recording in memory, normalise it as the server would and return its feature vector."""
+    from audio_io import decode_audio
+    from voice_analyzer import extract_voice_features_from_samples
+
+    with open(path, 'rb') as f:
+        samples, rate = decode_audio(f.read(), max_seconds=_max_seconds)
+    if _normalizer is not None:
+        samples, rate, _ = _normalizer(samples, rate)
+    return extract_voice_features_from_samples(samples, rate).tolist()
+
+
+# --- Inputs ---
+
+def parse_label(path: str, pattern):
+    match = pattern.search(os.path.splitext(os.path.basename(path))[0])
+    return float(match.group(1)) if match else None
+
+
+def iter_inputs(source: str, label_pattern):
+    """Yield ``(path, glucose_level)`` from a directory tree or from a manifest CSV with ``path,glucose_level``."""
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(AUDIO_EXTENSIONS):
+                    path = os.path.join(root, name)
+                    yield path, parse_label(path, label_pattern)
+        return
+
+    manifest = pd.read_csv(source)
+    if 'path' not in manifest.columns:
+        raise ValueError(f"Manifest {source} needs a 'path' column (and optionally 'glucose_level').")
+    base = os.path.dirname(os.path.abspath(source))
+    labels = manifest['glucose_level'] if 'glucose_level' in manifest.columns else [None] * len(manifest)
+    for path, label in zip(manifest['path'], labels):
+        path = path if os.path.isabs(path) else os.path.join(base, path)
+        yield path, None if label is None or pd.isna(label) else float(label)
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# --- Checkpointing and output ---
+
+class Checkpoint:
+    """
+    Append-only JSON-lines log of finished files.
+
+    Each line records a file's path, size, mtime and content hash with its
+    outcome, so a resumed run skips content it has already handled (whatever
+    the file is now called) and does not re-hash files that have not changed.
+    Successful rows are logged only after they reach the output file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done = {}      # sha256 -> "ok" | "failed"
+        self.hashes = {}    # (path, size, mtime) -> sha256
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short by an interrupted run
+                    self.done[record['sha256']] = record['status']
+                    self.hashes[(record['path'], record['size'], record['mtime'])] = record['sha256']
+        self._file = open(path, 'a')
+
+    def sha256(self, path: str) -> tuple:
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+        if key not in self.hashes:
+            self.hashes[key] = file_sha256(path)
+        return self.hashes[key], key
+
+    def record(self, key, sha256: str, status: str, error: str = None):
+        self.done[sha256] = status
+        entry = {'path': key[0], 'size': key[1], 'mtime': key[2], 'sha256': sha256, 'status': status}
+        if error:
+            entry['error'] = error
+        self._file.write(json.dumps(entry) + '\n')
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+class CSVWriter:
+    """Appends rows to one CSV file, writing the header only when the file is new."""
+
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.exists(path) and os.path.getsize(path):
+            # Drop a row left half-written by an interrupted run
+            with open(path, 'rb+') as f:
+                data = f.read()
+                if not data.endswith(b'\n'):
+                    f.truncate(data.rfind(b'\n') + 1)
+        self._header = not (os.path.exists(path) and os.path.getsize(path))
+
+    def existing_hashes(self) -> set:
+        if self._header:
+            return set()
+        return set(pd.read_csv(self.path, usecols=['sha256'])['sha256'])
+
+    def write(self, rows: list):
+        with open(self.path, 'a', newline='') as f:
+            pd.DataFrame(rows, columns=OUTPUT_COLUMNS).to_csv(f, header=self._header, index=False)
+            f.flush()
+            os.fsync(f.fileno())
+        self._header = False
+
+
+class ParquetWriter:
+    """Writes each flushed batch as a new part file in a directory that pandas reads as one table."""
+
+    def __init__(self, path: str):
+        try:
+            import pyarrow  # noqa: F401  (pandas' Parquet engine)
+        except ImportError:
+            raise SystemExit("Parquet output needs pyarrow (pip install pyarrow); use a .csv output instead.")
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._parts = len([name for name in os.listdir(path) if name.endswith('.parquet')])
+
+    def existing_hashes(self) -> set:
+        if not self._parts:
+            return set()
+        return set(pd.read_parquet(self.path, columns=['sha256'])['sha256'])
+
+    def write(self, rows: list):
+        part = os.path.join(self.path, f'part-{self._parts:05d}.parquet')
+        pd.DataFrame(rows, columns=OUTPUT_COLUMNS).to_parquet(part + '.tmp', index=False)
+        os.replace(part + '.tmp', part)
+        self._parts += 1
+
+
+# --- Driver ---
+
+def run(args):
+    label_pattern = re.compile(args.label_pattern)
+    writer = ParquetWriter(args.output) if args.output.endswith('.parquet') else CSVWriter(args.output)
+    checkpoint = Checkpoint(args.checkpoint or args.output.rstrip('/') + '.checkpoint.jsonl')
+    # Rows that reached the output before the run was interrupted count as done even if the log missed them
+    for sha256 in writer.existing_hashes():
+        checkpoint.done[sha256] = 'ok'
+
+    workers = args.workers or os.cpu_count() or 1
+    stats = {'extracted': 0, 'failed': 0, 'skipped': 0, 'duplicates': 0, 'unlabelled': 0}
+    pending_rows, pending_keys = [], []
+    last_flush = time.monotonic()
+    started = time.monotonic()
+
+    def flush_rows():
+        nonlocal last_flush
+        if pending_rows:
+            writer.write(pending_rows)
+            for key, sha256 in pending_keys:
+                checkpoint.record(key, sha256, 'ok')
+            pending_rows.clear()
+            pending_keys.clear()
+        checkpoint.flush()
+        last_flush = time.monotonic()
+
+    def jobs():
+        """Hash files lazily, so hashing overlaps with extraction instead of delaying the first job."""
+        in_run = set()
+        for path, label in iter_inputs(args.source, label_pattern):
+            if label is None and not args.allow_unlabelled:
+                stats['unlabelled'] += 1
+                continue
+            try:
+                sha256, key = checkpoint.sha256(path)
+            except OSError as e:
+                print(f"Cannot read {path}: {e}")
+                stats['failed'] += 1
+                continue
+            status = checkpoint.done.get(sha256)
+            if status == 'ok' or (status == 'failed' and not args.retry_failed):
+                stats['skipped'] += 1
+            elif sha256 in in_run:
+                stats['duplicates'] += 1
+            else:
+                in_run.add(sha256)
+                yield path, label, sha256, key
+
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                             initargs=(not args.no_normalize, args.max_seconds)) as executor:
+        queue = jobs()
+        in_flight = {}
+        exhausted = False
+        try:
+            while True:
+                # Keep a bounded number of jobs queued so memory stays flat on very large corpora
+                while not exhausted and len(in_flight) < workers * 4:
+                    job = next(queue, None)
+                    if job is None:
+                        exhausted = True
+                        break
+                    in_flight[executor.submit(_extract, job[0])] = job
+                if not in_flight:
+                    break
+
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    path, label, sha256, key = in_flight.pop(future)
+                    try:
+                        features = future.result()
+                    except Exception as e:
+                        stats['failed'] += 1
+                        checkpoint.record(key, sha256, 'failed', str(e))
+                        print(f"Failed {path}: {e}")
+                        continue
+                    stats['extracted'] += 1
+                    pending_rows.append(features + [label, path, sha256])
+                    pending_keys.append((key, sha256))
+
+                if len(pending_rows) >= args.flush_every or time.monotonic() - last_flush >= args.flush_seconds:
+                    flush_rows()
+                    done = stats['extracted'] + stats['failed']
+                    rate = done / max(time.monotonic() - started, 1e-9)
+                    print(f"{done} extracted or failed, {stats['skipped']} skipped ({rate:.1f} files/s)")
+        except KeyboardInterrupt:
+            print("Interrupted; saving progress (rerun the same command to resume).")
+            executor.shutdown(wait=False, cancel_futures=True)
+        finally:
+            flush_rows()
+            checkpoint.close()
+
+    elapsed = time.monotonic() - started
+    print(f"Done in {elapsed:.1f}s with {workers} worker(s): {stats['extracted']} extracted, {stats['failed']} failed, "
+          f"{stats['skipped']} already processed, {stats['duplicates']} duplicate(s), "
+          f"{stats['unlabelled']} without a label. Output: {args.output}")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Extract voice features from a folder or manifest of labelled recordings into a training table.")
+    parser.add_argument('source', help="Directory of WAV/m4a files, or a manifest CSV with path,glucose_level columns")
+    parser.add_argument('output', help="Output table: a .csv file, or a .parquet directory of part files")
+    parser.add_argument('--workers', type=int, default=0, help="Worker processes (default: all cores)")
+    parser.add_argument('--checkpoint', help="Progress log (default: <output>.checkpoint.jsonl)")
+    parser.add_argument('--label-pattern', default=DEFAULT_LABEL_PATTERN,
+                        help="Regex whose first group is the glucose level, searched in each file name (directory input)")
+    parser.add_argument('--allow-unlabelled', action='store_true', help="Keep files without a label (empty glucose_level)")
+    parser.add_argument('--retry-failed', action='store_true', help="Retry files that failed in an earlier run")
+    parser.add_argument('--no-normalize', action='store_true',
+                        help="Analyse recordings as they are instead of normalising them like the server does")
+    parser.add_argument('--max-seconds', type=float, default=VOICE_UPLOAD_MAX_SECONDS,
+                        help="Reject recordings longer than this, like the upload endpoint")
+    parser.add_argument('--flush-every', type=int, default=500, help="Rows buffered before writing to the output")
+    parser.add_argument('--flush-seconds', type=float, default=30.0, help="Longest time between writes to the output")
+    args = parser.parse_args()
+
+    stats = run(args)
+    if stats['extracted'] == 0 and stats['failed'] > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import asyncio
+import json
+import random
+import threading
+import time
+
+# Words the stand-in "generates"; roughly one token each
+_WORDS = ("the patient reported fatigue thirst and blurred vision which suggests checking fasting glucose "
+          "and HbA1c before attributing symptoms to stress regular follow up is recommended").split()
+
+OCR_RESULT = {
+    "Medication Name": "Metformin 500 mg",
+    "Description": "Biguanide tablet for type 2 diabetes",
+    "Dosage": "1 tablet",
+    "Frequency": "Twice daily",
+    "Time of day": "Morning and evening, with meals",
+    "Start Date": "Not specified",
+    "Duration": "30 days",
+    "Special Instructions": "Take with food",
+}
+
+
+class _Part:
+    def __init__(self, text):
+        self.text = text
+
+
+class _Content:
+    """Just enough of a Gemini Content for the chat history bookkeeping in ChatSessionPool."""
+
+    def __init__(self, role, text):
+        self.role = role
+        self.parts = [_Part(text)]
+
+
+class _Chunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class _Response:
+    """A generate_content result: iterable (sync or async) when streamed, with the joined ``text``."""
+
+    def __init__(self, gemini, chunks, on_complete=None):
+        self._gemini = gemini
+        self._chunks = chunks
+        self._on_complete = on_complete
+        self.text = "".join(chunks)
+
+    def __iter__(self):
+        for delay, chunk in zip(self._gemini.chunk_delays(self._chunks), self._chunks):
+            time.sleep(delay)
+            yield _Chunk(chunk)
+        if self._on_complete:
+            self._on_complete(self.text)
+
+    async def __aiter__(self):
+        for delay, chunk in zip(self._gemini.chunk_delays(self._chunks), self._chunks):
+            await asyncio.sleep(delay)
+            yield _Chunk(chunk)
+        if self._on_complete:
+            self._on_complete(self.text)
+
+
+class _Chat:
+    def __init__(self, gemini, history):
+        self._gemini = gemini
+        self.history = list(history or [])
+
+    async def send_message_async(self, content, stream=False):
+        self.history.append(_Content("user", str(content)))
+
+        def record(text):
+            self.history.append(_Content("model", text))
+
+        chunks = self._gemini.text_chunks()
+        if stream:
+            await asyncio.sleep(self._gemini.first_token_delay())
+            return _Response(self._gemini, chunks, on_complete=record)
+        await asyncio.sleep(self._gemini.first_token_delay() + sum(self._gemini.chunk_delays(chunks)))
+        record("".join(chunks))
+        return _Response(self._gemini, chunks)
+
+
+class _GenerativeModel:
+    def __init__(self, gemini, model_name="gemini-2.0-flash", **kwargs):
+        self._gemini = gemini
+        self.model_name = model_name
+
+    def _chunks_for(self, contents):
+        # Image prompts come from OCRScanner, which expects the medication fields as JSON
+        if isinstance(contents, list) and any(isinstance(part, dict) and "mime_type" in part for part in contents):
+            return [json.dumps(OCR_RESULT)]
+        return self._gemini.text_chunks()
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        self._gemini.calls += 1
+        chunks = self._chunks_for(contents)
+        time.sleep(self._gemini.first_token_delay())
+        if not stream:
+            time.sleep(sum(self._gemini.chunk_delays(chunks)))
+        return _Response(self._gemini, chunks)
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        self._gemini.calls += 1
+        chunks = self._chunks_for(contents)
+        await asyncio.sleep(self._gemini.first_token_delay())
+        if not stream:
+            await asyncio.sleep(sum(self._gemini.chunk_delays(chunks)))
+        return _Response(self._gemini, chunks)
+
+    def start_chat(self, history=None):
+        return _Chat(self._gemini, history)
+
+
+class FakeGemini:
+    """
+    Offline stand-in for ``google.generativeai`` with configurable latency, for benchmarks.
+
+    ``install()`` replaces ``genai.configure`` and ``genai.GenerativeModel``, which OCRScanner,
+    ChatBot and TranscriptionAgent look up when they are constructed, so the services run
+    unchanged against it. Every call waits ``first_token_ms`` (± ``jitter``) before the first
+    chunk; the ``response_tokens`` words of a text answer then stream at ``tokens_per_second``
+    in chunks of ``chunk_tokens``. OCR prompts get a fixed medication label as JSON.
+    """
+
+    def __init__(self, first_token_ms: float = 400.0, tokens_per_second: float = 100.0, response_tokens: int = 150,
+                 chunk_tokens: int = 10, jitter: float = 0.2, seed: int = 0):
+        self.first_token_ms = first_token_ms
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.chunk_tokens = chunk_tokens
+        self.jitter = jitter
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._restore = None
+
+    def _scaled(self, seconds):
+        with self._random_lock:
+            return seconds * (1.0 + self.jitter * (2.0 * self._random.random() - 1.0))
+
+    def first_token_delay(self):
+        return self._scaled(self.first_token_ms / 1000.0)
+
+    def chunk_delays(self, chunks):
+        if self.tokens_per_second <= 0:
+            return [0.0] * len(chunks)
+        return [self._scaled(len(chunk.split()) / self.tokens_per_second) for chunk in chunks]
+
+    def text_chunks(self):
+        words = [_WORDS[i % len(_WORDS)] for i in range(self.response_tokens)]
+        return [" ".join(words[i:i + self.chunk_tokens]) + " " for i in range(0, len(words), self.chunk_tokens)]
+
+    def install(self):
+        """Patch google.generativeai to use this stand-in until ``uninstall()``."""
+        import google.generativeai as genai
+
+        if self._restore is None:
+            self._restore = (genai.configure, genai.GenerativeModel)
+            genai.configure = lambda *args, **kwargs: None
+            genai.GenerativeModel = lambda *args, **kwargs: _GenerativeModel(self, *args, **kwargs)
+        return self
+
+    def uninstall(self):
+        import google.generativeai as genai
+
+        if self._restore is not None:
+            genai.configure, genai.GenerativeModel = self._restore
+            self._restore = None
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, *exc_info):
+        self.uninstall()
@@ -0,0 +1,212 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ExtractionTimeout(Exception):
+    """Raised when a feature extraction job exceeds its time budget."""
+
+
+_deadline_hit = False
+
+
+def _raise_timeout(signum, frame):
+    global _deadline_hit
+    _deadline_hit = True
+    raise ExtractionTimeout("Feature extraction exceeded its time budget")
+
+
+def _init_worker(sample_path: Optional[str]):
+    """Import parselmouth and optionally analyse a sample file so the first real job starts warm."""
+    # Leave Ctrl+C handling to the parent, which shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    import voice_analyzer
+
+    if sample_path and os.path.exists(sample_path):
+        try:
+            voice_analyzer.extract_voice_features(sample_path)
+        except Exception:
+            pass
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _run_job(source, timeout: Optional[float], normalizer=None):
+    """
+    Worker entry point: extract features from a WAV path or a (samples, sample_rate) pair under a SIGALRM deadline.
+    Decoded samples go through ``normalizer`` first when one is given, and come back as ``(features, report)``;
+    ``report["stage_seconds"]`` holds the time spent in normalisation and each extraction stage, which run back
+    to back from ``report["started_at_ns"]`` (wall clock).
+    """
+    global _deadline_hit
+    from voice_analyzer import extract_voice_features, extract_voice_features_from_samples
+
+    # The alarm fires between Praat calls, so a stuck job frees its worker shortly after the deadline
+    use_alarm = timeout is not None and hasattr(signal, "setitimer")
+    _deadline_hit = False
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        if isinstance(source, str):
+            return extract_voice_features(source)
+        samples, sample_rate = source
+        started_at_ns = time.time_ns()
+        report = {}
+        timings = {}
+        if normalizer is not None:
+            started = time.perf_counter()
+            samples, sample_rate, report = normalizer(samples, sample_rate)
+            timings["normalize"] = time.perf_counter() - started
+        features = extract_voice_features_from_samples(samples, sample_rate, timings=timings)
+        return features, dict(report, stage_seconds=timings, started_at_ns=started_at_ns)
+    except Exception:
+        # extract_voice_features wraps errors, so report a deadline hit as a timeout explicitly
+        if _deadline_hit:
+            raise ExtractionTimeout(f"Feature extraction exceeded {timeout}s") from None
+        raise
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+class FeatureExtractionPool:
+    """
+    Runs Praat feature extraction in a pool of worker processes.
+
+    Extraction is CPU-bound and holds the GIL, so running it in-process stalls
+    every other request on the event loop. Jobs are submitted to a
+    ``ProcessPoolExecutor`` whose workers are spawned (and pre-warmed) by
+    ``start()``. ``extract()`` waits for at most ``timeout`` seconds; a job
+    that is cancelled or times out while still queued never runs, and a
+    running job is interrupted in its worker by the same deadline. A pool
+    whose worker died is rebuilt on the next submission.
+
+    With ``workers=0`` extraction runs in a thread instead (useful where
+    processes cannot be spawned).
+    """
+
+    def __init__(self, workers: int = 2, timeout: Optional[float] = 60.0, sample_path: Optional[str] = None,
+                 normalizer=None):
+        self.workers = workers
+        self.timeout = timeout
+        self.sample_path = sample_path
+        self.normalizer = normalizer
+        self._executor = None
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.in_flight = 0
+        self.restarts = 0
+        self.seconds_received = 0.0
+        self.seconds_analysed = 0.0
+
+    def start(self):
+        """Spawn and warm up every worker process."""
+        if self.workers <= 0:
+            return
+        executor = self._get_executor()
+        # One ping per worker forces the executor to spawn all of them now rather than on demand
+        pids = {future.result() for future in [executor.submit(_ping) for _ in range(self.workers)]}
+        logger.info(f"Feature extraction pool ready with {len(pids)} worker process(es).")
+
+    async def extract(self, voice_wav_path: str):
+        """Extract the voice features of a WAV file without blocking the event loop."""
+        return await self._extract(voice_wav_path)
+
+    async def extract_samples(self, samples, sample_rate: int):
+        """
+        Extract the voice features of decoded audio; the samples are pickled to the worker, never written to disk.
+        Returns ``(features, report)`` where the report describes what normalisation dropped (nothing without a
+        normalizer) and, under ``stage_seconds``, how long each extraction stage took.
+        """
+        features, report = await self._extract((samples, sample_rate))
+        if "original_seconds" in report:
+            self.seconds_received += report["original_seconds"]
+            self.seconds_analysed += report["analysed_seconds"]
+        return features, report
+
+    async def _extract(self, source):
+        self.submitted += 1
+        self.in_flight += 1
+        try:
+            if self.workers <= 0:
+                job = asyncio.ensure_future(asyncio.to_thread(_run_job, source, None, self.normalizer))
+            else:
+                job = self._submit(source)
+            # Cancelling the wrapped future (timeout or client gone) also cancels the job if it is still queued
+            features = await asyncio.wait_for(job, self.timeout)
+        except (asyncio.TimeoutError, ExtractionTimeout) as e:
+            self.timeouts += 1
+            raise ExtractionTimeout(f"Feature extraction timed out after {self.timeout}s") from e
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+        self.completed += 1
+        return features
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "timeout_seconds": self.timeout,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "cancelled": self.cancelled,
+            "in_flight": self.in_flight,
+            "restarts": self.restarts,
+            "audio_seconds_received": round(self.seconds_received, 3),
+            "audio_seconds_analysed": round(self.seconds_analysed, 3),
+        }
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn rather than fork: the parent may already hold TensorFlow and gRPC threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.sample_path,),
+                )
+            return self._executor
+
+    def _submit(self, source) -> asyncio.Future:
+        executor = self._get_executor()
+        try:
+            future = executor.submit(_run_job, source, self.timeout, self.normalizer)
+        except BrokenProcessPool:
+            logger.warning("Feature extraction pool is broken (a worker died); restarting it.")
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+            self.restarts += 1
+            future = self._get_executor().submit(_run_job, source, self.timeout, self.normalizer)
+        return asyncio.wrap_future(future)
@@ -2,22 +2,75 @@
 # pip install google-generativeai python-dotenv
 
 import os
+import asyncio
 import base64
 import logging
+import datetime
+import threading
 import google.generativeai as genai
+from google.generativeai.types import content_types
 from dotenv import load_dotenv
+import tracing
+from metrics import gemini_call
 
-# Setup logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
-logger.info("--- Logger initialized successfully ---") # Add this line
 
 # Load environment variables from .env file
 load_dotenv()
 
 
-def generate(input_text):
-    try:
+# System instruction has to be included in the content for Gemini API
+SYSTEM_INSTRUCTION = """🔧 System Prompt: AI Transcriber Agent (Experienced Medical Doctor)
+    You are an experienced and observant medical doctor trained in internal medicine and primary care. You are given a transcription of a conversation between a patient and a doctor. Your job is to:
+
+    Identify hidden symptoms or risks shared by the patient that the doctor might have overlooked or not explored in detail.
+
+    Suggest better or more suitable treatment alternatives, especially if the doctor's recommendation seems incomplete or inappropriate.
+
+    Flag possible misdiagnoses, missed connections, or poor clinical decisions.
+
+    Assume the transcription might not label the speaker clearly, or may even mix up speaker roles. Use your understanding of the context and phrasing to infer who is the patient and who is the doctor.
+
+    Prioritize concise, context-aware analysis — clarity over verbosity.
+
+    Act as a supportive second opinion system, not a replacement for the doctor. Your role is to assist in improving patient outcomes through intelligent observation.
+
+    🎯 Output Format (Example):
+    Patient: Mentioned ongoing fatigue, increased thirst, and blurry vision — subtle signs of potential undiagnosed diabetes. Also expressed concern about frequent urination, but this was not followed up.
+
+    Doctor: Focused primarily on sleep quality and prescribed vitamins. Missed key pattern suggestive of Type 2 Diabetes. A simple blood glucose test could have been suggested. Opportunity for earlier diagnosis lost.
+
+    📝 Note: Keep responses concise but meaningful. Avoid generic suggestions. Understand context deeply and infer speaker roles accurately for high-impact analysis."""
+
+ACKNOWLEDGEMENT = "I understand my role as an experienced medical doctor providing analysis of patient-doctor conversations. I'll identify overlooked symptoms, suggest better treatments, and flag possible misdiagnoses in a concise, meaningful way."
+
+EXAMPLE_CASE = """Example case:
+    Patient:
+    "Yeah, I've been really tired lately… like exhausted all the time. I've also lost about 5 kilos in the past month but I didn't change my diet or anything. Oh, and I've been drinking a lot more water than usual — always thirsty."
+
+    Doctor:
+    "Sounds like stress. Maybe take a break, get some rest, and I'll prescribe you some supplements for energy. Let's monitor for now.\""""
+
+EXAMPLE_ANALYSIS = """Analysis:
+    Patient: Reported persistent fatigue, unexplained weight loss, and increased thirst. These are classic symptoms that warrant further investigation.
+
+    Doctor: Attributed symptoms to stress and prescribed supplements without further investigation.
+
+    Recommendation: The constellation of symptoms suggests possible diabetes (Type 1 or Type 2) or hyperthyroidism. A basic metabolic panel including glucose and thyroid function tests should be considered before attributing the symptoms to stress and prescribing supplements."""
+
+
+class TranscriptionAgent:
+    """
+    Long-lived Gemini agent for transcription analysis.
+
+    The model, its safety settings and the fixed prompt prefix (instruction,
+    acknowledgement and the few-shot example turns) are built once. Each call
+    only appends the new transcript. When GEMINI_CONTEXT_CACHE is enabled and
+    the installed client supports it, the prefix is uploaded once as cached
+    content so it is not billed and processed on every call.
+    """
+
+    def __init__(self, model_name: str = "gemini-2.0-flash"):
         # Get API key from environment variables
         api_key = os.getenv("GEMINI_API_KEY")
         if not api_key:
@@ -27,13 +80,12 @@ def generate(input_text):
         genai.configure(api_key=api_key)
 
         # Set up the model with system instructions
-        generation_config = {
+        self.generation_config = {
             "temperature": 0.1,
             "max_output_tokens": 1024,
         }
 
-        # System instructions - must be passed as part of the model configuration
-        safety_settings = [
+        self.safety_settings = [
             {
                 "category": "HARM_CATEGORY_HARASSMENT",
                 "threshold": "BLOCK_MEDIUM_AND_ABOVE",
@@ -52,131 +104,232 @@ def generate(input_text):
             },
         ]
 
-        model = genai.GenerativeModel(
-            model_name="gemini-2.0-flash",
-            generation_config=generation_config,
-            safety_settings=safety_settings,
+        self.model = genai.GenerativeModel(
+            model_name=model_name,
+            generation_config=self.generation_config,
+            safety_settings=self.safety_settings,
         )
 
-        # System instruction has to be included in the content for Gemini API
-        system_instruction = """🔧 System Prompt: AI Transcriber Agent (Experienced Medical Doctor)
-    You are an experienced and observant medical doctor trained in internal medicine and primary care. You are given a transcription of a conversation between a patient and a doctor. Your job is to:
-
-    Identify hidden symptoms or risks shared by the patient that the doctor might have overlooked or not explored in detail.
-
-    Suggest better or more suitable treatment alternatives, especially if the doctor's recommendation seems incomplete or inappropriate.
-
-    Flag possible misdiagnoses, missed connections, or poor clinical decisions.
-
-    Assume the transcription might not label the speaker clearly, or may even mix up speaker roles. Use your understanding of the context and phrasing to infer who is the patient and who is the doctor.
-
-    Prioritize concise, context-aware analysis — clarity over verbosity.
-
-    Act as a supportive second opinion system, not a replacement for the doctor. Your role is to assist in improving patient outcomes through intelligent observation.
-
-    🎯 Output Format (Example):
-    Patient: Mentioned ongoing fatigue, increased thirst, and blurry vision — subtle signs of potential undiagnosed diabetes. Also expressed concern about frequent urination, but this was not followed up.
-
-    Doctor: Focused primarily on sleep quality and prescribed vitamins. Missed key pattern suggestive of Type 2 Diabetes. A simple blood glucose test could have been suggested. Opportunity for earlier diagnosis lost.
-
-    📝 Note: Keep responses concise but meaningful. Avoid generic suggestions. Understand context deeply and infer speaker roles accurately for high-impact analysis."""
+        # Fixed prompt prefix, converted to Content objects once
+        self.prefix = content_types.to_contents([
+            {"role": "user", "parts": [{"text": SYSTEM_INSTRUCTION}]},
+            {"role": "model", "parts": [{"text": ACKNOWLEDGEMENT}]},
+            {"role": "user", "parts": [{"text": EXAMPLE_CASE}]},
+            {"role": "model", "parts": [{"text": EXAMPLE_ANALYSIS}]},
+        ])
+
+        # Optional upstream context caching of the prefix
+        self.cache_enabled = os.getenv("GEMINI_CONTEXT_CACHE", "").lower() in ("1", "true", "yes")
+        self.cache_model_name = os.getenv("GEMINI_CACHE_MODEL", "models/gemini-2.0-flash-001")
+        self.cache_ttl = datetime.timedelta(seconds=int(os.getenv("GEMINI_CACHE_TTL_SECONDS", "3600")))
+        self._cached_model = None
+        self._cache_expires_at = None
+        self._cache_lock = threading.Lock()
+        self._async_cache_lock = asyncio.Lock()
+        self._cache_unavailable = False
+        self._cache_retry_at = None
+
+    def _request(self, input_text, cached_model=None):
+        """Return the model to call and the contents for one transcript."""
+        new_turn = {
+            "role": "user",
+            "parts": [{"text": f"Now please analyze this new conversation:\n    {input_text}"}],
+        }
+        tracing.current_span().set_attribute("gemini.cached_prefix", cached_model is not None)
+        if cached_model is not None:
+            return cached_model, [new_turn]
+        return self.model, self.prefix + content_types.to_contents([new_turn])
+
+    def _cache_due(self, now) -> bool:
+        """Whether the upstream cache has to be (re)created before the next call."""
+        if not self.cache_enabled or self._cache_unavailable:
+            return False
+        if self._cache_retry_at is not None and now < self._cache_retry_at:
+            return False
+        return self._cached_model is None or now >= self._cache_expires_at
+
+    def _get_cached_model(self):
+        """
+        Return a model bound to the cached prefix, (re)creating the cache when it is about to expire.
+        Creating it is a blocking network call; the async path runs this in a worker thread.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if self._cache_due(now):
+            with self._cache_lock:
+                if self._cache_due(now):
+                    self._create_cached_model(now)
+        return self._cached_model
+
+    async def _get_cached_model_async(self):
+        """_get_cached_model without blocking the event loop; concurrent callers wait for one refresh."""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if self._cache_due(now):
+            async with self._async_cache_lock:
+                if self._cache_due(now):
+                    await asyncio.to_thread(self._get_cached_model)
+        return self._cached_model
+
+    def _create_cached_model(self, now):
+        caching = getattr(genai, "caching", None)
+        if caching is None:
+            logger.warning("Gemini Agent: Context caching is not supported by the installed google-generativeai; sending the full prompt.")
+            self._cache_unavailable = True
+            return
+        try:
+            cached = caching.CachedContent.create(
+                model=self.cache_model_name,
+                display_name="medimate-transcription-prefix",
+                contents=self.prefix,
+                ttl=self.cache_ttl,
+            )
+            self._cached_model = genai.GenerativeModel.from_cached_content(
+                cached,
+                generation_config=self.generation_config,
+                safety_settings=self.safety_settings,
+            )
+            # Refresh a minute early so calls never race the upstream expiry
+            self._cache_expires_at = now + self.cache_ttl - datetime.timedelta(seconds=60)
+            logger.info(f"Gemini Agent: Prompt prefix cached upstream as {cached.name}.")
+        except Exception as cache_err:
+            # e.g. the prefix is below the model's minimum cacheable token count
+            logger.warning(f"Gemini Agent: Context caching unavailable, sending the full prompt: {cache_err}")
+            self._cached_model = None
+            self._cache_retry_at = now + datetime.timedelta(minutes=10)
+
+    def generate(self, input_text):
+        with tracing.span("transcription.generate"):
+            try:
+                with tracing.span("transcription.prepare_request"):
+                    model, content = self._request(input_text, self._get_cached_model())
+                logger.debug("Gemini Agent: Content prepared. Calling generate_content...")
+
+                # Generate content with streaming
+                with gemini_call("transcription") as first_chunk:
+                    response = model.generate_content(
+                        content,
+                        stream=True,
+                    )
+                    logger.debug("Gemini Agent: Stream initiated.")
+
+                    response_text = ""
+                    chunk_count = 0
+                    try:
+                        for chunk in response:
+                            chunk_count += 1
+                            chunk_text = _chunk_text(chunk, chunk_count)
+                            # Append only if text was successfully retrieved
+                            if chunk_text is not None:
+                                first_chunk()
+                                response_text += chunk_text
+
+                    except Exception as stream_err: # Catch errors during the overall streaming process
+                        logger.error(f"Gemini Agent: Error during stream processing loop (outside chunk access): {stream_err}", exc_info=True)
+                        logger.error(f"Gemini Agent: Last successful text: '{response_text}'")
+                        raise # Re-raise the error
+
+                _log_stream_finished(response_text, chunk_count)
+                return response_text
+
+            except Exception as e:
+                logger.error(f"Error in generate function: {str(e)}", exc_info=True)
+                tracing.current_span().set_error(str(e))
+                return f"Error: {str(e)}"
+
+    async def generate_async(self, input_text):
+        """
+        Async variant of generate using the native async Gemini client, so the
+        stream is consumed without blocking the event loop.
+        """
+        with tracing.span("transcription.generate"):
+            try:
+                with tracing.span("transcription.prepare_request"):
+                    model, content = self._request(input_text, await self._get_cached_model_async())
+                logger.debug("Gemini Agent: Content prepared. Calling generate_content_async...")
+
+                with gemini_call("transcription") as first_chunk:
+                    response = await model.generate_content_async(
+                        content,
+                        stream=True,
+                    )
+                    logger.debug("Gemini Agent: Stream initiated.")
+
+                    response_text = ""
+                    chunk_count = 0
+                    try:
+                        async for chunk in response:
+                            chunk_count += 1
+                            chunk_text = _chunk_text(chunk, chunk_count)
+                            if chunk_text is not None:
+                                first_chunk()
+                                response_text += chunk_text
+
+                    except Exception as stream_err:
+                        logger.error(f"Gemini Agent: Error during stream processing loop (outside chunk access): {stream_err}", exc_info=True)
+                        logger.error(f"Gemini Agent: Last successful text: '{response_text}'")
+                        raise
+
+                _log_stream_finished(response_text, chunk_count)
+                return response_text
+
+            except Exception as e:
+                logger.error(f"Error in generate_async function: {str(e)}", exc_info=True)
+                tracing.current_span().set_error(str(e))
+                return f"Error: {str(e)}"
+
+
+def _chunk_text(chunk, chunk_count):
+    """Return the text carried by a streamed chunk, or None if it has no usable text."""
+    try:
+        # Check if the attribute exists AND try to access it safely
+        if hasattr(chunk, "text"):
+            return chunk.text # This is where the internal IndexError occurs
+        logger.warning(f"Gemini Agent: Chunk {chunk_count} received without 'text' attribute: {type(chunk)}")
+    except IndexError as ie:
+        # Specifically catch the IndexError identified from the traceback
+        logger.warning(f"Gemini Agent: IndexError accessing chunk.text at chunk {chunk_count}. Likely an empty 'parts' list internally. Skipping chunk. Details: {ie}", exc_info=False) # Log as warning, don't need full traceback
+    except Exception as access_err:
+        # Catch any other unexpected error during text access
+        logger.warning(f"Gemini Agent: Error accessing text from chunk {chunk_count}: {access_err}", exc_info=True)
+    return None
 
-        # Create content parts with system instruction first
-        content = [
-            {"role": "user", "parts": [{"text": system_instruction}]},
-            {
-                "role": "model",
-                "parts": [
-                    {
-                        "text": "I understand my role as an experienced medical doctor providing analysis of patient-doctor conversations. I'll identify overlooked symptoms, suggest better treatments, and flag possible misdiagnoses in a concise, meaningful way."
-                    }
-                ],
-            },
-            {
-                "role": "user",
-                "parts": [
-                    {
-                        "text": f"""Example case:
-    Patient:
-    "Yeah, I've been really tired lately… like exhausted all the time. I've also lost about 5 kilos in the past month but I didn't change my diet or anything. Oh, and I've been drinking a lot more water than usual — always thirsty."
 
-    Doctor:
-    "Sounds like stress. Maybe take a break, get some rest, and I'll prescribe you some supplements for energy. Let's monitor for now."
+def _log_stream_finished(response_text, chunk_count):
+    logger.info("Gemini Agent: Stream finished", extra={"chunks": chunk_count, "response_length": len(response_text)})
+    # Ensure some text was generated, otherwise it might indicate a persistent issue
+    if not response_text and chunk_count > 0:
+         logger.warning("Gemini Agent: Stream finished, but no text content was extracted from chunks.")
+    elif chunk_count == 0:
+         logger.warning("Gemini Agent: Stream finished immediately with zero chunks.")
 
-    Analysis:
-    Patient: Reported persistent fatigue, unexplained weight loss, and increased thirst. These are classic symptoms that warrant further investigation.
 
-    Doctor: Attributed symptoms to stress and prescribed supplements without further investigation.
+_default_agent = None
 
-    Recommendation: The constellation of symptoms suggests possible diabetes (Type 1 or Type 2) or hyperthyroidism. A basic metabolic panel including glucose and thyroid function tests should be considered before attributing the symptoms to stress and prescribing supplements.
 
-    Now please analyze this new conversation:
-    {input_text}"""
-                    }
-                ],
-            },
-        ]
+def _get_default_agent():
+    global _default_agent
+    if _default_agent is None:
+        _default_agent = TranscriptionAgent()
+    return _default_agent
 
-        logger.info("Gemini Agent: Content prepared. Calling generate_content...")
 
-        # Generate content with streaming
-        response = model.generate_content(
-            content,
-            stream=True,
-        )
-        logger.info("Gemini Agent: Stream initiated.")
+def generate(input_text):
+    """Analyze a transcription with the shared module-level agent."""
+    try:
+        agent = _get_default_agent()
+    except Exception as e:
+        logger.error(f"Error in generate function: {str(e)}", exc_info=True)
+        return f"Error: {str(e)}"
+    return agent.generate(input_text)
 
-        response_text = ""
-        chunk_count = 0
-        # Add more detailed logging and error handling around the loop
-        try:
-            for chunk in response:
-                chunk_count += 1
-                chunk_text = None # Initialize chunk_text for this iteration
-                try:
-                    # Check if the attribute exists AND try to access it safely
-                    if hasattr(chunk, "text"):
-                        chunk_text = chunk.text # This is where the internal IndexError occurs
-                    else:
-                         logger.warning(f"Gemini Agent: Chunk {chunk_count} received without 'text' attribute: {type(chunk)}")
-
-                    # Append only if text was successfully retrieved
-                    if chunk_text is not None:
-                        response_text += chunk_text
-                        # logger.debug(f"Gemini Agent: Appended text: '{chunk_text}'") # Optional: Log appended text
-
-                except IndexError as ie:
-                    # Specifically catch the IndexError identified from the traceback
-                    logger.warning(f"Gemini Agent: IndexError accessing chunk.text at chunk {chunk_count}. Likely an empty 'parts' list internally. Skipping chunk. Details: {ie}", exc_info=False) # Log as warning, don't need full traceback
-                    # Optionally log the chunk type or content if helpful and safe
-                    # logger.warning(f"Gemini Agent: Problematic chunk type: {type(chunk)}")
-                    continue # Skip to the next chunk
-                except Exception as access_err:
-                    # Catch any other unexpected error during text access
-                    logger.warning(f"Gemini Agent: Error accessing text from chunk {chunk_count}: {access_err}", exc_info=True)
-                    continue # Skip to the next chunk
-
-
-        except Exception as stream_err: # Catch errors during the overall streaming process
-            logger.error(f"Gemini Agent: Error during stream processing loop (outside chunk access): {stream_err}", exc_info=True)
-            logger.error(f"Gemini Agent: Last successful text: '{response_text}'")
-            raise # Re-raise the error
-
-        logger.info(f"Gemini Agent: Stream finished after {chunk_count} chunks. Full response length: {len(response_text)}")
-        # Ensure some text was generated, otherwise it might indicate a persistent issue
-        if not response_text and chunk_count > 0:
-             logger.warning("Gemini Agent: Stream finished, but no text content was extracted from chunks.")
-        elif chunk_count == 0:
-             logger.warning("Gemini Agent: Stream finished immediately with zero chunks.")
-
-        return response_text
 
+async def generate_async(input_text):
+    """Async variant of generate using the shared module-level agent."""
+    try:
+        agent = _get_default_agent()
     except Exception as e:
-        print(f"\n\nError in generate function: {str(e)}")
-        import traceback
-
-        traceback.print_exc()
+        logger.error(f"Error in generate_async function: {str(e)}", exc_info=True)
         return f"Error: {str(e)}"
+    return await agent.generate_async(input_text)
 
 
 # Test function to run the agent with sample input
@@ -191,4 +344,5 @@ Doctor: "Hmm, probably muscular. You might’ve pulled something. Just take some
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     test_agent()
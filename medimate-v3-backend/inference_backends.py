@@ -0,0 +1,183 @@
+"""
+Inference backends for the voice glucose model.
+
+Every backend exposes ``predict(features_matrix) -> np.ndarray`` returning one
+raw prediction per row, and a ``fingerprint`` string identifying the weights
+it serves. Only the Keras backend needs TensorFlow; the NumPy
+backend runs the exported dense weights directly, and the TFLite and ONNX
+backends use their standalone runtimes when those are installed.
+"""
+import hashlib
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("keras", "numpy", "tflite", "onnx")
+
+def _digest_arrays(arrays):
+    digest = hashlib.sha256()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(str(array.shape).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()[:16]
+
+
+def _digest_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+_ACTIVATIONS = {
+    "linear": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0.0),
+    "sigmoid": lambda x: 1.0 / (1.0 + np.exp(-x)),
+    "tanh": np.tanh,
+}
+
+
+class KerasBackend:
+    """Runs a Keras model in-process (requires TensorFlow)."""
+
+    name = "keras"
+
+    def __init__(self, model):
+        self.model = model
+        self.fingerprint = _digest_arrays(model.get_weights())
+
+    def predict(self, features_matrix):
+        features_matrix = np.asarray(features_matrix, dtype=np.float32)
+        rows = features_matrix.shape[0]
+        # Pad to a power-of-two row count so the graph is only traced for a handful of batch shapes
+        padded_rows = 1 << (rows - 1).bit_length()
+        if padded_rows != rows:
+            padding = np.zeros((padded_rows - rows, features_matrix.shape[1]), dtype=np.float32)
+            features_matrix = np.vstack([features_matrix, padding])
+
+        # predict_on_batch skips the data-adapter setup that predict() pays on every call
+        return np.asarray(self.model.predict_on_batch(features_matrix)).reshape(-1)[:rows]
+
+
+class NumpyMLPBackend:
+    """Pure NumPy forward pass over exported dense-layer weights."""
+
+    name = "numpy"
+
+    def __init__(self, weights, biases, activations):
+        self.weights = [np.asarray(w, dtype=np.float32) for w in weights]
+        self.biases = [np.asarray(b, dtype=np.float32) for b in biases]
+        self.activations = list(activations)
+        unknown = [a for a in self.activations if a not in _ACTIVATIONS]
+        if unknown:
+            raise ValueError(f"Unsupported activation(s) in exported model: {unknown}")
+        # Same weights give the same fingerprint as the Keras model they were exported from
+        self.fingerprint = _digest_arrays([a for pair in zip(self.weights, self.biases) for a in pair])
+
+    @classmethod
+    def from_file(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            layers = int(data["num_layers"])
+            weights = [data[f"weights_{i}"] for i in range(layers)]
+            biases = [data[f"bias_{i}"] for i in range(layers)]
+            activations = [str(a) for a in data["activations"]]
+        return cls(weights, biases, activations)
+
+    @classmethod
+    def from_keras_model(cls, model):
+        """Collect the Dense layers of a Sequential model; Dropout is a no-op at inference time."""
+        weights, biases, activations = [], [], []
+        for layer in model.layers:
+            kind = layer.__class__.__name__
+            if kind == "Dense":
+                kernel, bias = layer.get_weights()
+                weights.append(kernel)
+                biases.append(bias)
+                activations.append(layer.activation.__name__)
+            elif kind not in ("Dropout", "InputLayer"):
+                raise ValueError(f"Cannot export layer type '{kind}' to the NumPy backend")
+        return cls(weights, biases, activations)
+
+    def save(self, path, feature_names=None):
+        arrays = {"num_layers": np.array(len(self.weights)), "activations": np.array(self.activations)}
+        for i, (w, b) in enumerate(zip(self.weights, self.biases)):
+            arrays[f"weights_{i}"] = w
+            arrays[f"bias_{i}"] = b
+        if feature_names is not None:
+            arrays["feature_names"] = np.array(feature_names)
+        np.savez(path, **arrays)
+
+    def predict(self, features_matrix):
+        x = np.asarray(features_matrix, dtype=np.float32)
+        for w, b, activation in zip(self.weights, self.biases, self.activations):
+            x = _ACTIVATIONS[activation](x @ w + b)
+        return x.reshape(-1)
+
+
+class TFLiteBackend:
+    """Runs a .tflite export with the standalone TFLite runtime."""
+
+    name = "tflite"
+
+    def __init__(self, path, interpreter_cls=None):
+        Interpreter = interpreter_cls
+        if Interpreter is None:
+            try:
+                from tflite_runtime.interpreter import Interpreter
+            except ImportError:
+                try:
+                    from ai_edge_litert.interpreter import Interpreter
+                except ImportError as e:
+                    raise ImportError("The tflite backend needs 'tflite-runtime' or 'ai-edge-litert' installed") from e
+        self.interpreter = Interpreter(model_path=path)
+        self.fingerprint = _digest_file(path)
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._rows = None
+
+    def predict(self, features_matrix):
+        x = np.asarray(features_matrix, dtype=np.float32)
+        if x.shape[0] != self._rows:
+            self.interpreter.resize_tensor_input(self._input["index"], x.shape)
+            self.interpreter.allocate_tensors()
+            self._rows = x.shape[0]
+        self.interpreter.set_tensor(self._input["index"], x)
+        self.interpreter.invoke()
+        return np.array(self.interpreter.get_tensor(self._output["index"])).reshape(-1)
+
+
+class ONNXBackend:
+    """Runs an .onnx export with ONNX Runtime."""
+
+    name = "onnx"
+
+    def __init__(self, path):
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise ImportError("The onnx backend needs 'onnxruntime' installed") from e
+        self.session = onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"])
+        self.fingerprint = _digest_file(path)
+        self._input_name = self.session.get_inputs()[0].name
+
+    def predict(self, features_matrix):
+        x = np.asarray(features_matrix, dtype=np.float32)
+        return np.asarray(self.session.run(None, {self._input_name: x})[0]).reshape(-1)
+
+
+def load_backend(name, path):
+    """Load a non-Keras backend from its exported artifact."""
+    if name not in BACKENDS or name == "keras":
+        raise ValueError(f"Unknown exported backend '{name}'. Choose from {BACKENDS[1:]}")
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No exported model for the '{name}' backend at {path}. Run export_voice_model.py first.")
+    if name == "numpy":
+        return NumpyMLPBackend.from_file(path)
+    if name == "tflite":
+        return TFLiteBackend(path)
+    return ONNXBackend(path)
@@ -1,43 +1,240 @@
+import hashlib
+import hmac
+import io
 import os
-import shutil
+from contextlib import asynccontextmanager, contextmanager
 from fastapi import FastAPI, HTTPException, UploadFile, File, Request # Added Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 import uuid
-from OCRScanner import OCRScanner
-from voice_analyzer import VoiceAnalyzer # Ensure this import is correct
-from chatbot import ChatBot
+from inference_batcher import MicroBatcher
+from feature_pool import FeatureExtractionPool, ExtractionTimeout
+from voice_cache import VoiceResultCache
+from audio_io import AudioDecodeError, AudioNormalizer, AudioTooLarge, StreamingAudioDecoder, UnsupportedAudioFormat, ffmpeg_path
+from upload_stream import MalformedUpload, RequestTooLarge, stream_multipart_file
+from subsystems import Subsystem, warm_up
+from training_jobs import TrainingJobManager
+import metrics
+import structured_logging
+import tracing
+from request_profiler import ProfileStore, ProfilingMiddleware
 import logging
 import base64
-from io import BytesIO
-import numpy as np
-import pandas as pd
-from geminiaiagent import generate as gemini_agent_generate
-import traceback # Import traceback for detailed error logging
-from typing import Optional # For optional fields in response model
-from pydub import AudioSegment, exceptions as pydub_exceptions # Import pydub
-import tempfile # Import tempfile
-
-# Setup logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+import json
+import asyncio
+import time
+from typing import List, Optional # For optional fields in response model
+
+# Logging: records are queued to a background writer thread (see structured_logging).
+#   LOG_FORMAT           json (one object per line, default) or text
+#   LOG_ENDPOINT_LEVELS  per-endpoint levels, e.g. "/upload-voice=WARNING,/chat=DEBUG"
+#   LOG_SAMPLE_RATES     fraction of requests per endpoint whose info/debug records are kept, e.g. "/upload-voice=0.1"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_ENDPOINT_LEVELS = os.getenv("LOG_ENDPOINT_LEVELS", "")
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+log_handler = structured_logging.setup_logging(LOG_LEVEL, LOG_FORMAT, LOG_ENDPOINT_LEVELS, LOG_QUEUE_SIZE)
 logger = logging.getLogger(__name__)
-logger.info("--- Logger initialized successfully ---") # Add this line
-
-# --- Add ffmpeg check/warning (optional but recommended) ---
-try:
-    AudioSegment.converter = AudioSegment.get_converter_path()
-    logger.info(f"ffmpeg converter found at: {AudioSegment.converter}")
-except pydub_exceptions.CouldntEncodeError:
-    logger.warning("ffmpeg/avconv not found or not configured correctly. '.m4a' conversion might fail. Please install ffmpeg and ensure it's in the system PATH.")
-except Exception as ff_check_err:
-     logger.warning(f"Could not verify ffmpeg presence: {ff_check_err}")
-# ---------------------------------------------------------
+
+# Startup mode:
+#   background - accept connections immediately and load/warm every subsystem in the background (default)
+#   eager      - load and warm every subsystem before accepting connections
+#   lazy       - load each subsystem on its first request, without warmup
+STARTUP_MODE = os.getenv("MEDIMATE_STARTUP_MODE", "background").lower()
+SAMPLE_AUDIO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sample_audio.wav")
+
+# Batch OCR fan-out limits
+OCR_BATCH_CONCURRENCY = int(os.getenv("OCR_BATCH_CONCURRENCY", "4"))
+OCR_BATCH_MAX_CONCURRENCY = int(os.getenv("OCR_BATCH_MAX_CONCURRENCY", "16"))
+OCR_BATCH_MAX_IMAGES = int(os.getenv("OCR_BATCH_MAX_IMAGES", "50"))
+
+# Glucose prediction micro-batching
+VOICE_BATCH_MAX_SIZE = int(os.getenv("VOICE_BATCH_MAX_SIZE", "32"))
+VOICE_BATCH_WINDOW_MS = float(os.getenv("VOICE_BATCH_WINDOW_MS", "2"))
+
+# Praat feature extraction worker processes (0 runs extraction in a thread instead)
+VOICE_EXTRACT_WORKERS = int(os.getenv("VOICE_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+VOICE_EXTRACT_TIMEOUT_SECONDS = float(os.getenv("VOICE_EXTRACT_TIMEOUT_SECONDS", "60"))
+
+# Audio normalisation ahead of Praat analysis (see AudioNormalizer; VOICE_ANALYSIS_RATE=0 keeps the upload rate)
+VOICE_ANALYSIS_RATE = int(os.getenv("VOICE_ANALYSIS_RATE", "16000"))
+VOICE_MAX_ANALYSIS_SECONDS = float(os.getenv("VOICE_MAX_ANALYSIS_SECONDS", "30"))
+VOICE_TRIM_SILENCE = os.getenv("VOICE_TRIM_SILENCE", "true").lower() in ("1", "true", "yes")
+VOICE_SILENCE_THRESHOLD_DB = float(os.getenv("VOICE_SILENCE_THRESHOLD_DB", "40"))
+
+# Voice upload limits, enforced while the upload streams in
+VOICE_UPLOAD_MAX_BYTES = int(os.getenv("VOICE_UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+VOICE_UPLOAD_MAX_SECONDS = float(os.getenv("VOICE_UPLOAD_MAX_SECONDS", "120"))
+
+# Voice feature/prediction cache (in memory, keyed by upload and PCM hashes)
+VOICE_CACHE_ENABLED = os.getenv("VOICE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+VOICE_CACHE_ENTRIES = int(os.getenv("VOICE_CACHE_ENTRIES", "1024"))
+
+# Background voice model training (see TrainingJobManager)
+VOICE_TRAINING_DIR = os.getenv("VOICE_TRAINING_DIR", "training_jobs")
+VOICE_TRAINING_HOLDOUT = float(os.getenv("VOICE_TRAINING_HOLDOUT", "0.2"))
+VOICE_TRAINING_REQUIRE_IMPROVEMENT = os.getenv("VOICE_TRAINING_REQUIRE_IMPROVEMENT", "false").lower() in ("1", "true", "yes")
+VOICE_TRAINING_TIMEOUT_SECONDS = float(os.getenv("VOICE_TRAINING_TIMEOUT_SECONDS", "3600"))
+
+# Versioned voice models (see ModelRegistry); the active version is loaded at startup. Empty disables the registry.
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+VOICE_MODEL_REGISTRY = os.getenv("VOICE_MODEL_REGISTRY", os.path.join(BACKEND_DIR, "model_registry"))
+
+# Request tracing (see tracing.py): spans are written as OTLP/JSON to a file, or to a collector when
+# TRACE_EXPORTER is a URL such as http://localhost:4318/v1/traces. Empty disables tracing.
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0")) # Head sampling for requests without a traceparent
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "medimate-backend")
+TRACE_FLUSH_SECONDS = float(os.getenv("TRACE_FLUSH_SECONDS", "2"))
+
+# On-demand request profiling (see ProfilingMiddleware): requests sending PROFILING_TOKEN in X-Profile-Token,
+# plus a PROFILING_SAMPLE_RATE fraction of requests to PROFILING_PATHS (comma-separated; empty means all).
+# The token also authorizes /admin/profiles. Profiling is off, and costs nothing, unless a token or rate is set.
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_PATHS = [path.strip() for path in os.getenv("PROFILING_PATHS", "").split(",") if path.strip()]
+PROFILING_DIR = os.getenv("PROFILING_DIR", "profiles")
+PROFILING_MAX_PROFILES = int(os.getenv("PROFILING_MAX_PROFILES", "20"))
+PROFILING_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILING_SAMPLE_INTERVAL_MS", "5"))
+
+# --- Subsystems ---
+# Heavy libraries (TensorFlow, parselmouth, google.generativeai) are imported inside these
+# factories, so importing this module is cheap and the server can accept connections straight away.
+
+def check_ffmpeg():
+    """Warn early if ffmpeg is missing, since '.m4a' decoding depends on it"""
+    converter = ffmpeg_path()
+    if converter:
+        logger.info(f"ffmpeg converter found at: {converter}")
+    else:
+        logger.warning("ffmpeg not found. '.m4a' decoding will fail. Please install ffmpeg and ensure it's in the system PATH (or set FFMPEG_BINARY).")
+
+def create_ocr_scanner():
+    from OCRScanner import OCRScanner
+    return OCRScanner()
+
+def create_model_registry():
+    """The voice model registry, seeded on first use with the models shipped in the repository"""
+    from model_registry import ModelRegistry
+    registry = ModelRegistry(VOICE_MODEL_REGISTRY)
+    seeded = registry.import_existing([
+        ({"keras": os.path.join(BACKEND_DIR, "backup_model", "voice_glucose_model.keras")}, "backup_model/voice_glucose_model.keras"),
+        ({"keras": os.path.join(BACKEND_DIR, "voice_glucose_model.keras"),
+          "numpy": os.path.join(BACKEND_DIR, "voice_glucose_model.npz")}, "voice_glucose_model.keras"),
+    ])
+    if seeded:
+        logger.info(f"Seeded the voice model registry at {VOICE_MODEL_REGISTRY}; active version {seeded}")
+    return registry
+
+def create_voice_analyzer():
+    from voice_analyzer import VoiceAnalyzer # Ensure this import is correct
+    check_ffmpeg()
+    return VoiceAnalyzer(registry=create_model_registry() if VOICE_MODEL_REGISTRY else None)
+
+def warm_up_voice_analyzer(analyzer):
+    # Trace every batch shape the micro-batcher can produce and run the sample recording through Praat
+    analyzer.warmup(SAMPLE_AUDIO_PATH, max_batch_size=VOICE_BATCH_MAX_SIZE)
+
+def create_feature_pool():
+    pool = FeatureExtractionPool(
+        workers=VOICE_EXTRACT_WORKERS,
+        timeout=VOICE_EXTRACT_TIMEOUT_SECONDS,
+        sample_path=SAMPLE_AUDIO_PATH if warm else None,
+        normalizer=AudioNormalizer(
+            target_rate=VOICE_ANALYSIS_RATE,
+            max_seconds=VOICE_MAX_ANALYSIS_SECONDS,
+            trim_silence=VOICE_TRIM_SILENCE,
+            threshold_db=VOICE_SILENCE_THRESHOLD_DB,
+        ),
+    )
+    pool.start()
+    return pool
+
+def create_chatbot():
+    from chatbot import ChatBot
+    return ChatBot()
+
+def create_transcription_agent():
+    from geminiaiagent import TranscriptionAgent
+    # Built once; its prompt prefix is reused across requests
+    return TranscriptionAgent()
+
+warm = STARTUP_MODE != "lazy"
+ocr_service = Subsystem("ocr", create_ocr_scanner)
+voice_service = Subsystem("voice", create_voice_analyzer, warm_up_voice_analyzer if warm else None)
+extraction_service = Subsystem("voice-extraction", create_feature_pool)
+chat_service = Subsystem("chat", create_chatbot)
+transcription_service = Subsystem("transcription", create_transcription_agent)
+SUBSYSTEMS = [ocr_service, voice_service, extraction_service, chat_service, transcription_service]
+
+def predict_glucose_rows(features_matrix):
+    """
+    One ((glucose_level, confidence), model_version, forward) per row; the whole batch comes from a single model.
+    ``forward`` is (start_ns, end_ns, batch_size) of the shared forward pass, for tracing.
+    """
+    started_ns = time.time_ns()
+    with metrics.VOICE_STAGE_SECONDS.labels("model_forward").time():
+        predictions, model_version = voice_service.get().predict_glucose_batch_versioned(features_matrix)
+    forward = (started_ns, time.time_ns(), len(predictions))
+    return [(prediction, model_version, forward) for prediction in predictions]
+
+@contextmanager
+def voice_stage(stage: str, **attributes):
+    """Time one stage of a voice upload for /metrics and, in a sampled trace, as a span"""
+    with metrics.VOICE_STAGE_SECONDS.labels(stage).time(), tracing.span(stage, **attributes) as span:
+        yield span
+
+# Concurrent glucose predictions are coalesced into batched forward passes
+glucose_batcher = MicroBatcher(
+    predict_glucose_rows,
+    max_batch_size=VOICE_BATCH_MAX_SIZE,
+    max_wait_ms=VOICE_BATCH_WINDOW_MS,
+)
+
+# Re-uploads of the same recording skip decoding, Praat and (for the same model) prediction
+voice_cache = VoiceResultCache(max_entries=VOICE_CACHE_ENTRIES) if VOICE_CACHE_ENABLED else None
+
+# Training runs in its own process; the result is validated and swapped in without stopping predictions
+training_jobs = TrainingJobManager(
+    jobs_dir=VOICE_TRAINING_DIR,
+    holdout_fraction=VOICE_TRAINING_HOLDOUT,
+    require_improvement=VOICE_TRAINING_REQUIRE_IMPROVEMENT,
+    timeout=VOICE_TRAINING_TIMEOUT_SECONDS,
+    warmup_batch_size=VOICE_BATCH_MAX_SIZE,
+)
+
+async def require(subsystem: Subsystem):
+    """Return a subsystem's service, or fail the request with 503 if it cannot be initialized"""
+    try:
+        return await subsystem.aget()
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"The {subsystem.name} service is unavailable: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.info(f"Startup mode: {STARTUP_MODE}")
+    warmup_task = None
+    if STARTUP_MODE == "eager":
+        await warm_up(SUBSYSTEMS)
+    elif STARTUP_MODE == "background":
+        warmup_task = asyncio.create_task(warm_up(SUBSYSTEMS))
+    yield
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+    training_jobs.shutdown()
+    if extraction_service.ready:
+        extraction_service.get().shutdown()
+    if tracer is not None:
+        tracer.exporter.flush()
 
 # Initialize FastAPI
 app = FastAPI(
     title="MediMate API", # Updated title
     description="API for MediMate features including OCR, Voice Analysis, and Chat",
+    lifespan=lifespan,
 )
 
 # Add CORS middleware
@@ -49,27 +246,49 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Create upload directory if it doesn't exist
-UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-logger.info(f"Upload directory set to: {os.path.abspath(UPLOAD_DIR)}")
-
-# Initialize OCR Scanner
-ocr_scanner = OCRScanner()
-logger.info("OCRScanner initialized.")
-
-# Initialize Voice Analyzer
-try:
-    voice_analyzer = VoiceAnalyzer()
-    logger.info("VoiceAnalyzer initialized.")
-except Exception as va_init_err:
-    logger.error(f"Failed to initialize VoiceAnalyzer: {va_init_err}", exc_info=True)
-    # Depending on severity, you might want to exit or disable voice features
-    voice_analyzer = None # Set to None if initialization fails
-
-# Initialize ChatBot
-chatbot = ChatBot()
-logger.info("ChatBot initialized.")
+# Request ids in a context variable for every log record, per-endpoint log sampling and an access record
+app.add_middleware(structured_logging.RequestContextMiddleware, sample_rates=LOG_SAMPLE_RATES)
+
+# Per-endpoint request counts, errors, in-flight requests and durations, served on /metrics
+app.add_middleware(metrics.MetricsMiddleware)
+
+# A server span per sampled request, continuing an incoming traceparent; only installed when tracing is on
+tracer = None
+if TRACE_EXPORTER:
+    tracer = tracing.Tracer(
+        tracing.OTLPJsonExporter(TRACE_EXPORTER, service_name=TRACE_SERVICE_NAME, flush_interval=TRACE_FLUSH_SECONDS),
+        sample_rate=TRACE_SAMPLE_RATE,
+    )
+    app.add_middleware(tracing.TracingMiddleware, tracer=tracer, endpoint=metrics.EndpointResolver())
+    metrics.REGISTRY.gauge_callback(
+        "medimate_trace_spans_dropped", "Spans dropped because the trace exporter's queue was full",
+        lambda: tracer.exporter.dropped)
+
+# Per-request CPU and allocation profiles; the middleware is only installed when profiling is enabled
+profile_store = None
+if PROFILING_TOKEN or PROFILING_SAMPLE_RATE > 0:
+    profile_store = ProfileStore(PROFILING_DIR, max_profiles=PROFILING_MAX_PROFILES)
+    app.add_middleware(
+        ProfilingMiddleware,
+        store=profile_store,
+        token=PROFILING_TOKEN or None,
+        sample_rate=PROFILING_SAMPLE_RATE,
+        paths=PROFILING_PATHS,
+        skip_paths=("/admin/profiles", "/metrics", "/ready"),
+        sample_interval=PROFILING_SAMPLE_INTERVAL_MS / 1000.0,
+    )
+metrics.REGISTRY.gauge_callback(
+    "medimate_voice_batch_queue_depth", "Glucose predictions waiting to be batched",
+    lambda: glucose_batcher.stats()["queue_depth"])
+metrics.REGISTRY.gauge_callback(
+    "medimate_voice_extraction_in_flight", "Feature extraction jobs queued or running in the worker pool",
+    lambda: extraction_service.get().in_flight if extraction_service.ready else 0)
+metrics.REGISTRY.gauge_callback(
+    "medimate_subsystem_ready", "1 once a subsystem is loaded and warm",
+    lambda: {subsystem.name: int(subsystem.ready) for subsystem in SUBSYSTEMS}, labelname="subsystem")
+metrics.REGISTRY.gauge_callback(
+    "medimate_log_records_dropped", "Log records dropped because the background writer's queue was full",
+    lambda: log_handler.dropped)
 
 # --- Pydantic Models ---
 class OCRRequest(BaseModel):
@@ -90,9 +309,11 @@ class VoiceAnalysisResponse(BaseModel):
     confidence: Optional[float] = None # Ensure field name is 'confidence'
     status: str
     range_info: str
+    model_version: Optional[str] = None # Registry version (or runtime-fingerprint) of the model that answered
 
 class ChatRequest(BaseModel):
     message: str
+    session_id: Optional[str] = None # Conversation to continue; a new one is started if omitted
 
 class TranscriptionAnalysisRequest(BaseModel):
     transcription: str
@@ -100,76 +321,117 @@ class TranscriptionAnalysisRequest(BaseModel):
 class TranscriptionAnalysisResponse(BaseModel):
     key_points: str
 
-# --- Helper Function: Convert to WAV (Moved here) ---
-async def convert_to_wav(input_path: str, request_id: str) -> tuple[str, bool]:
+# --- Helper Functions: Voice ---
+async def predict_from_audio(upload: StreamingAudioDecoder) -> tuple:
     """
-    Convert audio file to WAV format if needed.
-    Returns the path to the WAV file and a boolean indicating if conversion occurred.
+    Finish decoding a fully received upload, extract its voice features and predict.
+    Returns ((glucose_level, confidence), model_version).
+    The voice result cache is consulted before decoding (upload bytes) and before extraction (decoded PCM).
     """
-    endpoint_name = "/upload-voice (convert_to_wav)" # Context for logging
-    # Check if the file is already in WAV format
-    if input_path.lower().endswith('.wav'):
-        logger.info(f"[{request_id}] {endpoint_name} - Input file is already WAV: {input_path}")
-        return input_path, False # Return path and flag indicating no conversion needed
+    voice_analyzer = await require(voice_service)
+    model_version = voice_analyzer.model_version
+    upload_key = pcm_key = features = None
+
+    if voice_cache is not None:
+        upload_key = upload.digest
+        pcm_key = voice_cache.pcm_key_for_upload(upload_key)
+        if pcm_key is not None:
+            prediction = voice_cache.get_prediction(pcm_key, model_version, from_upload=True)
+            if prediction is not None:
+                logger.info("Served from voice cache", extra={"cache": "upload"})
+                tracing.current_span().set_attribute("voice.cache", "upload")
+                upload.close()
+                return prediction, model_version
+            features = voice_cache.get_features(pcm_key)
+            if features is not None:
+                # Cached features make decoding unnecessary
+                upload.close()
+
+    if features is None:
+        def decode_and_key():
+            samples, sample_rate = upload.decode()
+            # Hashing minutes of float64 PCM takes long enough to stall the event loop, so it runs here too
+            return samples, sample_rate, voice_cache.pcm_key(samples, sample_rate) if voice_cache is not None else None
 
-    logger.info(f"[{request_id}] {endpoint_name} - Attempting conversion for: {input_path}")
-    temp_wav_path = None
-    try:
-        # Load the audio file using pydub
-        file_ext = os.path.splitext(input_path)[1].lower()
-
-        # Add detailed check before loading
-        logger.info(f"[{request_id}] {endpoint_name} - Checking existence before pydub load: Path='{input_path}', Exists={os.path.exists(input_path)}")
-        if not os.path.exists(input_path):
-             logger.error(f"[{request_id}] {endpoint_name} - File confirmed NOT FOUND right before pydub load: {input_path}")
-             # Raising FileNotFoundError explicitly here might give a clearer trace
-             raise FileNotFoundError(f"Audio file does not exist at the specified path: {input_path}")
-        logger.info(f"[{request_id}] {endpoint_name} - File confirmed exists. Attempting AudioSegment.from_file...")
-        # End detailed check
-
-        if file_ext == '.m4a':
-            audio = AudioSegment.from_file(input_path, format="m4a")
-        # Add other formats if needed
-        # elif file_ext == '.mp3':
-        #     audio = AudioSegment.from_file(input_path, format="mp3")
-        else:
-            # This case should ideally not happen if initial validation is correct
-            raise ValueError(f"Unsupported audio format for conversion: {input_path}")
-
-        if len(audio) == 0:
-             logger.warning(f"[{request_id}] {endpoint_name} - Audio file loaded but has zero duration/length: {input_path}")
-             # Depending on requirements, you might raise an error here
-             # raise ValueError("Input audio file is empty or silent.")
-
-        # Create a temporary WAV file path using tempfile
-        # delete=False is important because the file needs to exist after this block
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False, dir=UPLOAD_DIR, prefix=f"{request_id}_conv_") as temp_wav:
-            temp_wav_path = temp_wav.name
-        logger.info(f"[{request_id}] {endpoint_name} - Created temporary WAV path: {temp_wav_path}")
-
-        # Export as WAV
-        logger.info(f"[{request_id}] {endpoint_name} - Exporting to temporary WAV: {temp_wav_path}")
-        audio.export(temp_wav_path, format="wav")
-        logger.info(f"[{request_id}] {endpoint_name} - Successfully converted to WAV: {temp_wav_path}")
-
-        return temp_wav_path, True # Return path and flag indicating conversion happened
-
-    except pydub_exceptions.CouldntDecodeError as decode_err:
-         logger.error(f"[{request_id}] {endpoint_name} - Pydub failed to decode '{input_path}'. Check file integrity and ffmpeg installation.", exc_info=True)
-         raise Exception(f"Failed to decode audio file. Ensure it's a valid '{file_ext}' file and ffmpeg is installed.") from decode_err
-    except FileNotFoundError as fnf_err:
-         logger.error(f"[{request_id}] {endpoint_name} - Audio conversion failed. Input file not found: {input_path}", exc_info=True)
-         raise Exception(f"Audio file not found at path: {input_path}") from fnf_err
-    except Exception as e:
-        logger.error(f"[{request_id}] {endpoint_name} - Error converting audio file '{input_path}' to WAV: {e}", exc_info=True)
-        # Clean up temp file if created before error
-        if temp_wav_path and os.path.exists(temp_wav_path):
-            try:
-                os.remove(temp_wav_path)
-                logger.warning(f"[{request_id}] {endpoint_name} - Cleaned up intermediate temp file {temp_wav_path} during conversion error.")
-            except Exception as cleanup_err:
-                logger.warning(f"[{request_id}] {endpoint_name} - Failed to clean up intermediate temp file {temp_wav_path} during conversion error: {cleanup_err}")
-        raise Exception(f"Error converting audio file: {e}") from e
+        try:
+            # WAV is parsed in-process; m4a is piped through ffmpeg. Both run off the event loop.
+            with voice_stage("decode", **{"audio.format": upload.format}):
+                samples, sample_rate, pcm_key = await asyncio.to_thread(decode_and_key)
+        except AudioTooLarge as too_large:
+            raise HTTPException(status_code=413, detail=str(too_large))
+        except UnsupportedAudioFormat as format_err:
+            raise HTTPException(status_code=415, detail=str(format_err))
+        except AudioDecodeError as decode_err:
+            raise HTTPException(status_code=400, detail=f"Could not decode audio file: {decode_err}")
+        logger.debug("Decoded audio", extra={"samples": samples.shape[1], "channels": samples.shape[0], "sample_rate": sample_rate})
+
+        if voice_cache is not None:
+            prediction = voice_cache.get_prediction(pcm_key, model_version)
+            if prediction is not None:
+                logger.info("Served from voice cache", extra={"cache": "pcm"})
+                tracing.current_span().set_attribute("voice.cache", "pcm")
+                voice_cache.link_upload(upload_key, pcm_key)
+                return prediction, model_version
+            features = voice_cache.get_features(pcm_key)
+
+    if features is None:
+        feature_pool = await require(extraction_service)
+        # Praat analysis runs in a worker process so the event loop keeps serving other requests
+        try:
+            with voice_stage("extraction"):
+                features, normalization = await feature_pool.extract_samples(samples, sample_rate)
+                # Stages measured in the worker process become child spans of the extraction
+                worker_stages = normalization.pop("stage_seconds", {})
+                tracing.record_stages(normalization.pop("started_at_ns", None), worker_stages)
+        except ExtractionTimeout as timeout_err:
+            raise HTTPException(status_code=504, detail=str(timeout_err))
+        for stage, seconds in worker_stages.items():
+            metrics.VOICE_STAGE_SECONDS.labels(stage).observe(seconds)
+        logger.debug("Extracted voice features", extra={"normalization": normalization})
+    else:
+        logger.info("Reusing cached voice features", extra={"model_version": model_version})
+        tracing.current_span().set_attribute("voice.cache", "features")
+
+    # Tag the cache with the model that actually answered, which may be newer than the one checked above
+    with voice_stage("predict"):
+        prediction, model_version, (forward_start_ns, forward_end_ns, batch_size) = await glucose_batcher.submit(features)
+        # The forward pass is shared by the whole micro-batch
+        tracing.record_span("model_forward", forward_start_ns, forward_end_ns, **{
+            "voice.batch_size": batch_size, "voice.model_version": model_version})
+    if voice_cache is not None:
+        voice_cache.put(upload_key, pcm_key, features, model_version, prediction)
+    return prediction, model_version
+
+# --- Helper Functions: OCR ---
+def to_ocr_response(result: dict) -> OCRResponse:
+    """Map an OCRScanner result dict to the API response format"""
+    return OCRResponse(
+        medication_name=result.get("Medication Name", "Not specified"),
+        description=result.get("Description", "Not specified"),
+        dosage=result.get("Dosage", "Not specified"),
+        frequency=result.get("Frequency", "Not specified"),
+        time_of_day=result.get("Time of day", "Not specified"),
+        start_date=result.get("Start Date", "Not specified"),
+        duration=result.get("Duration", "Not specified"),
+        special_instructions=result.get("Special Instructions", "Not specified"),
+    )
+
+async def run_ocr(image_data: bytes) -> OCRResponse:
+    """Run Gemini Vision OCR on in-memory image bytes; nothing is written to disk"""
+    if not image_data:
+        raise HTTPException(status_code=400, detail="Invalid request: empty image.")
+
+    # Process the image with Gemini Vision
+    logger.info("Processing image with Gemini Vision", extra={"bytes": len(image_data)})
+    ocr_scanner = await require(ocr_service)
+    with tracing.span("ocr.scan"):
+        result = await ocr_scanner.process_image_bytes_async(image_data)
+    logger.debug("Gemini Vision result", extra={"result": result})
+
+    if "error" in result:
+        raise HTTPException(status_code=500, detail=f"Error processing image: {result['error']}")
+
+    return to_ocr_response(result)
 
 # --- Endpoints ---
 
@@ -179,56 +441,79 @@ async def process_image(request: OCRRequest):
     Process a base64 encoded medication label image and extract information
     """
     try:
-        # Create a temporary file path
-        temp_file_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4()}.jpg")
-
-        try:
-            # Decode base64 image
+        # Decode base64 image
+        with tracing.span("ocr.decode_base64"):
             image_data = base64.b64decode(request.image)
+    except Exception as e:
+        logger.error(f"Error in request processing: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"Invalid request: {str(e)}")
+
+    return await run_ocr(image_data)
+
+
+@app.post("/process-medication-image/raw", response_model=OCRResponse)
+async def process_image_raw(request: Request):
+    """
+    Process a medication label image sent as the raw request body (e.g. Content-Type: image/jpeg).
+    Avoids base64 overhead and never touches the filesystem.
+    """
+    image_data = await request.body()
+    return await run_ocr(image_data)
+
+
+@app.post("/process-medication-image/upload", response_model=OCRResponse)
+async def process_image_upload(file: UploadFile = File(...)):
+    """
+    Process a medication label image sent as a multipart file upload.
+    Note that the multipart parser spools uploads larger than 1 MB to a temporary file;
+    use /process-medication-image/raw for a fully in-memory path.
+    """
+    image_data = await file.read()
+    return await run_ocr(image_data)
 
-            # Save the image data to a temporary file
-            logger.info(f"Saving decoded image to: {temp_file_path}")
-            with open(temp_file_path, "wb") as f:
-                f.write(image_data)
-
-            # Process the image with Gemini Vision
-            logger.info("Processing image with Gemini Vision")
-            result = ocr_scanner.process_image(temp_file_path)
-            logger.info(f"Gemini Vision Result: {result}")
-
-            if "error" in result:
-                raise HTTPException(status_code=500, detail=result["error"])
-
-            # Map the result to expected response format
-            response = OCRResponse(
-                medication_name=result.get("Medication Name", "Not specified"),
-                description=result.get("Description", "Not specified"),
-                dosage=result.get("Dosage", "Not specified"),
-                frequency=result.get("Frequency", "Not specified"),
-                time_of_day=result.get("Time of day", "Not specified"),
-                start_date=result.get("Start Date", "Not specified"),
-                duration=result.get("Duration", "Not specified"),
-                special_instructions=result.get(
-                    "Special Instructions", "Not specified"
-                ),
-            )
-
-            return response
-
-        except Exception as e:
-            logger.error(f"Error processing image: {str(e)}")
-            raise HTTPException(
-                status_code=500, detail=f"Error processing image: {str(e)}"
-            )
 
+@app.post("/process-medication-images")
+async def process_images_batch(files: List[UploadFile] = File(...), concurrency: Optional[int] = None):
+    """
+    Process a batch of medication label images concurrently.
+    Streams one NDJSON line per image as soon as it completes (in completion order, tagged with its index),
+    followed by a final summary line. A failing image only produces an error line for that item.
+    """
+    if len(files) > OCR_BATCH_MAX_IMAGES:
+        raise HTTPException(status_code=400, detail=f"Too many images in batch ({len(files)}). Maximum is {OCR_BATCH_MAX_IMAGES}.")
+    limit = max(1, min(concurrency or OCR_BATCH_CONCURRENCY, OCR_BATCH_MAX_CONCURRENCY))
+    semaphore = asyncio.Semaphore(limit)
+    logger.info(f"Batch OCR: {len(files)} images with concurrency {limit}")
+
+    async def process_item(index: int, upload: UploadFile) -> dict:
+        item = {"index": index, "filename": upload.filename}
+        async with semaphore:
+            try:
+                image_data = await upload.read()
+                item["result"] = (await run_ocr(image_data)).dict()
+            except HTTPException as http_exc:
+                item.update(error=http_exc.detail, status_code=http_exc.status_code)
+            except Exception as e:
+                logger.error(f"Batch OCR: item {index} failed: {e}", exc_info=True)
+                item.update(error=str(e), status_code=500)
+        return item
+
+    async def stream_results():
+        tasks = [asyncio.create_task(process_item(i, f)) for i, f in enumerate(files)]
+        failed = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                item = await next_done
+                if "error" in item:
+                    failed += 1
+                yield json.dumps(item) + "\n"
+            yield json.dumps({"done": True, "count": len(tasks), "failed": failed}) + "\n"
         finally:
-            # Clean up the temporary file
-            if os.path.exists(temp_file_path):
-                os.remove(temp_file_path)
+            # Stop outstanding work if the client disconnects mid-stream
+            for task in tasks:
+                task.cancel()
 
-    except Exception as e:
-        logger.error(f"Error in request processing: {str(e)}")
-        raise HTTPException(status_code=400, detail=f"Invalid request: {str(e)}")
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
 
 
 @app.post("/process-text", response_model=OCRResponse)
@@ -238,130 +523,62 @@ async def process_text(text: str):
     """
     try:
         # Process the text
+        ocr_scanner = await require(ocr_service)
         result = ocr_scanner.extract_metrics(text)
 
         # Map the result to expected response format
-        response = OCRResponse(
-            medication_name=result.get("Medication Name", "Not specified"),
-            description=result.get("Description", "Not specified"),
-            dosage=result.get("Dosage", "Not specified"),
-            frequency=result.get("Frequency", "Not specified"),
-            time_of_day=result.get("Time of day", "Not specified"),
-            start_date=result.get("Start Date", "Not specified"),
-            duration=result.get("Duration", "Not specified"),
-            special_instructions=result.get("Special Instructions", "Not specified"),
-        )
-
-        return response
+        return to_ocr_response(result)
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing text: {str(e)}")
 
 
-@app.post("/upload-voice", response_model=VoiceAnalysisResponse)
-async def upload_voice(request: Request, file: UploadFile = File(...)): # Added Request
+# The upload is streamed from the request body, so the multipart schema is documented by hand
+VOICE_UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "required": ["file"],
+            "properties": {"file": {"type": "string", "format": "binary"}},
+        }}},
+    }
+}
+
+@app.post("/upload-voice", response_model=VoiceAnalysisResponse, openapi_extra=VOICE_UPLOAD_OPENAPI)
+async def upload_voice(request: Request): # Added Request
     """
-    Upload a voice file (.wav or .m4a), convert if necessary, and predict glucose level
+    Upload a voice file (.wav or .m4a), decode it in memory, and predict glucose level.
+    The upload is streamed: oversized or overlong recordings are rejected with 413 before the rest is read.
     """
-    # --- VERY FIRST LOG ---
-    logger.info("--- >>> Entered /upload-voice endpoint function <<< ---")
-    logger.info(f"Request Headers: {dict(request.headers)}")
-    # --- END VERY FIRST LOG ---
-
-    endpoint_name = "/upload-voice"
-    request_id = str(uuid.uuid4())
-    logger.info(f"[{request_id}] {endpoint_name} - Processing request.")
-
-    original_temp_file_path = None # Path of the initially uploaded file
-    converted_wav_path = None    # Path of the WAV file (might be same as original)
-    was_converted = False        # Flag if conversion happened
-
+    # The request id and endpoint are attached to every record by structured_logging
+    # --- Stream the Upload into the Decoder (bounded memory, nothing is written to disk) ---
+    # The format is sniffed from the first bytes of the file, not from its filename
+    upload = StreamingAudioDecoder(max_bytes=VOICE_UPLOAD_MAX_BYTES, max_seconds=VOICE_UPLOAD_MAX_SECONDS)
     try:
-        # --- Initial Validation and Logging ---
-        if not file:
-            logger.error(f"[{request_id}] {endpoint_name} - Failed: No file object received.")
-            raise HTTPException(status_code=400, detail="No file provided in the request.")
-
-        logger.info(f"[{request_id}] {endpoint_name} - Received file: Filename='{file.filename}', Content-Type='{file.content_type}', Size={getattr(file, 'size', 'Unknown')}")
-
-        if not file.filename:
-            logger.error(f"[{request_id}] {endpoint_name} - Failed: Filename missing.")
-            raise HTTPException(status_code=400, detail="Filename is missing in the upload.")
-
-        # --- File Extension Validation ---
-        logger.info(f"[{request_id}] {endpoint_name} - Validating file extension...")
-        allowed_extensions = (".wav", ".m4a")
-        file_ext = os.path.splitext(file.filename)[1].lower()
-        if file_ext not in allowed_extensions:
-            logger.error(f"[{request_id}] {endpoint_name} - Failed: Invalid file extension '{file_ext}'. Allowed: {allowed_extensions}")
-            raise HTTPException(
-                status_code=400, detail=f"Invalid file type '{file_ext}'. Only .wav or .m4a allowed."
-            )
-        logger.info(f"[{request_id}] {endpoint_name} - File extension '{file_ext}' is valid.")
-
-        # --- Save Original Uploaded File ---
-        original_temp_file_path = os.path.join(UPLOAD_DIR, f"{request_id}_orig{file_ext}") # Mark as original
-        logger.info(f"[{request_id}] {endpoint_name} - Generated original temporary file path: {original_temp_file_path}")
-
         try:
-            logger.info(f"[{request_id}] {endpoint_name} - Attempting to read file content...")
-            file_content = await file.read()
-            content_length = len(file_content)
-            logger.info(f"[{request_id}] {endpoint_name} - Successfully read {content_length} bytes from file stream.")
-
-            if content_length == 0:
-                 logger.error(f"[{request_id}] {endpoint_name} - Failed: Received empty file content (0 bytes).")
-                 raise HTTPException(status_code=400, detail="Received empty file.")
-
-            logger.info(f"[{request_id}] {endpoint_name} - Attempting to write content to {original_temp_file_path}...")
-            with open(original_temp_file_path, "wb") as buffer:
-                buffer.write(file_content)
-            logger.info(f"[{request_id}] {endpoint_name} - Successfully wrote original content to {original_temp_file_path}.")
-
-            # Verify save
-            if not os.path.exists(original_temp_file_path) or os.path.getsize(original_temp_file_path) == 0:
-                 logger.error(f"[{request_id}] {endpoint_name} - Failed: Original file saving failed or resulted in empty file at {original_temp_file_path}.")
-                 raise HTTPException(status_code=500, detail="Failed to properly save the uploaded file on the server.")
-            logger.info(f"[{request_id}] {endpoint_name} - Verified original file exists with size {os.path.getsize(original_temp_file_path)} bytes.")
-
-        except HTTPException as http_exc:
-             raise http_exc # Re-raise validation errors
-        except Exception as save_error:
-            logger.error(f"[{request_id}] {endpoint_name} - Error during file reading or saving original: {save_error}", exc_info=True)
-            raise HTTPException(status_code=500, detail=f"Server error saving uploaded file: {save_error}")
-
-        # --- Convert to WAV if Necessary ---
-        logger.info(f"[{request_id}] {endpoint_name} - Checking if conversion to WAV is needed...")
-        try:
-            # Call the conversion function (now part of main.py)
-            converted_wav_path, was_converted = await convert_to_wav(original_temp_file_path, request_id)
-            logger.info(f"[{request_id}] {endpoint_name} - Conversion check complete. Using WAV path: {converted_wav_path}. Was converted: {was_converted}")
-            # Verify the WAV file exists after conversion attempt
-            if not os.path.exists(converted_wav_path) or os.path.getsize(converted_wav_path) == 0:
-                logger.error(f"[{request_id}] {endpoint_name} - Failed: WAV file path '{converted_wav_path}' does not exist or is empty after conversion check.")
-                raise HTTPException(status_code=500, detail="Server error: Failed to obtain valid WAV file for analysis.")
-            logger.info(f"[{request_id}] {endpoint_name} - Verified WAV file exists at {converted_wav_path} with size {os.path.getsize(converted_wav_path)} bytes.")
-
-        except Exception as convert_error:
-            logger.error(f"[{request_id}] {endpoint_name} - Error during audio conversion: {convert_error}", exc_info=True)
-            raise HTTPException(status_code=500, detail=f"Server error converting audio to WAV: {convert_error}")
-
-        # --- Voice Analysis (using the WAV file) ---
-        if voice_analyzer is None:
-             logger.error(f"[{request_id}] {endpoint_name} - Failed: VoiceAnalyzer was not initialized successfully.")
-             raise HTTPException(status_code=500, detail="Voice analysis service is unavailable.")
-
-        logger.info(f"[{request_id}] {endpoint_name} - Starting feature extraction using: {converted_wav_path}...")
-        # Pass the potentially converted WAV path to the analyzer
-        features = voice_analyzer.extract_voice_features(converted_wav_path)
-        logger.info(f"[{request_id}] {endpoint_name} - Feature extraction completed successfully.")
-
-        logger.info(f"[{request_id}] {endpoint_name} - Starting glucose prediction...")
-        glucose_level, confidence = voice_analyzer.predict_glucose(features)
-        logger.info(f"[{request_id}] {endpoint_name} - Prediction completed: Glucose={glucose_level}, Confidence={confidence}")
+            with voice_stage("upload_read"):
+                file_info = await stream_multipart_file(request, "file", upload.feed, VOICE_UPLOAD_MAX_BYTES)
+        except (RequestTooLarge, AudioTooLarge) as too_large:
+            raise HTTPException(status_code=413, detail=str(too_large))
+        except UnsupportedAudioFormat as format_err:
+            raise HTTPException(status_code=415, detail=str(format_err))
+        except (MalformedUpload, AudioDecodeError) as upload_err:
+            raise HTTPException(status_code=400, detail=str(upload_err))
+        logger.info("Received voice upload", extra={
+            "upload_filename": file_info["filename"], "content_type": file_info["content_type"],
+            "size": file_info["size"], "format": upload.format})
+
+        if file_info["size"] == 0:
+            raise HTTPException(status_code=400, detail="Received empty file.")
+
+        # --- Voice Analysis (decode, extract features, predict; cached by content) ---
+        voice_analyzer = await require(voice_service)
+        (glucose_level, confidence), model_version = await predict_from_audio(upload)
 
         # --- Determine Status and Range Info ---
-        logger.info(f"[{request_id}] {endpoint_name} - Determining status based on prediction...")
         status = "Normal"
         range_info = "Normal range (80-120 mg/dL)"
         normal_range = getattr(voice_analyzer, 'normal_range', (80, 120))
@@ -376,111 +593,139 @@ async def upload_voice(request: Request, file: UploadFile = File(...)): # Added
             else:
                 range_info = f"Elevated range ({normal_range[1]}-140 mg/dL)"
 
-        logger.info(f"[{request_id}] {endpoint_name} - Determined Status='{status}', RangeInfo='{range_info}'")
-
         # --- Prepare and Return Response ---
         response_data = VoiceAnalysisResponse(
             glucose_level=round(float(glucose_level), 2),
             confidence=round(float(confidence), 2) if confidence is not None else None,
             status=status,
             range_info=range_info,
+            model_version=model_version,
         )
-        logger.info(f"[{request_id}] {endpoint_name} - Sending successful response: {response_data.dict()}")
+        logger.info("Predicted glucose level", extra={
+            "glucose_level": response_data.glucose_level, "confidence": response_data.confidence,
+            "status": status, "model_version": model_version})
         return response_data
 
     except HTTPException as http_exc:
-         # Log and re-raise known HTTP exceptions
-         logger.error(f"[{request_id}] {endpoint_name} - HTTPException occurred: {http_exc.status_code} - {http_exc.detail}", exc_info=False) # Don't need full traceback for these
+         # Log and re-raise known HTTP exceptions (no traceback needed for these)
+         logger.warning("Voice upload rejected", extra={"status_code": http_exc.status_code, "detail": http_exc.detail})
          raise http_exc
     except Exception as e:
         # Catch-all for unexpected errors during the main process
-        logger.error(f"[{request_id}] {endpoint_name} - Unexpected error in main processing: {e}", exc_info=True)
-        logger.error(f"[{request_id}] {endpoint_name} - Traceback: {traceback.format_exc()}")
+        logger.error(f"Unexpected error in voice upload: {e}", exc_info=True)
         # Determine status code based on where error might have occurred
         status_code = 500 # Default to internal server error
         if isinstance(e, (ValueError, TypeError)): # Example: could be bad data format
              status_code = 400
         raise HTTPException(status_code=status_code, detail=f"An unexpected server error occurred: {e}")
-
     finally:
-        # --- Clean up Temporary Files ---
-        logger.info(f"[{request_id}] {endpoint_name} - Starting cleanup...")
-        # Clean up the converted WAV file if it was created and is different from original
-        if was_converted and converted_wav_path and os.path.exists(converted_wav_path):
-            try:
-                os.remove(converted_wav_path)
-                logger.info(f"[{request_id}] {endpoint_name} - Cleaned up temporary WAV file: {converted_wav_path}")
-            except Exception as cleanup_error:
-                logger.error(f"[{request_id}] {endpoint_name} - Error cleaning up temporary WAV file {converted_wav_path}: {cleanup_error}", exc_info=True)
-        elif converted_wav_path:
-             logger.info(f"[{request_id}] {endpoint_name} - No conversion occurred or WAV path invalid, skipping WAV cleanup for: {converted_wav_path}")
-
-        # Clean up the original uploaded file
-        if original_temp_file_path and os.path.exists(original_temp_file_path):
-            try:
-                os.remove(original_temp_file_path)
-                logger.info(f"[{request_id}] {endpoint_name} - Cleaned up original uploaded file: {original_temp_file_path}")
-            except Exception as cleanup_error:
-                logger.error(f"[{request_id}] {endpoint_name} - Error cleaning up original file {original_temp_file_path}: {cleanup_error}", exc_info=True)
-        elif original_temp_file_path:
-             logger.warning(f"[{request_id}] {endpoint_name} - Original file {original_temp_file_path} not found during cleanup.")
-        logger.info(f"[{request_id}] {endpoint_name} - Cleanup finished.")
+        # Releases the buffered upload (an in-memory file for M4A) on every path; decode() has usually done so already
+        upload.close()
 
 
-@app.post("/train-voice-model")
-async def train_voice_model(file: UploadFile = File(...)):
+@app.post("/train-voice-model", status_code=202)
+async def train_voice_model(file: UploadFile = File(...), epochs: int = 50):
     """
-    Upload training data and train the voice analysis model
+    Upload training data (CSV with the feature columns and glucose_level) and start a background training job.
+    Poll the returned status_url for progress; the model is swapped in once it has trained and passed validation.
     """
-    try:
-        # Save the uploaded training data file
-        temp_file_path = os.path.join(UPLOAD_DIR, f"training_data_{uuid.uuid4()}.csv")
-
-        try:
-            # Save the uploaded file
-            with open(temp_file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-
-            # Load training data
-            training_data = pd.read_csv(temp_file_path)
-
-            # Assuming the CSV has columns for features and 'glucose_level'
-            X_train = training_data[voice_analyzer.feature_names].values
-            y_train = training_data["glucose_level"].values
-
-            # Train the model
-            voice_analyzer.train_model(X_train, y_train)
-
-            # Save the trained model
-            voice_analyzer.save_model()
-
-            return {"message": "Model trained successfully"}
-
-        except Exception as e:
-            logger.error(f"Error training model: {str(e)}")
-            raise HTTPException(
-                status_code=500, detail=f"Error training model: {str(e)}"
-            )
-
-        finally:
-            # Clean up the temporary file
-            if os.path.exists(temp_file_path):
-                os.remove(temp_file_path)
+    import pandas as pd # Only needed for training, so imported lazily
 
+    voice_analyzer = await require(voice_service)
+    try:
+        data = await file.read()
+        training_data = await asyncio.to_thread(pd.read_csv, io.BytesIO(data))
+        # Assuming the CSV has columns for features and 'glucose_level'
+        X_train = training_data[voice_analyzer.feature_names].values
+        y_train = training_data["glucose_level"].values
+        job = training_jobs.submit(voice_analyzer, X_train, y_train, epochs=epochs,
+                                   training_data_sha256=hashlib.sha256(data).hexdigest())
     except Exception as e:
         logger.error(f"Error in request processing: {str(e)}")
         raise HTTPException(status_code=400, detail=f"Invalid request: {str(e)}")
 
+    return {
+        "message": "Training job queued",
+        "job_id": job["id"],
+        "status_url": f"/train-voice-model/jobs/{job['id']}",
+        "job": job,
+    }
+
+@app.get("/train-voice-model/jobs")
+async def list_training_jobs():
+    """Recent training jobs, newest first"""
+    return {"jobs": training_jobs.list()}
+
+@app.get("/train-voice-model/jobs/{job_id}")
+async def training_job_status(job_id: str):
+    """State, per-epoch progress, validation metrics and resulting model version of a training job"""
+    job = training_jobs.status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown training job '{job_id}'")
+    return job
+
+# --- Voice model registry ---
+def require_registry(voice_analyzer):
+    if voice_analyzer.registry is None:
+        raise HTTPException(status_code=409, detail="The voice model registry is disabled (VOICE_MODEL_REGISTRY is empty)")
+    return voice_analyzer.registry
+
+@app.get("/voice-model/versions")
+async def list_voice_model_versions():
+    """Registered voice model versions with their metadata, plus the active and served versions"""
+    voice_analyzer = await require(voice_service)
+    registry = require_registry(voice_analyzer)
+    return {
+        "active": registry.active,
+        "serving": voice_analyzer.model_version,
+        "rollback_target": registry.rollback_target(),
+        "versions": await asyncio.to_thread(registry.versions),
+    }
+
+@app.post("/voice-model/versions/{version}/activate")
+async def activate_voice_model_version(version: str):
+    """Serve a registered version from now on (and after restarts); predictions in flight are not interrupted"""
+    voice_analyzer = await require(voice_service)
+    registry = require_registry(voice_analyzer)
+    if version not in registry:
+        raise HTTPException(status_code=404, detail=f"Unknown model version '{version}'")
+    try:
+        previous = await asyncio.to_thread(voice_analyzer.activate_version, version, VOICE_BATCH_MAX_SIZE)
+    except (ValueError, FileNotFoundError) as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    logger.info(f"Voice model activated: {previous} -> {version}")
+    return {"active": version, "previous": previous}
+
+@app.post("/voice-model/rollback")
+async def rollback_voice_model():
+    """Return to the version that was active before the current one"""
+    voice_analyzer = await require(voice_service)
+    require_registry(voice_analyzer)
+    try:
+        previous = await asyncio.to_thread(voice_analyzer.rollback, VOICE_BATCH_MAX_SIZE)
+    except (ValueError, FileNotFoundError) as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    logger.info(f"Voice model rolled back: {previous} -> {voice_analyzer.model_version}")
+    return {"active": voice_analyzer.model_version, "previous": previous}
+
 @app.post("/chat")
-async def chat_endpoint(request: ChatRequest):
+async def chat_endpoint(request: ChatRequest, http_request: Request):
     """
-    Get a streaming response from the Gemini-powered chatbot
+    Get a streaming response from the Gemini-powered chatbot.
+    The session id is echoed back in the X-Session-Id header so clients can continue the conversation.
+    Frames are newline-delimited JSON, or Server-Sent Events when the client sends Accept: text/event-stream.
     """
     try:
+        session_id = request.session_id or str(uuid.uuid4())
+        chatbot = await require(chat_service)
+        writer = chatbot.make_writer(sse="text/event-stream" in http_request.headers.get("accept", ""))
         return StreamingResponse(
-            chatbot.get_response(request.message),
-            media_type='application/json'
+            chatbot.get_response(request.message, session_id, writer),
+            media_type=writer.media_type,
+            headers={"X-Session-Id": session_id, **writer.headers},
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -492,21 +737,92 @@ async def analyze_transcription(request: TranscriptionAnalysisRequest):
     try:
         logger.info("Analyzing transcription with Gemini AI")
 
+        transcription_agent = await require(transcription_service)
+
         # Call Gemini AI Agent to analyze the transcription
-        analysis = gemini_agent_generate(request.transcription)
+        analysis = await transcription_agent.generate_async(request.transcription)
 
         # Return the analysis
         return TranscriptionAnalysisResponse(key_points=analysis)
 
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error analyzing transcription: {str(e)}")
-        import traceback
-
-        logger.error(f"Traceback: {traceback.format_exc()}")
+        logger.error(f"Error analyzing transcription: {str(e)}", exc_info=True)
         raise HTTPException(
             status_code=500, detail=f"Error analyzing transcription: {str(e)}"
         )
 
+@app.get("/ocr-cache/stats")
+async def ocr_cache_stats():
+    """
+    Hit/miss counters and sizes of the OCR result cache
+    """
+    ocr_scanner = await require(ocr_service)
+    if ocr_scanner.cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **ocr_scanner.cache.stats()}
+
+@app.get("/voice-inference/stats")
+async def voice_inference_stats():
+    """
+    Queue depth and batch-size histogram of the glucose prediction micro-batcher,
+    plus job counters of the feature extraction pool and voice cache hit rates
+    """
+    stats = glucose_batcher.stats()
+    if extraction_service.ready:
+        stats["extraction"] = extraction_service.get().stats()
+    if voice_cache is not None:
+        stats["cache"] = voice_cache.stats()
+    return stats
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """
+    Prometheus metrics: per-endpoint requests, errors, in-flight requests and latency,
+    voice pipeline stage latencies and Gemini time-to-first-chunk / total time
+    """
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+# --- Request profiles (admin) ---
+def require_profile_admin(request: Request) -> ProfileStore:
+    """The profile store, if profiling is enabled and the request carries the admin token"""
+    if profile_store is None:
+        raise HTTPException(status_code=404, detail="Request profiling is disabled")
+    token = request.headers.get("x-profile-token", "")
+    if not PROFILING_TOKEN or not hmac.compare_digest(token.encode(), PROFILING_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="A valid X-Profile-Token header is required")
+    return profile_store
+
+@app.get("/admin/profiles")
+async def list_request_profiles(request: Request):
+    """Stored request profiles, newest first"""
+    store = require_profile_admin(request)
+    return {"profiles": await asyncio.to_thread(store.list)}
+
+@app.get("/admin/profiles/{profile_id}/{artifact}")
+async def download_request_profile(profile_id: str, artifact: str, request: Request):
+    """
+    Download one artefact of a stored profile: cprofile.prof, cprofile.txt, stacks.folded or allocations.txt
+    """
+    store = require_profile_admin(request)
+    path = store.artifact_path(profile_id, artifact)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Unknown profile artefact '{profile_id}/{artifact}'")
+    return FileResponse(path, media_type=ProfileStore.ARTIFACTS[artifact], filename=f"{profile_id}-{artifact}")
+
+@app.get("/ready")
+async def ready():
+    """
+    Readiness probe: 200 once every subsystem is loaded and warm, 503 otherwise
+    """
+    subsystems = {subsystem.name: subsystem.status() for subsystem in SUBSYSTEMS}
+    is_ready = all(subsystem.ready for subsystem in SUBSYSTEMS)
+    return JSONResponse(
+        status_code=200 if is_ready else 503,
+        content={"ready": is_ready, "startup_mode": STARTUP_MODE, "subsystems": subsystems},
+    )
+
 @app.get("/")
 async def root():
     logger.info("Root endpoint '/' accessed.")
@@ -0,0 +1,359 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable, Optional
+
+from starlette.routing import Match
+
+import tracing
+
+# Prometheus text exposition format, version 0.0.4
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Request and stage latencies span sub-millisecond predictions to multi-second Gemini calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    """
+    A metric family with one child per combination of label values. ``labels(*values)`` is a
+    dictionary lookup; hot paths can keep the returned child to skip even that.
+    """
+
+    TYPE = None
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        (registry or REGISTRY).register(self)
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            values = tuple(str(value) for value in values)
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def collect(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}"]
+        with self._lock:
+            children = sorted(self._children.items(), key=lambda item: item[0])
+        for values, child in children:
+            lines.extend(child.samples(self.name, self.labelnames, values))
+        return lines
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name, labelnames, values):
+        return [f"{name}_total{_format_labels(labelnames, values)} {_format_value(self.value)}"]
+
+
+class Counter(_Metric):
+    """A monotonically increasing count; exposed with the conventional ``_total`` suffix."""
+
+    TYPE = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class _GaugeChild:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self.value -= amount
+
+    @contextmanager
+    def track_inprogress(self):
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+    def samples(self, name, labelnames, values):
+        return [f"{name}{_format_labels(labelnames, values)} {_format_value(self.value)}"]
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, such as requests in flight."""
+
+    TYPE = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def samples(self, name, labelnames, values):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            le = "+Inf" if math.isinf(bound) else repr(float(bound))
+            lines.append(f"{name}_bucket{_format_labels(labelnames, values, [('le', le)])} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labelnames, values)} {_format_value(total)}")
+        lines.append(f"{name}_count{_format_labels(labelnames, values)} {cumulative}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets, plus their sum and count."""
+
+    TYPE = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+
+class _Callback:
+    """Values read at scrape time from an existing stats source, e.g. a queue depth."""
+
+    def __init__(self, name, documentation, kind, read: Callable[[], dict], labelname: Optional[str] = None):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.read = read
+        self.labelname = labelname
+
+    def collect(self) -> list:
+        try:
+            values = self.read()
+        except Exception:
+            return []
+        if values is None:
+            return []
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        if self.labelname is None:
+            lines.append(f"{self.name} {_format_value(values)}")
+        else:
+            for label, value in sorted(values.items()):
+                lines.append(f"{self.name}{_format_labels([self.labelname], [label])} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric '{metric.name}' is already registered")
+            self._metrics[metric.name] = metric
+
+    def gauge_callback(self, name: str, documentation: str, read: Callable, labelname: Optional[str] = None):
+        """Expose ``read()`` (a number, or {label value: number} with ``labelname``) as a gauge at scrape time."""
+        self.register(_Callback(name, documentation, "gauge", read, labelname))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# --- Instruments ---
+
+HTTP_REQUESTS = Counter(
+    "medimate_http_requests", "HTTP requests handled, by endpoint, method and status code",
+    ["endpoint", "method", "status"])
+HTTP_ERRORS = Counter(
+    "medimate_http_request_errors", "HTTP requests that failed (status >= 400 or an unhandled exception), by endpoint",
+    ["endpoint", "kind"])
+HTTP_IN_FLIGHT = Gauge(
+    "medimate_http_requests_in_flight", "HTTP requests currently being handled, by endpoint", ["endpoint"])
+HTTP_DURATION = Histogram(
+    "medimate_http_request_duration_seconds", "Time from request start until the response (or stream) completed",
+    ["endpoint"])
+
+VOICE_STAGE_SECONDS = Histogram(
+    "medimate_voice_stage_seconds",
+    "Time spent in each stage of a voice upload: upload_read, decode, extraction (queue + worker), normalize, "
+    "sound_load, pitch, point_process, intensity, harmonicity, perturbation, predict and model_forward",
+    ["stage"])
+
+GEMINI_SECONDS = Histogram(
+    "medimate_gemini_seconds", "Gemini call latency by service, to the first chunk and in total",
+    ["service", "phase"])
+GEMINI_ERRORS = Counter("medimate_gemini_errors", "Gemini calls that raised, by service", ["service"])
+
+
+@contextmanager
+def gemini_call(service: str):
+    """
+    Time one Gemini call. The context yields a function to call when the first chunk arrives;
+    a non-streamed call that never calls it counts its total as the time to the first chunk.
+    Within a sampled trace the call is also a client span, with a ``first_chunk`` event.
+    """
+    started = time.perf_counter()
+    first = []
+
+    with tracing.span(f"gemini {service}", tracing.CLIENT, **{"gen_ai.system": "gemini", "medimate.service": service}) as span:
+        def first_chunk():
+            if not first:
+                first.append(time.perf_counter() - started)
+                span.add_event("first_chunk")
+
+        try:
+            yield first_chunk
+        except Exception:
+            GEMINI_ERRORS.labels(service).inc()
+            raise
+    # Calls abandoned part-way (client gone, task cancelled) are not observed
+    total = time.perf_counter() - started
+    GEMINI_SECONDS.labels(service, "first_chunk").observe(first[0] if first else total)
+    GEMINI_SECONDS.labels(service, "total").observe(total)
+
+
+class EndpointResolver:
+    """
+    Maps a request scope to its route template (``/train-voice-model/jobs/{job_id}``), so ids in
+    paths do not create new series; unmatched paths share the label ``other``.
+    """
+
+    # Paths whose endpoint label is remembered, so most requests skip route matching
+    MAX_CACHED_PATHS = 1024
+
+    def __init__(self):
+        self._routes = None
+        self._endpoints = {}
+
+    def __call__(self, scope) -> str:
+        key = (scope["method"], scope["path"])
+        endpoint = self._endpoints.get(key)
+        if endpoint is not None:
+            return endpoint
+        if self._routes is None:
+            # The router is complete once the first request arrives
+            self._routes = [route for route in scope["app"].router.routes if hasattr(route, "path")]
+        endpoint = "other"
+        for route in self._routes:
+            match, _ = route.matches(scope)
+            if match is Match.FULL:
+                endpoint = route.path
+                break
+        if len(self._endpoints) < self.MAX_CACHED_PATHS:
+            self._endpoints[key] = endpoint
+        return endpoint
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting requests, errors, in-flight requests and durations per endpoint,
+    labelled by route template (see EndpointResolver).
+    """
+
+    def __init__(self, app, skip_paths: Iterable[str] = ("/metrics",)):
+        self.app = app
+        self.skip_paths = set(skip_paths)
+        self._endpoint = EndpointResolver()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            return await self.app(scope, receive, send)
+
+        endpoint = self._endpoint(scope)
+        in_flight = HTTP_IN_FLIGHT.labels(endpoint)
+        status = []
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+            await send(message)
+
+        in_flight.inc()
+        started = time.perf_counter()
+        kind = None
+        try:
+            await self.app(scope, receive, send_with_status)
+        except BaseException:
+            kind = "exception"
+            raise
+        finally:
+            in_flight.dec()
+            HTTP_DURATION.labels(endpoint).observe(time.perf_counter() - started)
+            code = status[0] if status else 500
+            HTTP_REQUESTS.labels(endpoint, scope["method"], str(code)).inc()
+            if kind is None and code >= 400:
+                kind = "server" if code >= 500 else "client"
+            if kind is not None:
+                HTTP_ERRORS.labels(endpoint, kind).inc()
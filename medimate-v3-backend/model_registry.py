@@ -0,0 +1,233 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def data_sha256(path: str) -> str:
+    """
+    Hex sha256 identifying training data: a file's bytes, or for a directory (e.g. a Parquet
+    dataset) the names and bytes of its files in sorted order.
+    """
+    digest = hashlib.sha256()
+    if os.path.isdir(path):
+        files = sorted(os.path.relpath(os.path.join(folder, name), path)
+                       for folder, _, names in os.walk(path) for name in names)
+    else:
+        files = [None]
+    for name in files:
+        if name is not None:
+            digest.update(name.encode() + b"\0")
+        with open(path if name is None else os.path.join(path, name), "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_json_atomically(path, payload):
+    temporary = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(temporary, "w") as f:
+        json.dump(payload, f, indent=2)
+    os.replace(temporary, path)
+
+
+class UnknownModelVersion(LookupError):
+    """Raised for a version that is not in the registry."""
+
+
+class ModelRegistry:
+    """
+    A directory of versioned voice model artifacts.
+
+    Every version is a subdirectory (``v0001``, ``v0002``, ...) holding its artifacts, one file
+    per backend (see ARTIFACTS), and a ``metadata.json`` with its metrics, the sha256 of the
+    training data, the feature list and where it came from; it is never modified once published.
+    ``ACTIVE`` names the version the server loads at startup, and ``history.jsonl`` records every
+    activation and rollback, so a rollback always returns to the version that was active before
+    the current one.
+
+    Versions are published by renaming a fully written temporary directory, and ACTIVE is replaced
+    in one step, so a server starting up never sees a half-written model.
+    """
+
+    ARTIFACTS = {
+        "keras": "model.keras",
+        "numpy": "model.npz",
+        "tflite": "model.tflite",
+        "onnx": "model.onnx",
+    }
+    METADATA = "metadata.json"
+
+    def __init__(self, root: str):
+        self.root = root
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    # --- Versions ---
+
+    def _version_dir(self, version: str) -> str:
+        return os.path.join(self.root, version)
+
+    def _version_names(self):
+        names = []
+        for name in os.listdir(self.root):
+            if name.startswith("v") and name[1:].isdigit() and os.path.isfile(os.path.join(self.root, name, self.METADATA)):
+                names.append(name)
+        return sorted(names, key=lambda name: int(name[1:]))
+
+    def __contains__(self, version) -> bool:
+        return isinstance(version, str) and os.path.isfile(os.path.join(self._version_dir(version), self.METADATA))
+
+    def metadata(self, version: str) -> dict:
+        if version not in self:
+            raise UnknownModelVersion(f"Unknown model version '{version}'")
+        with open(os.path.join(self._version_dir(version), self.METADATA)) as f:
+            return json.load(f)
+
+    def versions(self) -> list:
+        """Metadata of every version, oldest first"""
+        return [self.metadata(version) for version in self._version_names()]
+
+    def artifact_path(self, version: str, backend: str) -> Optional[str]:
+        """Path of the artifact that ``backend`` loads for ``version``, or None if the version has none"""
+        if version not in self:
+            raise UnknownModelVersion(f"Unknown model version '{version}'")
+        path = os.path.join(self._version_dir(version), self.ARTIFACTS[backend])
+        return path if os.path.exists(path) else None
+
+    def register(self, artifacts: dict, metrics: Optional[dict] = None, training_data_sha256: Optional[str] = None,
+                 training_rows: Optional[int] = None, feature_names: Optional[list] = None,
+                 source: Optional[str] = None, parent: Optional[str] = None, **extra) -> str:
+        """
+        Copy ``artifacts`` ({backend name: file path}) into a new version and return its name.
+        The version is not activated.
+        """
+        unknown = set(artifacts) - set(self.ARTIFACTS)
+        if unknown or not artifacts:
+            raise ValueError(f"Artifacts must be keyed by backend name ({sorted(self.ARTIFACTS)}), got {sorted(artifacts)}")
+
+        staging = os.path.join(self.root, f".staging-{uuid.uuid4().hex}")
+        os.makedirs(staging)
+        try:
+            for backend, path in artifacts.items():
+                shutil.copyfile(path, os.path.join(staging, self.ARTIFACTS[backend]))
+            fingerprint = None
+            if "numpy" in artifacts:
+                # Identifies the weights the same way the serving backends do, without TensorFlow
+                from inference_backends import NumpyMLPBackend
+                fingerprint = NumpyMLPBackend.from_file(os.path.join(staging, self.ARTIFACTS["numpy"])).fingerprint
+            metadata = {
+                "version": None,
+                "created_at": _now(),
+                "source": source,
+                "parent": parent,
+                "artifacts": sorted(artifacts),
+                "fingerprint": fingerprint,
+                "feature_names": list(feature_names) if feature_names is not None else None,
+                "metrics": metrics or {},
+                "training_data_sha256": training_data_sha256,
+                "training_rows": training_rows,
+                **extra,
+            }
+
+            with self._lock:
+                while True:
+                    names = self._version_names()
+                    version = f"v{(int(names[-1][1:]) + 1 if names else 1):04d}"
+                    metadata["version"] = version
+                    _write_json_atomically(os.path.join(staging, self.METADATA), metadata)
+                    try:
+                        # Fails if another process published the same version first; take the next one
+                        os.rename(staging, self._version_dir(version))
+                        break
+                    except OSError:
+                        if not os.path.exists(self._version_dir(version)):
+                            raise
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        logger.info(f"Registered voice model {version} ({', '.join(sorted(artifacts))}) from {source}")
+        return version
+
+    # --- Activation ---
+
+    @property
+    def active(self) -> Optional[str]:
+        """The version the server should serve, or None if nothing has been activated"""
+        try:
+            with open(os.path.join(self.root, "ACTIVE")) as f:
+                version = f.read().strip()
+        except FileNotFoundError:
+            return None
+        return version or None
+
+    def _history(self) -> list:
+        try:
+            with open(os.path.join(self.root, "history.jsonl")) as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def _stack(self) -> list:
+        """Activated versions, most recent last: an activation pushes, a rollback pops"""
+        stack = []
+        for entry in self._history():
+            if entry["action"] == "rollback":
+                if stack:
+                    stack.pop()
+            else:
+                stack.append(entry["version"])
+        return stack
+
+    def rollback_target(self) -> Optional[str]:
+        """The version a rollback would return to"""
+        stack = self._stack()
+        return stack[-2] if len(stack) > 1 else None
+
+    def set_active(self, version: str, rollback: bool = False) -> Optional[str]:
+        """Make ``version`` the startup version and record it in the history; returns the previous one"""
+        if version not in self:
+            raise UnknownModelVersion(f"Unknown model version '{version}'")
+        with self._lock:
+            previous = self.active
+            temporary = os.path.join(self.root, f"ACTIVE.{uuid.uuid4().hex}.tmp")
+            with open(temporary, "w") as f:
+                f.write(version + "\n")
+            os.replace(temporary, os.path.join(self.root, "ACTIVE"))
+            with open(os.path.join(self.root, "history.jsonl"), "a") as f:
+                f.write(json.dumps({"action": "rollback" if rollback else "activate", "version": version,
+                                    "previous": previous, "at": _now()}) + "\n")
+        return previous
+
+    def history(self) -> list:
+        return self._history()
+
+    # --- Bootstrap ---
+
+    def import_existing(self, candidates: list, feature_names: Optional[list] = None) -> Optional[str]:
+        """
+        Seed an empty registry with models saved before it existed. ``candidates`` is a list of
+        ``(artifacts, source)`` pairs, oldest first; missing files are skipped. The newest imported
+        version becomes active. Does nothing if the registry already has versions.
+        """
+        if self._version_names():
+            return None
+        version = None
+        for artifacts, source in candidates:
+            artifacts = {backend: path for backend, path in artifacts.items() if path and os.path.exists(path)}
+            if artifacts:
+                version = self.register(artifacts, feature_names=feature_names, source=source)
+        if version is not None:
+            self.set_active(version)
+        return version
@@ -0,0 +1,223 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class OCRResultCache:
+    """
+    Content-addressed cache for medication label OCR results.
+
+    Entries are keyed by the SHA-256 of ``namespace`` and the normalized image
+    bytes (the JPEG that would be sent to Gemini). The namespace identifies
+    what produced the results (model, prompt, parsing); entries written under
+    another namespace are deleted when the cache is opened, so a deploy that
+    changes any of those never serves results in the old format. A small in-memory LRU tier sits in front
+    of an on-disk tier of JSON files; both honour ``ttl`` and the disk tier is
+    trimmed oldest-first once it exceeds ``max_disk_bytes``.
+
+    When ``phash_distance`` is set, each entry also stores a 64-bit difference
+    hash of the image and a miss on the exact key falls back to the closest
+    entry within that Hamming distance, so near-duplicate photos of the same
+    label are served from the cache too.
+    """
+
+    def __init__(self, cache_dir: str = "ocr_cache", max_memory_entries: int = 256,
+                 max_disk_bytes: int = 200 * 1024 * 1024, ttl: float = 7 * 24 * 3600,
+                 phash_distance: Optional[int] = None, namespace: str = ""):
+        self.cache_dir = cache_dir
+        self.namespace = namespace
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        self.phash_distance = phash_distance
+        self._memory: "OrderedDict[str, tuple[float, Optional[int], dict]]" = OrderedDict()
+        # key -> (created, phash, size) for every entry on disk
+        self._disk_index: "OrderedDict[str, tuple[float, Optional[int], int]]" = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.hits_phash = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_disk_index()
+
+    def key(self, image_bytes: bytes) -> str:
+        digest = hashlib.sha256(self.namespace.encode() + b"\0")
+        digest.update(image_bytes)
+        return digest.hexdigest()
+
+    @staticmethod
+    def perceptual_hash(img) -> int:
+        """64-bit difference hash (dHash) of a PIL image."""
+        small = img.convert("L").resize((9, 8))
+        pixels = list(small.getdata())
+        value = 0
+        for row in range(8):
+            for col in range(8):
+                left = pixels[row * 9 + col]
+                right = pixels[row * 9 + col + 1]
+                value = (value << 1) | (1 if left > right else 0)
+        return value
+
+    def get(self, key: str, phash: Optional[int] = None) -> Optional[dict]:
+        """Return the cached result for ``key`` (or a near-duplicate of ``phash``), or None."""
+        with self._lock:
+            result = self._get_exact(key)
+            if result is not None:
+                return result
+            if phash is not None and self.phash_distance is not None:
+                near_key = self._find_near_duplicate(phash)
+                if near_key is not None:
+                    result = self._get_exact(near_key, count=False)
+                    if result is not None:
+                        self.hits_phash += 1
+                        return result
+            self.misses += 1
+            return None
+
+    def put(self, key: str, result: dict, phash: Optional[int] = None):
+        created = time.time()
+        with self._lock:
+            self._remember(key, created, phash, result)
+            path = self._path(key)
+            payload = json.dumps({"created": created, "namespace": self.namespace, "phash": phash, "result": result})
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "w") as f:
+                    f.write(payload)
+                os.replace(tmp_path, path)
+            except OSError as write_err:
+                logger.warning(f"Could not write OCR cache entry {key}: {write_err}")
+                return
+            self._forget_disk(key)
+            size = len(payload)
+            self._disk_index[key] = (created, phash, size)
+            self._disk_bytes += size
+            self._trim_disk()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits_memory + self.hits_disk + self.hits_phash + self.misses
+            hits = lookups - self.misses
+            return {
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "hits_phash": self.hits_phash,
+                "misses": self.misses,
+                "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": len(self._disk_index),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    # --- Internal helpers (called with the lock held) ---
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def _get_exact(self, key: str, count: bool = True) -> Optional[dict]:
+        entry = self._memory.get(key)
+        if entry is not None:
+            created, _, result = entry
+            if not self._expired(created):
+                self._memory.move_to_end(key)
+                if count:
+                    self.hits_memory += 1
+                return result
+            del self._memory[key]
+
+        if key not in self._disk_index:
+            return None
+        created, phash, _ = self._disk_index[key]
+        if self._expired(created):
+            self._remove_disk(key)
+            return None
+        try:
+            with open(self._path(key)) as f:
+                result = json.load(f)["result"]
+        except (OSError, ValueError, KeyError) as read_err:
+            logger.warning(f"Dropping unreadable OCR cache entry {key}: {read_err}")
+            self._remove_disk(key)
+            return None
+        self._remember(key, created, phash, result)
+        if count:
+            self.hits_disk += 1
+        return result
+
+    def _find_near_duplicate(self, phash: int) -> Optional[str]:
+        best_key, best_distance = None, self.phash_distance + 1
+        for key, (created, entry_phash, _) in self._disk_index.items():
+            if entry_phash is None or self._expired(created):
+                continue
+            distance = (entry_phash ^ phash).bit_count()
+            if distance < best_distance:
+                best_key, best_distance = key, distance
+        return best_key
+
+    def _remember(self, key: str, created: float, phash: Optional[int], result: dict):
+        self._memory[key] = (created, phash, result)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _forget_disk(self, key: str):
+        entry = self._disk_index.pop(key, None)
+        if entry is not None:
+            self._disk_bytes -= entry[2]
+
+    def _remove_disk(self, key: str):
+        self._forget_disk(key)
+        self._memory.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _trim_disk(self):
+        # The index is ordered oldest-first, so evict from the front
+        while self._disk_bytes > self.max_disk_bytes and self._disk_index:
+            oldest_key = next(iter(self._disk_index))
+            self._remove_disk(oldest_key)
+
+    def _load_disk_index(self):
+        entries = []
+        outdated = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    with open(path) as f:
+                        data = json.load(f)
+                    if data.get("namespace", "") != self.namespace:
+                        # Produced by another model, prompt or parser
+                        os.remove(path)
+                        outdated += 1
+                        continue
+                    entries.append((data["created"], name[:-len(".json")], data.get("phash"), os.path.getsize(path)))
+                except (OSError, ValueError, KeyError):
+                    continue
+        for created, key, phash, size in sorted(entries):
+            if self._expired(created):
+                self._remove_disk(key)
+                continue
+            self._disk_index[key] = (created, phash, size)
+            self._disk_bytes += size
+        self._trim_disk()
+        if outdated:
+            logger.info(f"OCR cache removed {outdated} entries from an earlier model, prompt or parser")
+        if self._disk_index:
+            logger.info(f"OCR cache loaded {len(self._disk_index)} entries ({self._disk_bytes} bytes) from {self.cache_dir}")
@@ -0,0 +1,271 @@
+import asyncio
+import cProfile
+import hmac
+import io
+import json
+import logging
+import marshal
+import os
+import pstats
+import random
+import shutil
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class StackSampler:
+    """
+    Samples the stacks of every thread every ``interval`` seconds from a background thread.
+    This catches work cProfile cannot see, such as audio decoding and model forward passes run
+    with asyncio.to_thread. Stacks are counted in the folded format flame graph tools read.
+    """
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                # Threads that are only waiting (event loop selector, idle pool workers) are still sampled,
+                # so wall-clock time spent waiting on I/O shows up too
+                self.stacks[";".join([names.get(ident, str(ident)), *reversed(stack)])] += 1
+            self.samples += 1
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class ProfileStore:
+    """
+    Profiles kept on disk as a ring buffer: one directory per profiled request, oldest removed
+    once there are more than ``max_profiles``. Each holds ``meta.json`` and the artefacts named
+    in ARTIFACTS.
+    """
+
+    ARTIFACTS = {
+        "cprofile.prof": "application/octet-stream",  # pstats data for snakeviz, pstats or gprof2dot
+        "cprofile.txt": "text/plain",                 # the top functions by cumulative time
+        "stacks.folded": "text/plain",                # sampled stacks of every thread, for flame graphs
+        "allocations.txt": "text/plain",              # tracemalloc diff over the request
+    }
+
+    def __init__(self, directory: str = "profiles", max_profiles: int = 20):
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _profile_ids(self) -> list:
+        # Ids start with a sortable timestamp, so name order is age order
+        return sorted(name for name in os.listdir(self.directory)
+                      if os.path.isfile(os.path.join(self.directory, name, "meta.json")))
+
+    def save(self, profile_id: str, meta: dict, artifacts: dict):
+        staging = os.path.join(self.directory, f".staging-{profile_id}")
+        os.makedirs(staging)
+        for name, content in artifacts.items():
+            with open(os.path.join(staging, name), "wb" if isinstance(content, bytes) else "w") as f:
+                f.write(content)
+        with open(os.path.join(staging, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=2)
+        with self._lock:
+            os.rename(staging, os.path.join(self.directory, profile_id))
+            profile_ids = self._profile_ids()
+            for old in profile_ids[:max(0, len(profile_ids) - self.max_profiles)]:
+                shutil.rmtree(os.path.join(self.directory, old), ignore_errors=True)
+
+    def list(self) -> list:
+        """Metadata of the stored profiles, newest first"""
+        profiles = []
+        for profile_id in reversed(self._profile_ids()):
+            try:
+                with open(os.path.join(self.directory, profile_id, "meta.json")) as f:
+                    profiles.append(json.load(f))
+            except FileNotFoundError:
+                continue  # evicted meanwhile
+        return profiles
+
+    def artifact_path(self, profile_id: str, artifact: str) -> Optional[str]:
+        if artifact not in self.ARTIFACTS or os.path.basename(profile_id) != profile_id or profile_id.startswith("."):
+            return None
+        path = os.path.join(self.directory, profile_id, artifact)
+        return path if os.path.isfile(path) else None
+
+
+class _RequestProfile:
+    """cProfile of the event loop thread, stack samples of all threads and a tracemalloc diff for one request."""
+
+    def __init__(self, sample_interval: float, memory_frames: int):
+        self.profiler = cProfile.Profile()
+        self.sampler = StackSampler(sample_interval)
+        self.memory_frames = memory_frames
+        self._started_tracemalloc = False
+        self._before = None
+
+    def start(self):
+        # First, since it fails if another profiler is attached, before anything needs undoing
+        self.profiler.enable()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.memory_frames)
+            self._started_tracemalloc = True
+        tracemalloc.reset_peak()
+        self._before = tracemalloc.take_snapshot()
+        self.sampler.start()
+
+    def stop(self):
+        self.profiler.disable()
+        self.sampler.stop()
+        after = tracemalloc.take_snapshot()
+        _, self.peak_bytes = tracemalloc.get_traced_memory()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+        self._after = after
+
+    def artifacts(self, top: int = 60) -> dict:
+        """Render the reports; runs in a worker thread once the request is done"""
+        text = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=text)
+        # The same bytes Stats.dump_stats writes, so pstats.Stats(path) and snakeviz can read the file
+        prof = marshal.dumps(stats.stats)
+        stats.sort_stats("cumulative").print_stats(top)
+
+        # Also leave out the profiler's own frames, e.g. the previous profile's report still rendering
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                   tracemalloc.Filter(False, __file__, all_frames=True)]
+        diff = self._after.filter_traces(filters).compare_to(self._before.filter_traces(filters), "traceback")
+        lines = [f"Peak traced memory during the request: {self.peak_bytes / 1024:.1f} KiB", ""]
+        for stat in diff[:top]:
+            lines.append(f"{stat.size_diff / 1024:+.1f} KiB in {stat.count_diff:+d} blocks "
+                         f"(now {stat.size / 1024:.1f} KiB in {stat.count} blocks)")
+            lines.extend(f"    {line}" for line in stat.traceback.format(most_recent_first=True))
+        return {
+            "cprofile.prof": prof,
+            "cprofile.txt": text.getvalue(),
+            "stacks.folded": self.sampler.folded(),
+            "allocations.txt": "\n".join(lines) + "\n",
+        }
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling individual requests on demand: those sending the admin token in
+    ``X-Profile-Token``, and a random ``sample_rate`` fraction of the rest, limited to ``paths``
+    (all paths when empty). One request is profiled at a time; others run normally meanwhile.
+
+    The report covers the whole request including a streamed body: cProfile of the event loop
+    thread, stack samples of every thread and a tracemalloc diff. Work in other processes
+    (Praat feature extraction, training jobs) is not included. The profile id is returned in
+    ``X-Profile-Id``; the artefacts are written to ``store`` after the response is complete.
+
+    The middleware should only be installed when profiling is enabled, so requests pay nothing otherwise.
+    """
+
+    def __init__(self, app, store: ProfileStore, token: Optional[str] = None, sample_rate: float = 0.0,
+                 paths: Iterable[str] = (), skip_paths: Iterable[str] = (), sample_interval: float = 0.005,
+                 memory_frames: int = 10):
+        self.app = app
+        self.store = store
+        self.token = token.encode() if token else None
+        self.sample_rate = sample_rate
+        self.paths = set(paths)
+        self.skip_paths = tuple(skip_paths)
+        self.sample_interval = sample_interval
+        self.memory_frames = memory_frames
+        self._busy = threading.Lock()
+
+    def _requested(self, scope) -> Optional[str]:
+        """Why this request should be profiled ("token" or "sampled"), or None"""
+        path = scope["path"]
+        if (self.paths and path not in self.paths) or path.startswith(self.skip_paths):
+            return None
+        if self.token is not None:
+            for name, value in scope["headers"]:
+                if name == b"x-profile-token":
+                    return "token" if hmac.compare_digest(value, self.token) else None
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        reason = self._requested(scope)
+        if reason is None or not self._busy.acquire(blocking=False):
+            return await self.app(scope, receive, send)
+
+        profile_id = f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:8]}"
+        status = []
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+                message["headers"] = [*message.get("headers", []), (b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        profile = _RequestProfile(self.sample_interval, self.memory_frames)
+        started_at = datetime.now(timezone.utc).isoformat()
+        started = time.perf_counter()
+        try:
+            try:
+                profile.start()
+            except Exception as e:
+                # e.g. another profiler is already attached to the process; serve the request unprofiled
+                logger.warning(f"Could not start request profiling: {e}")
+                return await self.app(scope, receive, send)
+            try:
+                await self.app(scope, receive, send_with_profile_id)
+            finally:
+                profile.stop()
+        finally:
+            self._busy.release()
+
+        meta = {
+            "id": profile_id,
+            "method": scope["method"],
+            "path": scope["path"],
+            "status": status[0] if status else None,
+            "reason": reason,
+            "started_at": started_at,
+            "duration_seconds": round(time.perf_counter() - started, 4),
+            "stack_samples": profile.sampler.samples,
+            "peak_traced_bytes": profile.peak_bytes,
+            "artifacts": sorted(ProfileStore.ARTIFACTS),
+        }
+        try:
+            await asyncio.to_thread(lambda: self.store.save(profile_id, meta, profile.artifacts()))
+            logger.info(f"Saved request profile {profile_id} for {scope['method']} {scope['path']}")
+        except Exception as e:
+            logger.error(f"Could not save request profile {profile_id}: {e}", exc_info=True)
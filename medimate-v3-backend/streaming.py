@@ -0,0 +1,97 @@
+import asyncio
+import json
+from typing import AsyncIterator
+
+
+class FrameCoalescer:
+    """
+    Turns a stream of text pieces into NDJSON (or SSE) frames.
+
+    The first piece is written as soon as it arrives so time-to-first-token is
+    unchanged. After that, text is buffered and flushed when the buffer
+    reaches ``max_bytes`` or when ``max_delay_ms`` has passed since the first
+    buffered piece, whichever comes first. The timer also fires while waiting
+    on a slow upstream, so buffered text is never held back longer than the
+    delay.
+    """
+
+    SSE_HEADERS = {
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",  # stop reverse proxies from buffering the stream
+    }
+
+    def __init__(self, max_bytes: int = 256, max_delay_ms: float = 50.0, sse: bool = False):
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay_ms / 1000.0
+        self.sse = sse
+
+    @property
+    def media_type(self) -> str:
+        return "text/event-stream" if self.sse else "application/json"
+
+    @property
+    def headers(self) -> dict:
+        return dict(self.SSE_HEADERS) if self.sse else {}
+
+    def frame(self, payload: dict) -> str:
+        data = json.dumps(payload)
+        if self.sse:
+            return f"data: {data}\n\n"
+        return data + "\n"
+
+    async def frames(self, pieces: AsyncIterator[str]) -> AsyncIterator[str]:
+        """Yield coalesced ``{"text": ..., "done": False}`` frames for the given text pieces."""
+        loop = asyncio.get_running_loop()
+        iterator = pieces.__aiter__()
+        buffer = []
+        buffered_bytes = 0
+        deadline = None
+        first = True
+        pending = None
+        try:
+            while True:
+                if pending is None:
+                    pending = asyncio.ensure_future(iterator.__anext__())
+                timeout = None if deadline is None else max(0.0, deadline - loop.time())
+                done, _ = await asyncio.wait({pending}, timeout=timeout)
+
+                if not done:
+                    # Delay elapsed while upstream is still producing: flush what we have
+                    yield self.frame({"text": "".join(buffer), "done": False})
+                    buffer, buffered_bytes, deadline = [], 0, None
+                    continue
+
+                task, pending = pending, None
+                try:
+                    text = task.result()
+                except StopAsyncIteration:
+                    break
+                if not text:
+                    continue
+
+                if first:
+                    first = False
+                    yield self.frame({"text": text, "done": False})
+                    continue
+
+                buffer.append(text)
+                buffered_bytes += len(text.encode("utf-8"))
+                if deadline is None:
+                    deadline = loop.time() + self.max_delay
+                if buffered_bytes >= self.max_bytes:
+                    yield self.frame({"text": "".join(buffer), "done": False})
+                    buffer, buffered_bytes, deadline = [], 0, None
+
+            if buffer:
+                yield self.frame({"text": "".join(buffer), "done": False})
+        finally:
+            if pending is not None:
+                # The upstream generator must be idle before it can be closed
+                pending.cancel()
+                try:
+                    await pending
+                except (asyncio.CancelledError, Exception):
+                    pass
+            aclose = getattr(iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
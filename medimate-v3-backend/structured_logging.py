@@ -0,0 +1,229 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+
+from metrics import EndpointResolver
+
+# Set per request by RequestContextMiddleware and copied onto every record logged while it runs,
+# including from threads started with asyncio.to_thread (which copies the context)
+request_id_var = contextvars.ContextVar("request_id", default=None)
+endpoint_var = contextvars.ContextVar("endpoint", default=None)
+sampled_var = contextvars.ContextVar("log_sampled", default=True)
+
+# Attributes every LogRecord has; anything else on a record came from ``extra=`` and is emitted as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+_CONTEXT_ATTRIBUTES = {"request_id", "endpoint"}
+
+
+def _extra_fields(record) -> dict:
+    return {name: value for name, value in vars(record).items()
+            if name not in _RECORD_ATTRIBUTES and name not in _CONTEXT_ATTRIBUTES}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, request id, endpoint and any ``extra=`` fields."""
+
+    def format(self, record) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+            entry["endpoint"] = record.endpoint
+        entry.update(_extra_fields(record))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """The original human-readable format, with the request id and ``extra=`` fields appended."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    def format(self, record) -> str:
+        line = super().format(record)
+        fields = _extra_fields(record)
+        if getattr(record, "request_id", None):
+            fields = {"request_id": record.request_id, **fields}
+        if fields:
+            line += " " + " ".join(f"{name}={value}" for name, value in fields.items())
+        return line
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    Runs in the logging caller's thread, before the record is queued: stamps it with the request
+    id and endpoint from the context, then applies the endpoint's level and the request's sampling decision.
+    Warnings and errors are never sampled out.
+    """
+
+    def __init__(self, default_level: int = logging.INFO, endpoint_levels: Optional[dict] = None):
+        super().__init__()
+        self.default_level = default_level
+        self.endpoint_levels = endpoint_levels or {}
+
+    def filter(self, record) -> bool:
+        endpoint = endpoint_var.get()
+        record.request_id = request_id_var.get()
+        record.endpoint = endpoint
+        if record.levelno < self.endpoint_levels.get(endpoint, self.default_level):
+            return False
+        return record.levelno >= logging.WARNING or sampled_var.get()
+
+
+class BackgroundQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to a QueueListener thread without formatting them, so message interpolation,
+    JSON encoding and the write happen off the request path. When the queue is full the record
+    is dropped (and counted) rather than blocking the caller.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The listener runs in this process, so the record needs no pickling-safe rendering
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _parse_mapping(spec: str, convert) -> dict:
+    """``"/upload-voice=WARNING,/chat=0.5"`` -> {endpoint: convert(value)}"""
+    mapping = {}
+    for item in filter(None, (part.strip() for part in (spec or "").split(","))):
+        endpoint, _, value = item.rpartition("=")
+        if not endpoint:
+            raise ValueError(f"Expected ENDPOINT=VALUE, got '{item}'")
+        mapping[endpoint.strip()] = convert(value.strip())
+    return mapping
+
+
+def _level(name) -> int:
+    level = logging.getLevelName(str(name).upper())
+    if not isinstance(level, int):
+        raise ValueError(f"Unknown log level '{name}'")
+    return level
+
+
+_listener = None
+_handler = None
+
+
+def setup_logging(level: str = "INFO", fmt: str = "json", endpoint_levels: str = "", queue_size: int = 10000,
+                  stream=None) -> BackgroundQueueHandler:
+    """
+    Route the root logger through a bounded queue to a background writer thread.
+
+    ``fmt`` is ``json`` (one object per line) or ``text``. ``endpoint_levels`` overrides the level
+    for individual endpoints, e.g. ``"/upload-voice=WARNING,/chat=DEBUG"``; endpoints are route
+    templates as reported on /metrics. Replaces any handlers already on the root logger.
+    """
+    global _listener, _handler
+    if _listener is not None:
+        _listener.stop()
+
+    default_level = _level(level)
+    levels = _parse_mapping(endpoint_levels, _level)
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+
+    _handler = BackgroundQueueHandler(queue.Queue(maxsize=queue_size))
+    _handler.addFilter(RequestContextFilter(default_level, levels))
+    _listener = logging.handlers.QueueListener(_handler.queue, output)
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(_handler)
+    # Endpoints may be more verbose than the default; the filter enforces the default elsewhere
+    root.setLevel(min([default_level, *levels.values()]))
+    _listener.start()
+    return _handler
+
+
+@atexit.register
+def flush_logging():
+    """Write out everything still queued and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class RequestContextMiddleware:
+    """
+    ASGI middleware giving each HTTP request a request id (the caller's ``X-Request-Id`` if sent)
+    and deciding once per request whether its debug/info records are kept, at the endpoint's
+    sample rate, so a sampled request is logged completely. The id is echoed in the response's
+    ``X-Request-Id`` header, and one ``request completed`` record carries status and duration.
+    """
+
+    def __init__(self, app, sample_rates: str = "", skip_paths=("/metrics", "/ready")):
+        self.app = app
+        self.sample_rates = _parse_mapping(sample_rates, float)
+        self.skip_paths = set(skip_paths)
+        self._endpoint = EndpointResolver()
+        self._logger = logging.getLogger("medimate.requests")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:128]
+                break
+        request_id = request_id or uuid.uuid4().hex
+        endpoint = self._endpoint(scope)
+        rate = self.sample_rates.get(endpoint)
+        tokens = (
+            request_id_var.set(request_id),
+            endpoint_var.set(endpoint),
+            sampled_var.set(rate is None or random.random() < rate),
+        )
+        status = []
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+                message["headers"] = [*message.get("headers", []), (b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            if scope["path"] not in self.skip_paths:
+                self._logger.info("request completed", extra={
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status[0] if status else 500,
+                    "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+                })
+            for var, token in zip((request_id_var, endpoint_var, sampled_var), tokens):
+                var.reset(token)
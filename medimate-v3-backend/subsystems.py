@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Subsystem:
+    """
+    A lazily constructed service with a tracked lifecycle.
+
+    ``get()`` builds the service on first use (and runs its optional warmup),
+    so heavy imports and model construction are deferred until they are
+    needed or until a background warmup asks for them. Concurrent callers
+    wait for the same build. A failed build is remembered and re-raised.
+    """
+
+    PENDING = "pending"
+    LOADING = "loading"
+    READY = "ready"
+    FAILED = "failed"
+
+    def __init__(self, name: str, factory: Callable[[], object], warmup: Optional[Callable[[object], None]] = None):
+        self.name = name
+        self.factory = factory
+        self.warmup = warmup
+        self.state = self.PENDING
+        self.error = None
+        self.load_seconds = None
+        self._value = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.state == self.READY
+
+    def get(self):
+        """Return the service, building and warming it up first if needed."""
+        if self.state == self.READY:
+            return self._value
+        with self._lock:
+            if self.state == self.READY:
+                return self._value
+            if self.state == self.FAILED:
+                raise RuntimeError(f"{self.name} failed to initialize: {self.error}")
+
+            self.state = self.LOADING
+            started = time.perf_counter()
+            logger.info(f"Initializing subsystem '{self.name}'...")
+            try:
+                value = self.factory()
+                if self.warmup is not None:
+                    self.warmup(value)
+            except Exception as e:
+                self.state = self.FAILED
+                self.error = str(e)
+                logger.error(f"Subsystem '{self.name}' failed to initialize: {e}", exc_info=True)
+                raise RuntimeError(f"{self.name} failed to initialize: {e}") from e
+            self._value = value
+            self.load_seconds = round(time.perf_counter() - started, 3)
+            self.state = self.READY
+            logger.info(f"Subsystem '{self.name}' ready in {self.load_seconds}s.")
+            return value
+
+    async def aget(self):
+        """Async variant of get; building happens in a worker thread so the event loop keeps serving."""
+        if self.state == self.READY:
+            return self._value
+        return await asyncio.to_thread(self.get)
+
+    def status(self) -> dict:
+        status = {"state": self.state}
+        if self.load_seconds is not None:
+            status["load_seconds"] = self.load_seconds
+        if self.error is not None:
+            status["error"] = self.error
+        return status
+
+
+async def warm_up(subsystems):
+    """Build every subsystem concurrently; failures are recorded on the subsystem, not raised."""
+    async def load(subsystem):
+        try:
+            await subsystem.aget()
+        except Exception:
+            pass
+
+    await asyncio.gather(*(load(subsystem) for subsystem in subsystems))
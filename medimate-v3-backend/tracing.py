@@ -0,0 +1,347 @@
+import contextvars
+import json
+import logging
+import queue
+import random
+import threading
+import time
+import urllib.request
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# OTLP span kinds
+INTERNAL, SERVER, CLIENT = 1, 2, 3
+# OTLP status codes
+STATUS_OK, STATUS_ERROR = 1, 2
+
+# The span new spans are nested under; None outside a sampled trace, which makes span() a no-op
+_current = contextvars.ContextVar("current_span", default=None)
+
+
+def _new_id(hex_digits: int) -> str:
+    return f"{random.getrandbits(hex_digits * 4):0{hex_digits}x}"
+
+
+def parse_traceparent(header: Optional[str]):
+    """``(trace_id, parent_span_id, sampled)`` from a W3C traceparent header, or None if it is missing or invalid"""
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) < 4 or len(parts[0]) != 2 or parts[0] == "ff" or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        flags = int(parts[3][:2], 16)
+        int(parts[1], 16), int(parts[2], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return parts[1].lower(), parts[2].lower(), bool(flags & 1)
+
+
+class Span:
+    """One timed operation of a sampled trace. Ended spans are handed to the tracer's exporter."""
+
+    __slots__ = ("tracer", "trace_id", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns",
+                 "attributes", "events", "status", "status_message")
+
+    def __init__(self, tracer, trace_id, parent_id, name, kind=INTERNAL, attributes=None, start_ns=None):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = _new_id(16)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes or {}
+        self.events = []
+        self.status = None
+        self.status_message = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def add_event(self, name: str, **attributes):
+        self.events.append((time.time_ns(), name, attributes))
+
+    def set_error(self, message: str):
+        self.status, self.status_message = STATUS_ERROR, message
+
+    def end(self, end_ns: Optional[int] = None):
+        if self.end_ns is None:
+            self.end_ns = end_ns or time.time_ns()
+            self.tracer.exporter.export(self)
+
+
+class _NoopSpan:
+    """Stands in for a span outside a sampled trace, so instrumented code needs no checks."""
+
+    traceparent = None
+
+    def set_attribute(self, key, value):
+        pass
+
+    def add_event(self, name, **attributes):
+        pass
+
+    def set_error(self, message):
+        pass
+
+    def end(self, end_ns=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class _SpanScope:
+    def __init__(self, parent: Span, name: str, kind: int, attributes: dict):
+        self.parent = parent
+        self.span = Span(parent.tracer, parent.trace_id, parent.span_id, name, kind, attributes)
+
+    def __enter__(self) -> Span:
+        _current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self.span.status is None:
+            self.span.set_error(f"{exc_type.__name__}: {exc}" if exc is not None else exc_type.__name__)
+        self.span.end()
+        # Restore the parent by value: async generators may resume (and close) in another task's context
+        _current.set(self.parent)
+        return False
+
+
+def span(name: str, kind: int = INTERNAL, **attributes):
+    """
+    Context manager timing ``name`` as a child of the current span. Outside a sampled trace it
+    returns a shared no-op, so instrumentation costs one context variable lookup.
+    """
+    parent = _current.get()
+    if parent is None:
+        return NOOP_SPAN
+    return _SpanScope(parent, name, kind, attributes)
+
+
+def current_span():
+    """The innermost active span, or a no-op span outside a sampled trace"""
+    return _current.get() or NOOP_SPAN
+
+
+def record_span(name: str, start_ns: int, end_ns: int, **attributes):
+    """Add a child of the current span that was timed elsewhere, e.g. in a worker process or a shared batch."""
+    parent = _current.get()
+    if parent is not None:
+        Span(parent.tracer, parent.trace_id, parent.span_id, name, INTERNAL, attributes, start_ns).end(end_ns)
+
+
+def record_stages(start_ns: Optional[int], stage_seconds: dict):
+    """Add consecutive child spans for stages timed back to back from ``start_ns`` (wall clock, in ns)."""
+    if start_ns is None or _current.get() is None:
+        return
+    for stage, seconds in stage_seconds.items():
+        end_ns = start_ns + int(seconds * 1e9)
+        record_span(stage, start_ns, end_ns)
+        start_ns = end_ns
+
+
+class OTLPJsonExporter:
+    """
+    Batches ended spans on a background thread and writes them as OTLP/JSON
+    ``ExportTraceServiceRequest`` documents: appended one per line to a file (the layout the
+    OpenTelemetry Collector's ``otlpjsonfile`` receiver reads) or POSTed to a collector's
+    ``/v1/traces`` endpoint when ``target`` is an http(s) URL. Spans arriving while the queue
+    is full are dropped and counted, so a slow collector never stalls requests.
+    """
+
+    def __init__(self, target: str, service_name: str = "medimate-backend", max_queue: int = 10000,
+                 max_batch: int = 512, flush_interval: float = 2.0, timeout: float = 5.0):
+        self.target = target
+        self.service_name = service_name
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def export(self, span: Span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                    self._thread.start()
+
+    def flush(self):
+        """Write out every span queued so far; also called on shutdown."""
+        # Spans are only taken off the queue under the lock, so a concurrent flush waits for them to be written
+        with self._write_lock:
+            while True:
+                batch = self._drain()
+                if not batch:
+                    return
+                self._write(batch)
+
+    def _drain(self) -> list:
+        batch = []
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def _write(self, spans: list):
+        payload = json.dumps(self.encode(spans), separators=(",", ":"))
+        try:
+            if self.target.startswith(("http://", "https://")):
+                request = urllib.request.Request(self.target, data=payload.encode(), method="POST",
+                                                 headers={"Content-Type": "application/json"})
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    response.read()
+            else:
+                with open(self.target, "a") as f:
+                    f.write(payload + "\n")
+            self.exported += len(spans)
+        except Exception as e:
+            self.failed += len(spans)
+            logger.warning(f"Could not export {len(spans)} spans to {self.target}: {e}")
+
+    def encode(self, spans: list) -> dict:
+        return {"resourceSpans": [{
+            "resource": {"attributes": _attributes({"service.name": self.service_name})},
+            "scopeSpans": [{"scope": {"name": "medimate.tracing"}, "spans": [_encode_span(s) for s in spans]}],
+        }]}
+
+
+def _value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _attributes(attributes: dict) -> list:
+    return [{"key": key, "value": _value(value)} for key, value in attributes.items() if value is not None]
+
+
+def _encode_span(span: Span) -> dict:
+    encoded = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": span.kind,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": _attributes(span.attributes),
+        "status": {"code": span.status or STATUS_OK},
+    }
+    if span.parent_id:
+        encoded["parentSpanId"] = span.parent_id
+    if span.status_message:
+        encoded["status"]["message"] = span.status_message
+    if span.events:
+        encoded["events"] = [{"timeUnixNano": str(at), "name": name, "attributes": _attributes(attributes)}
+                             for at, name, attributes in span.events]
+    return encoded
+
+
+class Tracer:
+    """
+    Starts traces with head sampling: a request carrying a traceparent header follows the caller's
+    sampling decision (parent-based), any other request is sampled with probability ``sample_rate``.
+    """
+
+    def __init__(self, exporter: OTLPJsonExporter, sample_rate: float = 1.0):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+
+    def start_trace(self, name: str, traceparent: Optional[str] = None, kind: int = SERVER, **attributes):
+        """A root (or remote-parented) span, or None when the trace is not sampled"""
+        parent = parse_traceparent(traceparent)
+        if parent is not None:
+            trace_id, parent_id, sampled = parent
+        else:
+            trace_id, parent_id, sampled = _new_id(32), None, random.random() < self.sample_rate
+        if not sampled:
+            return None
+        return Span(self, trace_id, parent_id, name, kind, attributes)
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware opening a server span per sampled HTTP request, continuing the trace from an
+    incoming ``traceparent`` header. The span's context is returned in the response's
+    ``traceparent`` header so a slow request can be looked up by its trace id.
+    ``endpoint`` maps a scope to its route template (see metrics.EndpointResolver).
+    """
+
+    def __init__(self, app, tracer: Tracer, endpoint: Callable[[dict], str],
+                 skip_paths=("/metrics", "/ready")):
+        self.app = app
+        self.tracer = tracer
+        self.endpoint = endpoint
+        self.skip_paths = set(skip_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            return await self.app(scope, receive, send)
+
+        traceparent = None
+        for name, value in scope["headers"]:
+            if name == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+        route = self.endpoint(scope)
+        root = self.tracer.start_trace(f"{scope['method']} {route}", traceparent, **{
+            "http.method": scope["method"], "http.route": route, "http.target": scope["path"]})
+        if root is None:
+            return await self.app(scope, receive, send)
+
+        async def send_with_traceparent(message):
+            if message["type"] == "http.response.start":
+                root.set_attribute("http.status_code", message["status"])
+                if message["status"] >= 500:
+                    root.set_error(f"HTTP {message['status']}")
+                message["headers"] = [*message.get("headers", []), (b"traceparent", root.traceparent.encode())]
+            await send(message)
+
+        token = _current.set(root)
+        try:
+            await self.app(scope, receive, send_with_traceparent)
+        except BaseException as e:
+            root.set_error(f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            _current.reset(token)
+            root.end()
+
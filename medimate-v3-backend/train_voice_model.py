@@ -1,53 +1,72 @@
+import argparse
+import itertools
+import json
+import multiprocessing
 import pandas as pd
 import numpy as np
 import os
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 import tensorflow as tf
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import KFold, train_test_split
 from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
 import matplotlib.pyplot as plt
+from voice_analyzer import FEATURE_NAMES
 import warnings
 warnings.filterwarnings('ignore')
 
-# Define the feature names from the dataset
-FEATURE_NAMES = [
-    'meanF0', 'stdevF0', 'meanIntensity', 'stdevIntensity', 'HNR',
-    'localJitter', 'localabsoluteJitter', 'rapJitter', 'ppq5Jitter',
-    'localShimmer', 'localdbShimmer', 'apq3Shimmer', 'aqpq5Shimmer', 'apq11Shimmer'
-]
-
 # Define the output directory for models
 MODEL_DIR = 'models'
 os.makedirs(MODEL_DIR, exist_ok=True)
 
+# The registry the server loads its active model from (see model_registry.py)
+DEFAULT_REGISTRY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model_registry')
+
 def load_data(csv_path):
-    """Load training data from CSV file."""
+    """Load training data from a CSV file or a Parquet table (e.g. written by extract_training_features.py)."""
     print(f"Loading data from {csv_path}...")
     try:
-        df = pd.read_csv(csv_path)
+        df = pd.read_parquet(csv_path) if csv_path.endswith('.parquet') else pd.read_csv(csv_path)
+        # Recordings extracted without a label cannot be trained on
+        df = df.dropna(subset=['glucose_level'])
         print(f"Data loaded successfully. Shape: {df.shape}")
         return df
     except Exception as e:
         print(f"Error loading data: {e}")
         raise
 
-def create_model():
-    """Create a TensorFlow/Keras model matching the architecture in voice_analyzer.py"""
-    model = tf.keras.Sequential([
-        tf.keras.layers.Dense(64, activation='relu', input_shape=(14,)),
-        tf.keras.layers.Dropout(0.2),
-        tf.keras.layers.Dense(32, activation='relu'),
-        tf.keras.layers.Dropout(0.2),
-        tf.keras.layers.Dense(1)  # Output layer for glucose level prediction
-    ])
-    
-    model.compile(optimizer='adam',
+# Architecture and training settings; the defaults match the architecture in voice_analyzer.py
+DEFAULT_PARAMS = {'units': (64, 32), 'dropout': 0.2, 'learning_rate': 1e-3, 'batch_size': 8}
+
+def create_model(units=(64, 32), dropout=0.2, learning_rate=1e-3):
+    """Create a TensorFlow/Keras model: ReLU Dense layers of the given widths, each followed by dropout"""
+    layers = []
+    for i, width in enumerate(units):
+        if i == 0:
+            layers.append(tf.keras.layers.Dense(width, activation='relu', input_shape=(14,)))
+        else:
+            layers.append(tf.keras.layers.Dense(width, activation='relu'))
+        layers.append(tf.keras.layers.Dropout(dropout))
+    layers.append(tf.keras.layers.Dense(1))  # Output layer for glucose level prediction
+    model = tf.keras.Sequential(layers)
+    
+    model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate),
                  loss='mse',
                  metrics=['mae'])
     
     return model
 
-def train_model(df, model_filename='voice_glucose_model.keras'):
-    """Train a Keras model on the provided data and save it."""
+def make_dataset(X, y, batch_size, shuffle=False, seed=None):
+    """In-memory tf.data pipeline: cached tensors, reshuffled every epoch, batched and prefetched."""
+    dataset = tf.data.Dataset.from_tensor_slices((X.astype(np.float32), y.astype(np.float32))).cache()
+    if shuffle:
+        dataset = dataset.shuffle(len(X), seed=seed, reshuffle_each_iteration=True)
+    return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+def train_model(df, model_filename='voice_glucose_model.keras', params=None):
+    """Train a Keras model on the provided data (with ``params`` from DEFAULT_PARAMS or a search) and save it."""
+    params = dict(DEFAULT_PARAMS, **(params or {}))
     print("Preparing data for training...")
     
     # Extract features and target
@@ -64,7 +83,7 @@ def train_model(df, model_filename='voice_glucose_model.keras'):
     
     # Create and train a Keras model
     print("Creating and training Keras model...")
-    model = create_model()
+    model = create_model(params['units'], params['dropout'], params['learning_rate'])
     
     # Add early stopping to prevent overfitting
     early_stopping = tf.keras.callbacks.EarlyStopping(
@@ -77,7 +96,7 @@ def train_model(df, model_filename='voice_glucose_model.keras'):
     history = model.fit(
         X_train, y_train,
         epochs=50,
-        batch_size=8,
+        batch_size=params['batch_size'],
         validation_split=0.2,
         callbacks=[early_stopping],
         verbose=1
@@ -172,15 +191,245 @@ def check_model_on_high_ranges(df, model):
     print(f"High range MAE: {mae:.2f}")
     print(f"High range R²: {r2:.2f}")
 
+# --- Hyperparameter search ---
+
+SEARCH_SPACE = {
+    'units': [(32,), (64,), (32, 16), (64, 32), (128, 64), (128, 64, 32)],
+    'dropout': [0.0, 0.1, 0.2, 0.3],
+    'learning_rate': [3e-4, 1e-3, 3e-3],
+    'batch_size': [8, 16, 32],
+}
+
+# Data shared by every fold, sent to each search worker once rather than with every task
+_search_X = None
+_search_y = None
+
+def _init_search_worker(X, y):
+    """Keep TensorFlow to one thread per worker, so N workers use N cores without contending."""
+    global _search_X, _search_y
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    tf.config.threading.set_intra_op_parallelism_threads(1)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    _search_X, _search_y = X, y
+
+def _run_fold(trial, fold, params, train_index, test_index, epochs, patience, seed):
+    """Fit one configuration on one fold and score it on the held-out part."""
+    started, cpu_started = time.perf_counter(), time.process_time()
+    tf.keras.backend.clear_session()
+    tf.keras.utils.set_random_seed(seed + 1000 * trial + fold)
+
+    # Early stopping watches a slice of the training folds, never the fold being scored
+    rng = np.random.default_rng(seed + fold)
+    shuffled = rng.permutation(train_index)
+    n_val = max(1, int(round(0.2 * len(shuffled))))
+    fit_index, val_index = shuffled[n_val:], shuffled[:n_val]
+
+    model = create_model(params['units'], params['dropout'], params['learning_rate'])
+    early_stopping = tf.keras.callbacks.EarlyStopping(monitor='val_loss', patience=patience, restore_best_weights=True)
+    history = model.fit(
+        make_dataset(_search_X[fit_index], _search_y[fit_index], params['batch_size'], shuffle=True, seed=seed),
+        validation_data=make_dataset(_search_X[val_index], _search_y[val_index], params['batch_size']),
+        epochs=epochs,
+        callbacks=[early_stopping],
+        verbose=0
+    )
+    X_test, y_test = _search_X[test_index], _search_y[test_index]
+    predictions = model.predict(X_test.astype(np.float32), verbose=0).flatten()
+    return {
+        'trial': trial,
+        'fold': fold,
+        'rmse': float(np.sqrt(mean_squared_error(y_test, predictions))),
+        'mae': float(mean_absolute_error(y_test, predictions)),
+        'r2': float(r2_score(y_test, predictions)) if len(y_test) > 1 else float('nan'),
+        'epochs': len(history.history['loss']),
+        'seconds': time.perf_counter() - started,
+        'cpu_seconds': time.process_time() - cpu_started,
+    }
+
+def sample_trials(mode, n_trials, seed):
+    """The configurations to evaluate: the whole grid, or ``n_trials`` distinct random points of it.
+    The default configuration always comes first, as the baseline."""
+    keys = list(SEARCH_SPACE)
+    grid = [dict(zip(keys, values)) for values in itertools.product(*(SEARCH_SPACE[key] for key in keys))]
+    if mode == 'random':
+        rng = np.random.default_rng(seed)
+        grid = [grid[i] for i in rng.choice(len(grid), size=min(n_trials, len(grid)), replace=False)]
+    baseline = dict(DEFAULT_PARAMS)
+    return [baseline] + [params for params in grid if params != baseline]
+
+def should_prune(trial, scores, min_trials=4):
+    """Median rule: stop a trial whose mean RMSE so far is worse than the median of the other trials'
+    mean RMSE over the same number of folds."""
+    done = len(scores[trial])
+    if done == 0:
+        return False
+    others = [np.mean(folds[:done]) for t, folds in scores.items() if t != trial and len(folds) >= done]
+    if len(others) < min_trials:
+        return False
+    return np.mean(scores[trial]) > np.median(others)
+
+def run_search(df, mode='random', n_trials=20, n_folds=5, workers=None, epochs=100, patience=10,
+               seed=42, prune=True):
+    """
+    K-fold cross-validated hyperparameter search over SEARCH_SPACE.
+
+    Every (trial, fold) pair is a task for a process pool. Tasks are queued
+    fold by fold, so every trial reports its first fold before any trial
+    uses more folds, and trials that trail the median are pruned before
+    their remaining folds start. Returns the leaderboard, best first.
+    """
+    X = df[FEATURE_NAMES].values.astype(np.float32)
+    y = df['glucose_level'].values.astype(np.float32)
+    splits = list(KFold(n_splits=n_folds, shuffle=True, random_state=seed).split(X))
+    trials = sample_trials(mode, n_trials, seed)
+    workers = workers or os.cpu_count() or 1
+    print(f"Searching {len(trials)} configuration(s) x {n_folds} folds on {len(X)} rows with {workers} worker(s)...")
+
+    tasks = iter([(trial, fold) for fold in range(n_folds) for trial in range(len(trials))])
+    results = {trial: {} for trial in range(len(trials))}
+    pruned = set()
+    started = time.perf_counter()
+    cpu_seconds = 0.0
+
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_search_worker,
+                             initargs=(X, y)) as executor:
+        in_flight = {}
+        exhausted = False
+        while True:
+            # Queue only a little ahead, so pruning decisions still apply to most of the remaining work
+            while not exhausted and len(in_flight) < workers * 2:
+                task = next(tasks, None)
+                if task is None:
+                    exhausted = True
+                    break
+                trial, fold = task
+                if trial in pruned:
+                    continue
+                train_index, test_index = splits[fold]
+                future = executor.submit(_run_fold, trial, fold, trials[trial], train_index, test_index,
+                                         epochs, patience, seed)
+                in_flight[future] = task
+            if not in_flight:
+                break
+
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                trial, fold = in_flight.pop(future)
+                if future.cancelled():
+                    continue
+                result = future.result()
+                cpu_seconds += result['cpu_seconds']
+                results[trial][fold] = result
+                if prune and len(results[trial]) < n_folds:
+                    scores = {t: [r['rmse'] for r in folds.values()] for t, folds in results.items() if folds}
+                    if should_prune(trial, scores):
+                        pruned.add(trial)
+                        for other, (other_trial, _) in list(in_flight.items()):
+                            if other_trial == trial and other.cancel():
+                                in_flight.pop(other)
+
+    wall_seconds = time.perf_counter() - started
+    leaderboard = []
+    for trial, params in enumerate(trials):
+        folds = list(results[trial].values())
+        if not folds:
+            continue
+        leaderboard.append({
+            'trial': trial,
+            'units': '-'.join(str(width) for width in params['units']),
+            'dropout': params['dropout'],
+            'learning_rate': params['learning_rate'],
+            'batch_size': params['batch_size'],
+            'status': 'pruned' if trial in pruned else 'complete',
+            'folds': len(folds),
+            'mean_rmse': np.mean([r['rmse'] for r in folds]),
+            'std_rmse': np.std([r['rmse'] for r in folds]),
+            'mean_mae': np.mean([r['mae'] for r in folds]),
+            'mean_r2': np.nanmean([r['r2'] for r in folds]) if any(np.isfinite(r['r2']) for r in folds) else np.nan,
+            'mean_epochs': np.mean([r['epochs'] for r in folds]),
+            'seconds': sum(r['seconds'] for r in folds),
+        })
+    # Trials that saw every fold rank ahead of pruned ones, whose scores rest on fewer folds
+    leaderboard.sort(key=lambda row: (row['status'] != 'complete', row['mean_rmse']))
+    for rank, row in enumerate(leaderboard, 1):
+        row['rank'] = rank
+
+    # CPU time over wall-clock time is how many cores the search kept busy on average
+    print(f"Search finished in {wall_seconds:.1f}s wall-clock for {cpu_seconds:.1f} CPU-seconds of training "
+          f"({cpu_seconds / max(wall_seconds, 1e-9):.1f} cores busy on average); {len(pruned)} trial(s) pruned.")
+    return leaderboard, [trials[row['trial']] for row in leaderboard]
+
+def save_leaderboard(leaderboard, best_params, path=os.path.join(MODEL_DIR, 'search_leaderboard.csv')):
+    columns = ['rank', 'trial', 'units', 'dropout', 'learning_rate', 'batch_size', 'status', 'folds',
+               'mean_rmse', 'std_rmse', 'mean_mae', 'mean_r2', 'mean_epochs', 'seconds']
+    table = pd.DataFrame(leaderboard, columns=columns)
+    table.to_csv(path, index=False, float_format='%.4f')
+    with open(os.path.join(MODEL_DIR, 'search_best.json'), 'w') as f:
+        json.dump(dict(best_params, units=list(best_params['units'])), f, indent=2)
+    print(f"Leaderboard saved to {path}")
+    print(table.head(10).to_string(index=False, float_format=lambda value: f"{value:.4g}"))
+
+def register_model(model, registry_root, data_path, rows, rmse, r2, params, activate=False):
+    """Add the trained model (Keras file and NumPy weights) to the model registry the server loads from."""
+    from inference_backends import NumpyMLPBackend
+    from model_registry import ModelRegistry, data_sha256
+
+    registry = ModelRegistry(registry_root)
+    npz_path = os.path.join(MODEL_DIR, 'voice_glucose_model.npz')
+    NumpyMLPBackend.from_keras_model(model).save(npz_path, FEATURE_NAMES)
+    version = registry.register(
+        {'keras': os.path.join(MODEL_DIR, 'voice_glucose_model.keras'), 'numpy': npz_path},
+        metrics={'test_rmse': float(rmse), 'test_r2': float(r2)},
+        training_data_sha256=data_sha256(data_path),
+        training_rows=rows,
+        feature_names=FEATURE_NAMES,
+        source=f"train_voice_model.py --data {data_path}",
+        parent=registry.active,
+        configuration={name: list(value) if isinstance(value, tuple) else value
+                       for name, value in dict(DEFAULT_PARAMS, **(params or {})).items()},
+    )
+    print(f"Registered as {version} in {registry_root}")
+    if activate:
+        registry.set_active(version)
+        print(f"{version} is now the active version (running servers switch on restart or via the activate endpoint)")
+    return version
+
 def main():
     """Main function to run the training pipeline."""
-    csv_path = 'mock_training_data.csv'
+    parser = argparse.ArgumentParser(description="Train the voice glucose model.")
+    parser.add_argument('--data', default='mock_training_data.csv',
+                        help="Training table: CSV or Parquet with FEATURE_NAMES and glucose_level columns")
+    parser.add_argument('--search', choices=['grid', 'random'],
+                        help="Cross-validate configurations from SEARCH_SPACE first, then train the best one")
+    parser.add_argument('--trials', type=int, default=20, help="Random configurations to try (random search)")
+    parser.add_argument('--folds', type=int, default=5, help="Cross-validation folds")
+    parser.add_argument('--workers', type=int, default=0, help="Search worker processes (default: all cores)")
+    parser.add_argument('--epochs', type=int, default=100, help="Most epochs per fold (early stopping usually ends sooner)")
+    parser.add_argument('--no-prune', action='store_true', help="Run every fold of every configuration")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--registry', default=os.getenv('VOICE_MODEL_REGISTRY', DEFAULT_REGISTRY),
+                        help="Model registry the trained model is added to as a new version")
+    parser.add_argument('--no-register', action='store_true', help="Only save to models/, not to the registry")
+    parser.add_argument('--activate', action='store_true',
+                        help="Make the new version the one the server loads at startup (or switch a running "
+                             "server with POST /voice-model/versions/{version}/activate)")
+    args = parser.parse_args()
+    csv_path = args.data
     
     # Load data
     df = load_data(csv_path)
     
+    params = None
+    if args.search:
+        leaderboard, ranked_params = run_search(df, args.search, args.trials, args.folds, args.workers or None,
+                                                args.epochs, seed=args.seed, prune=not args.no_prune)
+        params = ranked_params[0]
+        save_leaderboard(leaderboard, params)
+        print(f"Best configuration: {params}")
+    
     # Train model
-    model, rmse, r2 = train_model(df)
+    model, rmse, r2 = train_model(df, params=params)
     
     # Check model on high glucose ranges
     check_model_on_high_ranges(df, model)
@@ -197,6 +446,10 @@ def main():
         f.write(f"Date trained: {pd.Timestamp.now()}\n")
         f.write(f"Training data: {csv_path}\n")
         f.write(f"Number of samples: {len(df)}\n")
+        f.write(f"Configuration: {dict(DEFAULT_PARAMS, **(params or {}))}\n")
+
+    if not args.no_register:
+        register_model(model, args.registry, csv_path, len(df), rmse, r2, params, activate=args.activate)
     
     return model
 
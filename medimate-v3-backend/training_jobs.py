@@ -0,0 +1,313 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import shutil
+import signal
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def _train_in_subprocess(X, y, train_index, holdout_index, epochs, base_model_path, job_dir, progress):
+    """
+    Training process entry point: fit the model on the training rows, report every epoch on ``progress``
+    and save the result as a Keras file plus NumPy weights, so the server can load it with or without TensorFlow.
+    """
+    # Leave Ctrl+C handling to the server, which stops its jobs on shutdown
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        import tensorflow as tf
+        from inference_backends import NumpyMLPBackend
+        from voice_analyzer import VoiceAnalyzer
+
+        analyzer = VoiceAnalyzer(backend="keras")
+        if base_model_path and base_model_path.endswith(".npz"):
+            # Served from exported NumPy weights: the same Dense layers, in the order Keras keeps them
+            base = NumpyMLPBackend.from_file(base_model_path)
+            analyzer.model.set_weights([array for pair in zip(base.weights, base.biases) for array in pair])
+        elif base_model_path:
+            # Continue from the weights the server was serving, as in-process training did
+            analyzer.load_model(base_model_path)
+
+        class Progress(tf.keras.callbacks.Callback):
+            def on_epoch_end(self, epoch, logs=None):
+                metrics = {name: float(value) for name, value in (logs or {}).items()}
+                progress.put({"type": "epoch", "epoch": epoch + 1, "epochs": epochs, **metrics})
+
+        analyzer.model.fit(
+            X[train_index], y[train_index],
+            epochs=epochs,
+            validation_data=(X[holdout_index], y[holdout_index]),
+            callbacks=[Progress()],
+            verbose=0,
+        )
+
+        keras_path = os.path.join(job_dir, "voice_glucose_model.keras")
+        npz_path = os.path.join(job_dir, "voice_glucose_model.npz")
+        analyzer.save_model(keras_path)
+        NumpyMLPBackend.from_keras_model(analyzer.model).save(npz_path, analyzer.feature_names)
+        progress.put({"type": "done", "keras_path": keras_path, "npz_path": npz_path})
+    except Exception as e:
+        progress.put({"type": "error", "error": f"{type(e).__name__}: {e}"})
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class TrainingRejected(Exception):
+    """Raised when a trained model fails validation and is not swapped in."""
+
+
+class TrainingJobManager:
+    """
+    Runs voice model training as background jobs, one at a time.
+
+    ``submit()`` records a job and returns immediately. The job trains in a
+    spawned process, so the event loop and the served model are untouched
+    while it runs; per-epoch metrics stream back and appear in ``status()``.
+    The trained model is then loaded into the server and validated on rows
+    held out from training: its predictions must be finite, and with
+    ``require_improvement`` its RMSE must not be worse than the served
+    model's on the same rows. A model that passes is warmed up and swapped
+    into the VoiceAnalyzer atomically (see ``VoiceAnalyzer.swap_model``). With a
+    model registry it is registered as a new version, with its metrics and the
+    hash of its training data, and activated; otherwise it is saved to the
+    analyzer's model path. A job's working directory is removed once it finishes.
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    VALIDATING = "validating"
+    SUCCEEDED = "succeeded"
+    REJECTED = "rejected"
+    FAILED = "failed"
+    FINISHED = (SUCCEEDED, REJECTED, FAILED)
+
+    def __init__(self, jobs_dir: str = "training_jobs", holdout_fraction: float = 0.2,
+                 require_improvement: bool = False, timeout: Optional[float] = 3600.0,
+                 warmup_batch_size: int = 1, max_jobs_kept: int = 50):
+        self.jobs_dir = jobs_dir
+        self.holdout_fraction = holdout_fraction
+        self.require_improvement = require_improvement
+        self.timeout = timeout
+        self.warmup_batch_size = warmup_batch_size
+        self.max_jobs_kept = max_jobs_kept
+        self._jobs: "OrderedDict[str, dict]" = OrderedDict()
+        self._tasks = {}
+        self._processes = {}
+        self._slot = None
+
+    def submit(self, analyzer, X: np.ndarray, y: np.ndarray, epochs: int = 50,
+               training_data_sha256: Optional[str] = None) -> dict:
+        """
+        Queue a training job on (X, y); must be called from the event loop. Raises ValueError for unusable data.
+        ``training_data_sha256`` identifies the uploaded data in the registered version's metadata.
+        """
+        X = np.asarray(X, dtype=np.float32)
+        y = np.asarray(y, dtype=np.float32).reshape(-1)
+        if X.ndim != 2 or X.shape[1] != len(analyzer.feature_names):
+            raise ValueError(f"Expected {len(analyzer.feature_names)} feature columns, got shape {X.shape}")
+        if len(X) != len(y) or len(X) < 2:
+            raise ValueError("Training data needs at least 2 rows, each with a glucose_level")
+        if not (np.all(np.isfinite(X)) and np.all(np.isfinite(y))):
+            raise ValueError("Training data contains missing or non-numeric values")
+        if epochs < 1:
+            raise ValueError("epochs must be at least 1")
+
+        # Hold out rows the job never trains on, to validate the result before it is served
+        order = np.random.default_rng().permutation(len(X))
+        holdout = max(1, int(round(self.holdout_fraction * len(X))))
+        holdout_index, train_index = order[:holdout], order[holdout:]
+
+        job_id = uuid.uuid4().hex
+        self._jobs[job_id] = {
+            "id": job_id,
+            "state": self.QUEUED,
+            "created_at": _now(),
+            "started_at": None,
+            "finished_at": None,
+            "epochs": epochs,
+            "training_rows": len(train_index),
+            "holdout_rows": len(holdout_index),
+            "training_data_sha256": training_data_sha256,
+            "progress": None,
+            "validation": None,
+            "model_version": None,
+            "previous_model_version": None,
+            "error": None,
+        }
+        self._forget_old_jobs()
+        self._tasks[job_id] = asyncio.get_running_loop().create_task(
+            self._run(job_id, analyzer, X, y, train_index, holdout_index, epochs))
+        logger.info(f"Training job {job_id} queued: {len(train_index)} training rows, {len(holdout_index)} held out, {epochs} epochs.")
+        return self.status(job_id)
+
+    def status(self, job_id: str) -> Optional[dict]:
+        job = self._jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+    def list(self) -> list:
+        return [dict(job) for job in reversed(self._jobs.values())]
+
+    def shutdown(self):
+        """Stop running training processes and abandon queued jobs."""
+        for process in list(self._processes.values()):
+            if process.is_alive():
+                process.terminate()
+        for task in self._tasks.values():
+            task.cancel()
+
+    def _forget_old_jobs(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job["state"] in self.FINISHED]
+        for job_id in finished[:max(0, len(self._jobs) - self.max_jobs_kept)]:
+            del self._jobs[job_id]
+
+    async def _run(self, job_id, analyzer, X, y, train_index, holdout_index, epochs):
+        job = self._jobs[job_id]
+        if self._slot is None:
+            self._slot = asyncio.Lock()
+        try:
+            async with self._slot:
+                job_dir = os.path.join(self.jobs_dir, job_id)
+                os.makedirs(job_dir, exist_ok=True)
+                base_model_path = None
+                if analyzer.model is not None:
+                    base_model_path = os.path.join(job_dir, "base.keras")
+                    await asyncio.to_thread(analyzer.model.save, base_model_path)
+                elif analyzer.backend.name == "numpy":
+                    base_model_path = os.path.join(job_dir, "base.npz")
+                    await asyncio.to_thread(analyzer.backend.save, base_model_path)
+
+                job["state"] = self.RUNNING
+                job["started_at"] = _now()
+                result = await self._train(job, X, y, train_index, holdout_index, epochs, base_model_path, job_dir)
+
+                job["state"] = self.VALIDATING
+                await asyncio.to_thread(self._validate_and_swap, job, analyzer, result, X[holdout_index], y[holdout_index])
+                job["state"] = self.SUCCEEDED
+                logger.info(f"Training job {job_id} succeeded; now serving {job['model_version']}.")
+        except TrainingRejected as e:
+            job["state"] = self.REJECTED
+            job["error"] = str(e)
+            logger.warning(f"Training job {job_id} rejected: {e}")
+        except asyncio.CancelledError:
+            job["state"] = self.FAILED
+            job["error"] = "Cancelled (server shutting down)"
+            raise
+        except Exception as e:
+            job["state"] = self.FAILED
+            job["error"] = str(e)
+            logger.error(f"Training job {job_id} failed: {e}", exc_info=True)
+        finally:
+            job["finished_at"] = _now()
+            self._tasks.pop(job_id, None)
+            # The trained files are copied into the registry or the model path (or rejected), so none are kept
+            shutil.rmtree(os.path.join(self.jobs_dir, job_id), ignore_errors=True)
+
+    async def _train(self, job, X, y, train_index, holdout_index, epochs, base_model_path, job_dir) -> dict:
+        # spawn rather than fork: the server process may already hold TensorFlow and gRPC threads
+        context = multiprocessing.get_context("spawn")
+        progress = context.Queue()
+        process = context.Process(
+            target=_train_in_subprocess,
+            args=(X, y, train_index, holdout_index, epochs, base_model_path, job_dir, progress),
+            daemon=True,
+        )
+        process.start()
+        self._processes[job["id"]] = process
+        started = time.monotonic()
+        try:
+            while True:
+                try:
+                    message = await asyncio.to_thread(progress.get, True, 0.5)
+                except queue.Empty:
+                    if self.timeout is not None and time.monotonic() - started > self.timeout:
+                        raise TimeoutError(f"Training exceeded {self.timeout}s")
+                    if not process.is_alive():
+                        # Anything the process sent just before exiting is still in the pipe
+                        try:
+                            message = progress.get(timeout=1.0)
+                        except queue.Empty:
+                            raise RuntimeError(f"Training process exited with code {process.exitcode} before finishing")
+                    else:
+                        continue
+                if message["type"] == "epoch":
+                    job["progress"] = {name: value for name, value in message.items() if name != "type"}
+                elif message["type"] == "error":
+                    raise RuntimeError(message["error"])
+                else:
+                    return message
+        finally:
+            await asyncio.to_thread(process.join, 5)
+            if process.is_alive():
+                process.terminate()
+            self._processes.pop(job["id"], None)
+
+    def _validate_and_swap(self, job, analyzer, result, X_holdout, y_holdout):
+        """Load the trained model, check it on the held-out rows and swap it in (runs in a worker thread)."""
+        if analyzer.backend_name == "keras":
+            import tensorflow as tf
+            from inference_backends import KerasBackend
+
+            model = tf.keras.models.load_model(result["keras_path"])
+            backend = KerasBackend(model)
+        else:
+            # Exported runtimes serve the trained weights through NumPy, without loading TensorFlow here
+            from inference_backends import NumpyMLPBackend
+
+            model = None
+            backend = NumpyMLPBackend.from_file(result["npz_path"])
+
+        candidate = np.asarray(backend.predict(X_holdout), dtype=np.float64)
+        if candidate.shape != y_holdout.shape or not np.all(np.isfinite(candidate)):
+            raise TrainingRejected("The trained model produced invalid predictions on the held-out rows")
+        current = np.asarray(analyzer.backend.predict(X_holdout), dtype=np.float64)
+        validation = {
+            "candidate_rmse": float(np.sqrt(np.mean((candidate - y_holdout) ** 2))),
+            "candidate_mae": float(np.mean(np.abs(candidate - y_holdout))),
+            "served_rmse": float(np.sqrt(np.mean((current - y_holdout) ** 2))),
+            "served_mae": float(np.mean(np.abs(current - y_holdout))),
+        }
+        job["validation"] = validation
+        if self.require_improvement and validation["candidate_rmse"] > validation["served_rmse"]:
+            raise TrainingRejected(
+                f"Held-out RMSE {validation['candidate_rmse']:.3f} is worse than the served model's {validation['served_rmse']:.3f}")
+
+        if analyzer.registry is not None:
+            version = analyzer.registry.register(
+                {"keras": result["keras_path"], "numpy": result["npz_path"]},
+                metrics={**validation, **{f"final_{name}": value for name, value in (job["progress"] or {}).items()
+                                          if name not in ("epoch", "epochs")}},
+                training_data_sha256=job["training_data_sha256"],
+                training_rows=job["training_rows"],
+                feature_names=analyzer.feature_names,
+                source=f"training job {job['id']}",
+                parent=analyzer.model_version,
+                epochs=job["epochs"],
+            )
+            job["previous_model_version"] = analyzer.activate_version(
+                version, max_batch_size=self.warmup_batch_size, loaded=(model, backend))
+            job["model_version"] = version
+            return
+
+        job["previous_model_version"] = analyzer.swap_model(model=model, backend=backend,
+                                                            max_batch_size=self.warmup_batch_size)
+        job["model_version"] = analyzer.version_of(backend)
+
+        # Persist where save_model would, and over the served export, replacing each file in one step
+        persisted = [(result["keras_path"], analyzer.model_path)]
+        if analyzer.backend_name == "numpy" and analyzer.backend_path:
+            persisted.append((result["npz_path"], analyzer.backend_path))
+        for source, target in persisted:
+            temporary = target + ".tmp"
+            shutil.copyfile(source, temporary)
+            os.replace(temporary, target)
@@ -0,0 +1,106 @@
+import logging
+from typing import Callable
+
+from fastapi import Request
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+logger = logging.getLogger(__name__)
+
+# Room for the multipart boundaries, part headers and any small form fields around the file
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class RequestTooLarge(ValueError):
+    """Raised when a request body is larger than allowed."""
+
+
+class MalformedUpload(ValueError):
+    """Raised when a multipart upload cannot be parsed or lacks the expected file field."""
+
+
+async def stream_multipart_file(request: Request, field_name: str, on_data: Callable[[bytes], None],
+                                max_file_bytes: int) -> dict:
+    """
+    Stream one file field of a multipart/form-data request into ``on_data`` as chunks arrive.
+
+    Nothing is buffered or spooled: the body is parsed incrementally with python-multipart and every
+    chunk of the file part is handed straight to ``on_data``, which may raise to abort the upload.
+    A Content-Length over the limit is rejected before any of the body is read, and the byte count is
+    enforced again while streaming for chunked requests. Only one file may be sent in the field.
+    Returns the part's filename, content type and size.
+    """
+    max_body_bytes = max_file_bytes + MULTIPART_OVERHEAD_BYTES
+    content_length = request.headers.get("content-length")
+    if content_length is not None and content_length.isdigit() and int(content_length) > max_body_bytes:
+        raise RequestTooLarge(f"Upload of {content_length} bytes exceeds the {max_file_bytes} byte limit.")
+
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise MalformedUpload("Expected a multipart/form-data upload.")
+
+    part = {"headers": {}, "field": None, "name": b"", "value": b""}
+    found = {}
+
+    def on_part_begin():
+        part["headers"] = {}
+        part["field"] = None
+
+    def on_header_field(data, start, end):
+        part["name"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["name"].lower()] = part["value"]
+        part["name"], part["value"] = b"", b""
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        if disposition.get(b"name", b"").decode(errors="replace") == field_name and b"filename" in disposition:
+            if "filename" in found:
+                # A second file would be appended to the first one's stream
+                raise MalformedUpload(f"Expected one file in the '{field_name}' form field, got several.")
+            part["field"] = field_name
+            found["filename"] = disposition[b"filename"].decode(errors="replace")
+            found["content_type"] = part["headers"].get(b"content-type", b"").decode(errors="replace")
+            found["size"] = 0
+
+    def on_part_data(data, start, end):
+        if part["field"] is not None:
+            found["size"] += end - start
+            on_data(bytes(data[start:end]))
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+    })
+
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > max_body_bytes:
+            raise RequestTooLarge(f"Upload exceeds the {max_file_bytes} byte limit.")
+        try:
+            parser.write(chunk)
+        except (RequestTooLarge, MalformedUpload):
+            raise
+        except ValueError as parse_err:
+            # python-multipart reports malformed bodies as ValueError subclasses; errors from on_data pass through
+            if type(parse_err).__module__.startswith(("multipart", "python_multipart")):
+                raise MalformedUpload(f"Could not parse multipart upload: {parse_err}") from parse_err
+            raise
+    parser.finalize()
+
+    if "filename" not in found:
+        raise MalformedUpload(f"No file provided in the '{field_name}' form field.")
+    return found
@@ -1,32 +1,215 @@
 import numpy as np
-import pandas as pd
-from sklearn.pipeline import make_pipeline
-from sklearn.preprocessing import StandardScaler
-from sklearn.svm import SVC
 import parselmouth
 from parselmouth.praat import call
-import tensorflow as tf
 import os
 import logging
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from inference_backends import BACKENDS, KerasBackend, NumpyMLPBackend, load_backend
+from voice_perturbation import perturbation_features, praat_perturbation_features
 
 logger = logging.getLogger(__name__)
 
+# Jitter/shimmer engine: "numpy" computes all nine measures in one vectorized pass, "praat" queries Praat nine times
+PERTURBATION_ENGINES = {"numpy": perturbation_features, "praat": praat_perturbation_features}
+PERTURBATION_ENGINE = os.getenv("VOICE_PERTURBATION_ENGINE", "numpy").lower()
+if PERTURBATION_ENGINE not in PERTURBATION_ENGINES:
+    logger.warning(f"Unknown VOICE_PERTURBATION_ENGINE '{PERTURBATION_ENGINE}'; using 'numpy'.")
+    PERTURBATION_ENGINE = "numpy"
+
+# The model's input columns, in order; training tables and exported models use the same order
+FEATURE_NAMES = [
+    "meanF0", "stdevF0", "meanIntensity", "stdevIntensity", "HNR",
+    "localJitter", "localabsoluteJitter", "rapJitter", "ppq5Jitter",
+    "localShimmer", "localdbShimmer", "apq3Shimmer", "aqpq5Shimmer", "apq11Shimmer"
+]
+
+def extract_voice_features(voice_wav_path, f0min=75, f0max=500):
+    """
+    Extract acoustic features from a WAV voice file.
+    Module-level (and free of TensorFlow) so it can run in a feature extraction worker process.
+    """
+    logger.info(f"Extracting features directly from WAV: {voice_wav_path}")
+
+    # --- Add validation that input is WAV ---
+    if not isinstance(voice_wav_path, str) or not voice_wav_path.lower().endswith('.wav'):
+         logger.error(f"Input to extract_voice_features is not a valid WAV file path: {voice_wav_path}")
+         raise ValueError("extract_voice_features expects a .wav file path.")
+    # -----------------------------------------
+
+    try:
+        # Load the audio file (expects WAV)
+        try:
+            sound = parselmouth.Sound(voice_wav_path)
+        except Exception as ps_load_err:
+             logger.error(f"Parselmouth failed to load sound from '{voice_wav_path}'. Check WAV file integrity.", exc_info=True)
+             raise Exception(f"Failed to load audio using parselmouth: {ps_load_err}") from ps_load_err
+
+        return compute_voice_features(sound, voice_wav_path, f0min, f0max)
+
+    except Exception as e:
+        logger.error(f"Error in feature extraction pipeline for '{voice_wav_path}': {e}", exc_info=True)
+        logger.error(traceback.format_exc())
+        # Re-raise the exception so it's caught by the endpoint handler
+        raise Exception(f"Error extracting voice features from WAV: {e}") from e
+
+
+def extract_voice_features_from_samples(samples, sample_rate, f0min=75, f0max=500, timings=None):
+    """
+    Extract acoustic features from decoded audio: a (channels, n) or (n,) float array scaled to [-1, 1]
+    With a ``timings`` dict, the seconds spent in each stage are recorded in it (see compute_voice_features).
+    """
+    started = time.perf_counter()
+    try:
+        sound = parselmouth.Sound(np.asarray(samples, dtype=np.float64), sampling_frequency=sample_rate)
+    except Exception as ps_load_err:
+        logger.error(f"Parselmouth failed to build a sound from decoded samples: {ps_load_err}", exc_info=True)
+        raise Exception(f"Failed to load audio using parselmouth: {ps_load_err}") from ps_load_err
+    if timings is not None:
+        timings["sound_load"] = time.perf_counter() - started
+    return compute_voice_features(sound, "<memory>", f0min, f0max, timings)
+
+
+def compute_voice_features(sound, source="<memory>", f0min=75, f0max=500, timings=None):
+    """
+    Compute the acoustic feature vector of a loaded parselmouth Sound
+    With a ``timings`` dict, the seconds spent on each feature group (pitch, point_process, intensity,
+    harmonicity, perturbation) are recorded in it.
+    """
+    clock = [time.perf_counter()]
+
+    def lap(stage):
+        if timings is not None:
+            now = time.perf_counter()
+            timings[stage] = now - clock[0]
+            clock[0] = now
+
+    # --- Add Validation ---
+    duration = sound.get_total_duration()
+    if duration <= 0.1: # Example threshold
+        logger.warning(f"Audio duration is very short ({duration:.2f}s). Feature extraction might be unreliable or fail.")
+    # --------------------
+
+    # Extract features using parselmouth calls
+    try:
+        pitch = sound.to_pitch(pitch_floor=f0min, pitch_ceiling=f0max)
+
+        # Fundamental frequency
+        pitch_values = pitch.selected_array['frequency']
+        pitch_values = pitch_values[pitch_values != 0]
+        meanF0 = np.mean(pitch_values) if len(pitch_values) > 0 else 0
+        stdevF0 = np.std(pitch_values) if len(pitch_values) > 1 else 0
+        lap("pitch")
+
+        point_process = call(sound, "To PointProcess (periodic, cc)", f0min, f0max)
+        lap("point_process")
+
+        # Intensity
+        intensity = sound.to_intensity(minimum_pitch=f0min)
+        intensity_values = intensity.values[0]
+        meanI = np.mean(intensity_values) if len(intensity_values) > 0 else 0
+        stdevI = np.std(intensity_values) if len(intensity_values) > 1 else 0
+        lap("intensity")
+
+        # Harmonicity
+        harmonicity = sound.to_harmonicity()
+        hnr_values = harmonicity.values[harmonicity.values != -200] # Praat uses -200 for undefined
+        meanHNR = np.mean(hnr_values) if len(hnr_values) > 0 else 0
+        lap("harmonicity")
+
+        # Jitter and shimmer
+        (localJitter, localabsoluteJitter, rapJitter, ppq5Jitter,
+         localShimmer, localdbShimmer, apq3Shimmer, aqpq5Shimmer, apq11Shimmer) = PERTURBATION_ENGINES[PERTURBATION_ENGINE](
+            sound, point_process, 0.0001, 0.02, 1.3, 1.6)
+        lap("perturbation")
+
+    except Exception as praat_err:
+         logger.error(f"Error during Praat feature calculation via parselmouth on '{source}': {praat_err}", exc_info=True)
+         raise Exception(f"Failed during acoustic feature calculation: {praat_err}") from praat_err
+
+    features = [
+        meanF0, stdevF0, meanI, stdevI, meanHNR,
+        localJitter, localabsoluteJitter, rapJitter, ppq5Jitter,
+        localShimmer, localdbShimmer, apq3Shimmer, aqpq5Shimmer, apq11Shimmer
+    ]
+
+    # Check for NaN or infinite values and replace with 0
+    features = np.nan_to_num(np.array(features), nan=0.0, posinf=0.0, neginf=0.0)
+    if np.any(np.isnan(features)) or np.any(np.isinf(features)):
+         # This should ideally not happen after nan_to_num
+         logger.error(f"Invalid feature values (NaN/Inf) detected AFTER nan_to_num: {features}")
+         raise ValueError("Invalid feature values detected (NaN or infinite) after processing.")
+
+    logger.debug("Extracted features from %s", source)
+    return features
+
+
 class VoiceAnalyzer:
-    def __init__(self):
-        self.feature_names = [
-            "meanF0", "stdevF0", "meanIntensity", "stdevIntensity", "HNR",
-            "localJitter", "localabsoluteJitter", "rapJitter", "ppq5Jitter",
-            "localShimmer", "localdbShimmer", "apq3Shimmer", "aqpq5Shimmer", "apq11Shimmer"
-        ]
+    # Default artifact for each exported backend (see export_voice_model.py)
+    EXPORTED_MODEL_PATHS = {
+        "numpy": "voice_glucose_model.npz",
+        "tflite": "voice_glucose_model.tflite",
+        "onnx": "voice_glucose_model.onnx",
+    }
+
+    # Registry versions kept loaded besides the served one, so switching back to them is instant
+    KEEP_LOADED_VERSIONS = 3
+
+    def __init__(self, backend=None, backend_path=None, registry=None):
+        self.feature_names = list(FEATURE_NAMES)
         self.model = None
         self.model_path = 'voice_glucose_model.keras'
         # Reference ranges from training data
         self.min_glucose = 75  # minimum glucose level in training data
         self.max_glucose = 180  # maximum glucose level in training data
         self.normal_range = (80, 120)  # normal glucose range
-        self.initialize_model()
+
+        # Inference backend: the others run exported weights; "keras" imports TensorFlow and is
+        # meant for training and debugging
+        self.backend_name = backend or os.getenv("VOICE_MODEL_BACKEND", "numpy")
+        if self.backend_name not in BACKENDS:
+            raise ValueError(f"Unknown VOICE_MODEL_BACKEND '{self.backend_name}'. Choose from {BACKENDS}")
+        self.backend = None
+        # The exported file served when there is no registry, rewritten by training jobs
+        self.backend_path = None
+        # Serialises model swaps; predictions never take it, they read self.backend once per batch
+        self._swap_lock = threading.Lock()
+        # Versioned models (see ModelRegistry); an explicit export path still takes precedence
+        self.registry = registry
+        self._activation_lock = threading.RLock()
+        self._loaded_versions = OrderedDict()
+        if registry is not None and registry.active and not (backend_path or os.getenv("VOICE_MODEL_EXPORT_PATH")):
+            self.model, self.backend = self.load_version(registry.active)
+            logger.info(f"Loaded voice model {registry.active} from the registry at {registry.root}")
+        elif self.backend_name == "keras":
+            self.initialize_model()
+        else:
+            path = backend_path or os.getenv("VOICE_MODEL_EXPORT_PATH") or self.EXPORTED_MODEL_PATHS[self.backend_name]
+            self.backend = load_backend(self.backend_name, path)
+            self.backend_path = path
+            logger.info(f"Loaded '{self.backend_name}' inference backend from {path}")
+
+    @property
+    def model_version(self):
+        """Identifies the weights currently served; changes whenever the model is retrained, loaded or swapped"""
+        return self.version_of(self.backend)
+
+    @staticmethod
+    def version_of(backend):
+        # Registry versions are reported by name; anything else by runtime and weight fingerprint
+        registry_version = getattr(backend, "registry_version", None)
+        return registry_version or f"{backend.name}-{backend.fingerprint}"
 
     def initialize_model(self):
+        self.model = self.build_model()
+        self.backend = KerasBackend(self.model)
+
+    def build_model(self):
+        """Build and compile a fresh (untrained) Keras model of the serving architecture"""
+        import tensorflow as tf
+
         # Create a simple Sequential model
         model = tf.keras.Sequential([
             tf.keras.layers.Dense(64, activation='relu', input_shape=(14,)),
@@ -40,96 +223,127 @@ class VoiceAnalyzer:
                      loss='mse',
                      metrics=['mae'])
         
-        self.model = model
+        return model
 
     def extract_voice_features(self, voice_wav_path, f0min=75, f0max=500): # Renamed parameter
         """Extract acoustic features from a WAV voice file"""
-        logger.info(f"Extracting features directly from WAV: {voice_wav_path}")
+        return extract_voice_features(voice_wav_path, f0min, f0max)
 
-        # --- Add validation that input is WAV ---
-        if not isinstance(voice_wav_path, str) or not voice_wav_path.lower().endswith('.wav'):
-             logger.error(f"Input to extract_voice_features is not a valid WAV file path: {voice_wav_path}")
-             raise ValueError("extract_voice_features expects a .wav file path.")
-        # -----------------------------------------
+    def train_model(self, X_train, y_train, epochs=50):
+        """Train a copy of the model with voice features and glucose levels, then swap it in"""
+        import tensorflow as tf
 
-        try:
-            # Load the audio file (expects WAV)
-            try:
-                sound = parselmouth.Sound(voice_wav_path)
-            except Exception as ps_load_err:
-                 logger.error(f"Parselmouth failed to load sound from '{voice_wav_path}'. Check WAV file integrity.", exc_info=True)
-                 raise Exception(f"Failed to load audio using parselmouth: {ps_load_err}") from ps_load_err
-
-            # --- Add Validation ---
-            duration = sound.get_total_duration()
-            if duration <= 0.1: # Example threshold
-                logger.warning(f"Audio duration is very short ({duration:.2f}s). Feature extraction might be unreliable or fail.")
-            # --------------------
-
-            # Extract features using parselmouth calls
-            try:
-                pitch = sound.to_pitch(pitch_floor=f0min, pitch_ceiling=f0max)
-                point_process = call(sound, "To PointProcess (periodic, cc)", f0min, f0max)
-
-                # Fundamental frequency
-                pitch_values = pitch.selected_array['frequency']
-                pitch_values = pitch_values[pitch_values != 0]
-                meanF0 = np.mean(pitch_values) if len(pitch_values) > 0 else 0
-                stdevF0 = np.std(pitch_values) if len(pitch_values) > 1 else 0
-
-                # Intensity
-                intensity = sound.to_intensity(minimum_pitch=f0min)
-                intensity_values = intensity.values[0]
-                meanI = np.mean(intensity_values) if len(intensity_values) > 0 else 0
-                stdevI = np.std(intensity_values) if len(intensity_values) > 1 else 0
-
-                # Harmonicity
-                harmonicity = sound.to_harmonicity()
-                hnr_values = harmonicity.values[harmonicity.values != -200] # Praat uses -200 for undefined
-                meanHNR = np.mean(hnr_values) if len(hnr_values) > 0 else 0
-
-                # Jitter
-                localJitter = call(point_process, "Get jitter (local)", 0.0, 0.0, 0.0001, 0.02, 1.3)
-                localabsoluteJitter = call(point_process, "Get jitter (local, absolute)", 0.0, 0.0, 0.0001, 0.02, 1.3)
-                rapJitter = call(point_process, "Get jitter (rap)", 0.0, 0.0, 0.0001, 0.02, 1.3)
-                ppq5Jitter = call(point_process, "Get jitter (ppq5)", 0.0, 0.0, 0.0001, 0.02, 1.3)
-
-                # Shimmer
-                localShimmer = call([sound, point_process], "Get shimmer (local)", 0.0, 0.0, 0.0001, 0.02, 1.3, 1.6)
-                localdbShimmer = call([sound, point_process], "Get shimmer (local_dB)", 0.0, 0.0, 0.0001, 0.02, 1.3, 1.6)
-                apq3Shimmer = call([sound, point_process], "Get shimmer (apq3)", 0.0, 0.0, 0.0001, 0.02, 1.3, 1.6)
-                aqpq5Shimmer = call([sound, point_process], "Get shimmer (apq5)", 0.0, 0.0, 0.0001, 0.02, 1.3, 1.6)
-                apq11Shimmer = call([sound, point_process], "Get shimmer (apq11)", 0.0, 0.0, 0.0001, 0.02, 1.3, 1.6)
-
-            except Exception as praat_err:
-                 logger.error(f"Error during Praat feature calculation via parselmouth on '{voice_wav_path}': {praat_err}", exc_info=True)
-                 raise Exception(f"Failed during acoustic feature calculation: {praat_err}") from praat_err
-
-            features = [
-                meanF0, stdevF0, meanI, stdevI, meanHNR,
-                localJitter, localabsoluteJitter, rapJitter, ppq5Jitter,
-                localShimmer, localdbShimmer, apq3Shimmer, aqpq5Shimmer, apq11Shimmer
-            ]
-
-            # Check for NaN or infinite values and replace with 0
-            features = np.nan_to_num(np.array(features), nan=0.0, posinf=0.0, neginf=0.0)
-            if np.any(np.isnan(features)) or np.any(np.isinf(features)):
-                 # This should ideally not happen after nan_to_num
-                 logger.error(f"Invalid feature values (NaN/Inf) detected AFTER nan_to_num: {features}")
-                 raise ValueError("Invalid feature values detected (NaN or infinite) after processing.")
-
-            logger.info(f"Successfully extracted features from {voice_wav_path}")
-            return features
-
-        except Exception as e:
-            logger.error(f"Error in feature extraction pipeline for '{voice_wav_path}': {e}", exc_info=True)
-            logger.error(traceback.format_exc())
-            # Re-raise the exception so it's caught by the endpoint handler
-            raise Exception(f"Error extracting voice features from WAV: {e}") from e
+        if self.model is None:
+            # Serving from an exported backend: train a fresh Keras model
+            model = self.build_model()
+        else:
+            # Fit a copy so predictions in flight keep using the served weights until the swap
+            model = tf.keras.models.clone_model(self.model)
+            model.set_weights(self.model.get_weights())
+        model.compile(optimizer='adam', loss='mse', metrics=['mae'])
+        model.fit(X_train, y_train, epochs=epochs, validation_split=0.2)
+        self.swap_model(model)
 
-    def train_model(self, X_train, y_train, epochs=50):
-        """Train the model with voice features and glucose levels"""
-        self.model.fit(X_train, y_train, epochs=epochs, validation_split=0.2)
+    def backend_for(self, model):
+        """The backend that serves a Keras model in this analyzer's mode"""
+        if self.backend_name == "keras":
+            return KerasBackend(model)
+        # Exported runtimes cannot load an in-memory Keras model, so serve its weights with NumPy
+        return NumpyMLPBackend.from_keras_model(model)
+
+    def swap_model(self, model=None, backend=None, max_batch_size=1):
+        """
+        Start serving a new model. The backend is built (from ``model`` unless given) and warmed up first,
+        then replaces the served one in a single assignment: a batch already running finishes on the old
+        weights and every later batch uses the new ones, so no batch ever mixes the two.
+        """
+        if backend is None:
+            backend = self.backend_for(model)
+        self._warm_backend(backend, max_batch_size)
+        with self._swap_lock:
+            previous = self.version_of(self.backend) if self.backend is not None else None
+            # The Keras model behind the served weights (None when they came from an exported file)
+            self.model = model
+            self.backend = backend
+        logger.info(f"Voice model swapped: {previous} -> {self.version_of(backend)}")
+        return previous
+
+    def load_version(self, version):
+        """
+        Load a registry version for this analyzer's backend; returns ``(keras_model_or_None, backend)``.
+        A version without an artifact for an exported runtime is served from its NumPy weights
+        (exported from its Keras file if it has no .npz).
+        """
+        if self.registry is None:
+            raise ValueError("No model registry configured")
+        metadata = self.registry.metadata(version)
+        if metadata.get("feature_names") and list(metadata["feature_names"]) != self.feature_names:
+            raise ValueError(f"Model {version} was trained on different features: {metadata['feature_names']}")
+
+        model = None
+        path = self.registry.artifact_path(version, self.backend_name)
+        if path is not None and self.backend_name == "keras":
+            import tensorflow as tf
+
+            model = tf.keras.models.load_model(path)
+            backend = KerasBackend(model)
+        elif path is not None:
+            backend = load_backend(self.backend_name, path)
+        elif self.registry.artifact_path(version, "numpy") is not None:
+            backend = NumpyMLPBackend.from_file(self.registry.artifact_path(version, "numpy"))
+        elif self.registry.artifact_path(version, "keras") is not None:
+            # Only a Keras file (e.g. a model saved before exports existed): TensorFlow is needed to read it
+            import tensorflow as tf
+
+            model = tf.keras.models.load_model(self.registry.artifact_path(version, "keras"))
+            backend = self.backend_for(model)
+        else:
+            raise FileNotFoundError(f"Model {version} has no artifact this analyzer can serve (it has {metadata.get('artifacts')})")
+        backend.registry_version = version
+        return model, backend
+
+    def activate_version(self, version, max_batch_size=1, rollback=False, loaded=None):
+        """
+        Serve a registry version and make it the one loaded at startup; returns the previously served version.
+        The version is loaded (or taken from the recently served ones, or ``loaded``) and warmed before the swap.
+        """
+        if self.registry is None:
+            raise ValueError("No model registry configured")
+        with self._activation_lock:
+            if loaded is None:
+                loaded = self._loaded_versions.pop(version, None) or self.load_version(version)
+            model, backend = loaded
+            backend.registry_version = version
+            outgoing = (self.model, self.backend)
+            previous = self.swap_model(model=model, backend=backend, max_batch_size=max_batch_size)
+            self.registry.set_active(version, rollback=rollback)
+
+            # Keep the outgoing version loaded (and already warm) for an instant switch back
+            outgoing_version = getattr(outgoing[1], "registry_version", None)
+            if outgoing_version is not None and outgoing_version != version:
+                self._loaded_versions[outgoing_version] = outgoing
+                while len(self._loaded_versions) > self.KEEP_LOADED_VERSIONS:
+                    self._loaded_versions.popitem(last=False)
+            return previous
+
+    def rollback(self, max_batch_size=1):
+        """Return to the registry version that was active before the current one"""
+        if self.registry is None:
+            raise ValueError("No model registry configured")
+        with self._activation_lock:
+            target = self.registry.rollback_target()
+            if target is None:
+                raise ValueError("There is no earlier model version to roll back to")
+            return self.activate_version(target, max_batch_size=max_batch_size, rollback=True)
+
+    def _warm_backend(self, backend, max_batch_size=1):
+        """Run dummy rows through a backend for every batch shape the micro-batcher can produce"""
+        # Batches are padded to a power of two (see KerasBackend.predict), so warm up to the padded size
+        largest = 1 << (max(1, max_batch_size) - 1).bit_length()
+        rows = 1
+        while rows <= largest:
+            backend.predict(np.zeros((rows, len(self.feature_names)), dtype=np.float32))
+            rows *= 2
 
     def normalize_prediction(self, raw_prediction):
         """
@@ -167,17 +381,49 @@ class VoiceAnalyzer:
     def predict_glucose(self, voice_features):
         """Predict glucose level from voice features"""
         features = voice_features.reshape(1, -1)
-        raw_prediction = self.model.predict(features, verbose=0)[0][0]
-        logger.info(f"Raw prediction: {raw_prediction}")
-        
-        # Normalize prediction to realistic glucose range
-        glucose_level, confidence = self.normalize_prediction(raw_prediction)
-        logger.info(f"Normalized prediction: {glucose_level}, confidence: {confidence}")
+        glucose_level, confidence = self.predict_glucose_batch(features)[0]
+        logger.debug("Normalized prediction: %s, confidence: %s", glucose_level, confidence)
         
         return glucose_level, confidence
 
+    def predict_glucose_batch(self, features_matrix):
+        """
+        Predict glucose levels for a (n, 14) matrix of voice features in one forward pass.
+        Returns a list of (glucose_level, confidence) tuples, one per row.
+        """
+        return self.predict_glucose_batch_versioned(features_matrix)[0]
+
+    def predict_glucose_batch_versioned(self, features_matrix):
+        """
+        Like predict_glucose_batch, but also returns the model_version of the weights that produced the
+        predictions. The backend is read once, so a model swapped in meanwhile cannot split the batch.
+        """
+        backend = self.backend
+        return self._predict_with(backend, features_matrix), self.version_of(backend)
+
+    def _predict_with(self, backend, features_matrix):
+        raw_predictions = backend.predict(features_matrix)
+        # Per-batch detail; the arguments are only formatted if debug logging is on
+        logger.debug("Raw predictions for batch of %d: %s", len(raw_predictions), raw_predictions)
+
+        # Normalize each prediction to realistic glucose range
+        return [self.normalize_prediction(raw_prediction) for raw_prediction in raw_predictions]
+
+    def warmup(self, sample_path=None, max_batch_size=1):
+        """
+        Run dummy feature vectors through the model for every batch shape the micro-batcher can produce,
+        and optionally decode and analyse a sample recording, so the first real request does not pay for
+        graph tracing or Praat initialisation.
+        """
+        self._warm_backend(self.backend, max_batch_size)
+        if sample_path and os.path.exists(sample_path):
+            features = self.extract_voice_features(sample_path)
+            self.predict_glucose_batch(features.reshape(1, -1))
+
     def save_model(self, path=None):
         """Save the trained model"""
+        if self.model is None:
+            raise ValueError("No Keras model to save; the active backend serves exported weights")
         if path is None:
             path = self.model_path
         self.model.save(path)
@@ -187,6 +433,8 @@ class VoiceAnalyzer:
         if path is None:
             path = self.model_path
         if os.path.exists(path):
-            self.model = tf.keras.models.load_model(path)
+            import tensorflow as tf
+
+            self.swap_model(tf.keras.models.load_model(path))
         else:
             raise FileNotFoundError("No trained model found")
\ No newline at end of file
@@ -0,0 +1,120 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class VoiceResultCache:
+    """
+    In-memory cache of voice features and glucose predictions.
+
+    Entries are keyed by the SHA-256 of the decoded PCM (plus sample rate), so
+    the same recording re-encoded or re-wrapped still hits. A second index maps
+    the SHA-256 of the uploaded bytes to that PCM key, so an identical re-upload
+    is answered before any decoding. Each entry holds the 14-element feature
+    vector and the ``(glucose_level, confidence)`` prediction tagged with the
+    model version that produced it. A prediction from any other model version
+    is ignored and replaced, so retraining or swapping the model invalidates
+    predictions automatically while the (model-independent) features are
+    reused. Both indexes are LRU-bounded by ``max_entries``.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        # pcm key -> {"features": np.ndarray, "model_version": str | None, "prediction": tuple | None}
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        # upload bytes key -> pcm key
+        self._uploads: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits_upload = 0
+        self.hits_pcm = 0
+        self.hits_features = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def upload_key(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def pcm_key(samples: np.ndarray, sample_rate: int) -> str:
+        """Hashes the sample buffer in place (no copy when contiguous); call it off the event loop for long audio"""
+        digest = hashlib.sha256(str((samples.shape, sample_rate)).encode())
+        digest.update(memoryview(np.ascontiguousarray(samples)).cast("B"))
+        return digest.hexdigest()
+
+    def pcm_key_for_upload(self, upload_key: str) -> Optional[str]:
+        with self._lock:
+            pcm_key = self._uploads.get(upload_key)
+            if pcm_key is not None:
+                self._uploads.move_to_end(upload_key)
+            return pcm_key
+
+    def get_prediction(self, pcm_key: str, model_version: str, from_upload: bool = False) -> Optional[tuple]:
+        """Cached ``(glucose_level, confidence)`` for this audio under ``model_version``, or None."""
+        with self._lock:
+            entry = self._entries.get(pcm_key)
+            if entry is None or entry["prediction"] is None:
+                return None
+            if entry["model_version"] != model_version:
+                # Produced by another model: drop it, the features are still good
+                entry["prediction"] = None
+                entry["model_version"] = None
+                self.invalidations += 1
+                return None
+            self._entries.move_to_end(pcm_key)
+            if from_upload:
+                self.hits_upload += 1
+            else:
+                self.hits_pcm += 1
+            return entry["prediction"]
+
+    def get_features(self, pcm_key: str) -> Optional[np.ndarray]:
+        """Cached feature vector for this audio, or None (counted as a miss)."""
+        with self._lock:
+            entry = self._entries.get(pcm_key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(pcm_key)
+            self.hits_features += 1
+            return entry["features"]
+
+    def link_upload(self, upload_key: str, pcm_key: str):
+        """Remember that these upload bytes decode to already-cached audio."""
+        with self._lock:
+            self._uploads[upload_key] = pcm_key
+            self._uploads.move_to_end(upload_key)
+            while len(self._uploads) > self.max_entries:
+                self._uploads.popitem(last=False)
+
+    def put(self, upload_key: str, pcm_key: str, features: np.ndarray, model_version: str, prediction: tuple):
+        with self._lock:
+            self._entries[pcm_key] = {
+                "features": np.asarray(features),
+                "model_version": model_version,
+                "prediction": (float(prediction[0]), float(prediction[1])),
+            }
+            self._entries.move_to_end(pcm_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        self.link_upload(upload_key, pcm_key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits_upload + self.hits_pcm + self.hits_features + self.misses
+            return {
+                "hits_upload": self.hits_upload,
+                "hits_pcm": self.hits_pcm,
+                "hits_features_only": self.hits_features,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_ratio": round((lookups - self.misses) / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "uploads": len(self._uploads),
+            }
@@ -0,0 +1,207 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from parselmouth.praat import call
+
+# Praat's defaults, as passed to "Get jitter (...)" and "Get shimmer (...)"
+PERIOD_FLOOR = 0.0001
+PERIOD_CEILING = 0.02
+MAX_PERIOD_FACTOR = 1.3
+MAX_AMPLITUDE_FACTOR = 1.6
+
+JITTER_NAMES = ['localJitter', 'localabsoluteJitter', 'rapJitter', 'ppq5Jitter']
+SHIMMER_NAMES = ['localShimmer', 'localdbShimmer', 'apq3Shimmer', 'aqpq5Shimmer', 'apq11Shimmer']
+
+def pulse_times(point_process) -> np.ndarray:
+    """The glottal pulse times of a Praat PointProcess, fetched in one call."""
+    if call(point_process, "Get number of points") == 0:
+        return np.zeros(0)
+    return call(point_process, "To Matrix").values[0].copy()
+
+
+def _factor(a, b):
+    """Praat's ratio of the larger to the smaller of two adjacent values (always >= 1)."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(a > b, a / b, b / a)
+
+
+def _all_true(flags, size):
+    """For every run of ``size`` consecutive flags, whether all of them are set."""
+    if len(flags) < size:
+        return np.zeros(0, dtype=bool)
+    return sliding_window_view(flags, size).all(axis=1)
+
+
+def _valid_windows(in_range, factor_ok, size):
+    """Windows of ``size`` consecutive periods that are all in range and whose adjacent ratios are all ok."""
+    valid = _all_true(in_range, size)
+    if size > 1 and len(valid):
+        valid &= _all_true(factor_ok, size - 1)
+    return valid
+
+
+def _mean_period(periods, period_floor, period_ceiling, max_period_factor):
+    """PointProcess_getMeanPeriod: the mean of the periods that Praat's isPeriod accepts (equal bounds mean no bounds)."""
+    ok = periods > 0
+    if period_floor == period_ceiling:
+        return periods[ok].mean() if ok.any() else np.nan
+    ok &= (periods >= period_floor) & (periods <= period_ceiling)
+    if not np.isnan(max_period_factor) and max_period_factor >= 1.0 and len(periods) > 1:
+        # A period is rejected only when it differs too much from both of its neighbours
+        with np.errstate(divide='ignore', invalid='ignore'):
+            previous = np.full(len(periods), np.nan)
+            following = np.full(len(periods), np.nan)
+            previous[1:] = np.where(periods[:-1] > 0, periods[1:] / periods[:-1], np.nan)
+            following[:-1] = np.where(periods[1:] > 0, periods[:-1] / periods[1:], np.nan)
+            previous = np.where(previous < 1.0, 1.0 / previous, previous)
+            following = np.where(following < 1.0, 1.0 / following, following)
+        ok &= ~((previous > max_period_factor) & (following > max_period_factor))
+    return periods[ok].mean() if ok.any() else np.nan
+
+
+def jitter(times, period_floor=PERIOD_FLOOR, period_ceiling=PERIOD_CEILING, max_period_factor=MAX_PERIOD_FACTOR):
+    """
+    Local, local absolute, rap and ppq5 jitter of a pulse sequence, matching Praat's
+    "Get jitter (...)" over the whole PointProcess. Undefined measures are NaN.
+    """
+    periods = np.diff(np.asarray(times, dtype=np.float64))
+    if period_floor == period_ceiling:
+        in_range = np.ones(len(periods), dtype=bool)
+        factor_ok = np.ones(max(len(periods) - 1, 0), dtype=bool)
+    else:
+        in_range = (periods >= period_floor) & (periods <= period_ceiling)
+        factor_ok = _factor(periods[:-1], periods[1:]) <= max_period_factor
+
+    mean_period = _mean_period(periods, period_floor, period_ceiling, max_period_factor)
+    results = []
+
+    # local: mean |p(i) - p(i+1)|
+    valid = _valid_windows(in_range, factor_ok, 2)
+    absolute = np.abs(np.diff(periods))[valid].mean() if valid.any() else np.nan
+    results += [absolute / mean_period, absolute]
+
+    # rap and ppq5: mean |p(centre) - mean of the window|
+    for size in (3, 5):
+        valid = _valid_windows(in_range, factor_ok, size)
+        if not valid.any():
+            results.append(np.nan)
+            continue
+        windows = sliding_window_view(periods, size)[valid]
+        results.append(np.abs(windows[:, size // 2] - windows.mean(axis=1)).mean() / mean_period)
+    return results
+
+
+def peak_amplitudes(times, samples, x1, dx, period_floor=PERIOD_FLOOR, period_ceiling=PERIOD_CEILING,
+                    max_period_factor=MAX_PERIOD_FACTOR):
+    """
+    The per-period amplitude tier Praat builds for shimmer (PointProcess_Sound_to_AmplitudeTier_period):
+    a Hann-windowed RMS around every pulse whose two surrounding periods pass the period rules.
+    ``samples`` is the mono signal, ``x1`` the time of its first sample and ``dx`` the sample period.
+    Returns ``(peak_times, amplitudes)``.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    if len(times) < 3:
+        return np.zeros(0), np.zeros(0)
+    left = times[1:-1] - times[:-2]
+    right = times[2:] - times[1:-1]
+    ok = np.ones(len(left), dtype=bool)
+    if period_floor != period_ceiling:
+        ok = ((left >= period_floor) & (left <= period_ceiling) & (right >= period_floor) & (right <= period_ceiling)
+              & (_factor(left, right) <= max_period_factor))
+    centres, left, right = times[1:-1][ok], 0.2 * left[ok], 0.2 * right[ok]
+
+    # Sampled_getWindowSamples: samples whose time falls within [centre - left, centre + right]
+    last = len(samples) - 1
+    first_index = np.clip(np.ceil((centres - left - x1) / dx), 0, last).astype(np.int64)
+    last_index = np.clip(np.floor((centres + right - x1) / dx), 0, last).astype(np.int64)
+    counts = last_index - first_index + 1
+    # Too few samples under the window: Praat leaves the pulse out of the tier
+    keep = counts >= 3
+    centres, left, right, first_index, counts = centres[keep], left[keep], right[keep], first_index[keep], counts[keep]
+    if not len(centres):
+        return np.zeros(0), np.zeros(0)
+
+    # Every window's samples laid end to end, so all peaks are measured with flat array operations
+    starts = np.cumsum(counts) - counts
+    peak = np.repeat(np.arange(len(centres)), counts)
+    index = np.arange(counts.sum()) - starts[peak] + first_index[peak]
+    offset = x1 + index * dx - centres[peak]
+    window = 0.5 + 0.5 * np.cos(np.pi * offset / np.where(offset < 0, left[peak], right[peak]))
+    weighted = samples[index] * window
+    amplitudes = np.sqrt(np.add.reduceat(weighted * weighted, starts) / np.add.reduceat(window * window, starts))
+    # Silence under the window: no peak either
+    keep = amplitudes > 0
+    return centres[keep], amplitudes[keep]
+
+
+def shimmer(peak_times, amplitudes, period_floor=PERIOD_FLOOR, period_ceiling=PERIOD_CEILING,
+            max_amplitude_factor=MAX_AMPLITUDE_FACTOR):
+    """
+    Local, local dB, apq3, apq5 and apq11 shimmer of an amplitude tier, matching Praat's
+    "Get shimmer (...)" (AmplitudeTier_getShimmer_*). Undefined measures are NaN.
+    """
+    amplitudes = np.asarray(amplitudes, dtype=np.float64)
+    if len(amplitudes) < 2:
+        return [np.nan] * len(SHIMMER_NAMES)
+    periods = np.diff(np.asarray(peak_times, dtype=np.float64))
+    if period_floor == period_ceiling:
+        in_range = np.ones(len(periods), dtype=bool)
+    else:
+        in_range = (periods >= period_floor) & (periods <= period_ceiling)
+    factor_ok = _factor(amplitudes[:-1], amplitudes[1:]) <= max_amplitude_factor
+    # Praat's denominator averages every amplitude but the last
+    mean_amplitude = amplitudes[:-1].mean()
+    results = []
+
+    # A window of k amplitudes counts when its k - 1 periods are in range and its k - 1 amplitude ratios ok
+    gap_ok = in_range & factor_ok
+    valid = gap_ok
+    if valid.any():
+        pairs = sliding_window_view(amplitudes, 2)[valid]
+        results.append(np.abs(pairs[:, 0] - pairs[:, 1]).mean() / mean_amplitude)
+        results.append(20.0 * np.abs(np.log10(pairs[:, 0] / pairs[:, 1])).mean())
+    else:
+        results += [np.nan, np.nan]
+
+    for size in (3, 5, 11):
+        valid = _all_true(gap_ok, size - 1)
+        if not valid.any():
+            results.append(np.nan)
+            continue
+        windows = sliding_window_view(amplitudes, size)[valid]
+        results.append(np.abs(windows[:, size // 2] - windows.mean(axis=1)).mean() / mean_amplitude)
+    return results
+
+
+def perturbation_features(sound, point_process, period_floor=PERIOD_FLOOR, period_ceiling=PERIOD_CEILING,
+                          max_period_factor=MAX_PERIOD_FACTOR, max_amplitude_factor=MAX_AMPLITUDE_FACTOR):
+    """
+    All nine jitter and shimmer measures of a parselmouth Sound and its PointProcess, in the order of
+    JITTER_NAMES + SHIMMER_NAMES. The pulses and the sound are read once and every measure comes from
+    the same period and peak sequences, instead of nine Praat queries that each rebuild them.
+    """
+    times = pulse_times(point_process)
+    values = sound.values
+    # Praat analyses the average of the first two channels of a stereo sound
+    samples = values[0] if values.shape[0] == 1 else 0.5 * (values[0] + values[1])
+    peak_times, amplitudes = peak_amplitudes(times, samples, sound.x1, sound.dx,
+                                             period_floor, period_ceiling, max_period_factor)
+    return (jitter(times, period_floor, period_ceiling, max_period_factor)
+            + shimmer(peak_times, amplitudes, period_floor, period_ceiling, max_amplitude_factor))
+
+
+def praat_perturbation_features(sound, point_process, period_floor=PERIOD_FLOOR, period_ceiling=PERIOD_CEILING,
+                                max_period_factor=MAX_PERIOD_FACTOR, max_amplitude_factor=MAX_AMPLITUDE_FACTOR):
+    """The same nine measures through Praat's own queries (the reference the engine is checked against)."""
+    jitter_args = (0.0, 0.0, period_floor, period_ceiling, max_period_factor)
+    shimmer_args = jitter_args + (max_amplitude_factor,)
+    return [
+        call(point_process, "Get jitter (local)", *jitter_args),
+        call(point_process, "Get jitter (local, absolute)", *jitter_args),
+        call(point_process, "Get jitter (rap)", *jitter_args),
+        call(point_process, "Get jitter (ppq5)", *jitter_args),
+        call([sound, point_process], "Get shimmer (local)", *shimmer_args),
+        call([sound, point_process], "Get shimmer (local_dB)", *shimmer_args),
+        call([sound, point_process], "Get shimmer (apq3)", *shimmer_args),
+        call([sound, point_process], "Get shimmer (apq5)", *shimmer_args),
+        call([sound, point_process], "Get shimmer (apq11)", *shimmer_args),
+    ]
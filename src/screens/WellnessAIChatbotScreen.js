@@ -36,6 +36,7 @@ const WellnessAIChatbotScreen = ({ navigation }) => {
   const [streamingId, setStreamingId] = useState(null);
   const flatListRef = useRef(null);
   const streamingIntervalRef = useRef(null);
+  const sessionIdRef = useRef(null); // Backend chat session, assigned on the first reply
   const [showDisclaimer, setShowDisclaimer] = useState(false);
 
   // Show disclaimer popup after 2 seconds
@@ -129,6 +130,7 @@ const WellnessAIChatbotScreen = ({ navigation }) => {
         },
         body: JSON.stringify({
           message: messageWithContext,
+          session_id: sessionIdRef.current,
         }),
       });
 
@@ -136,6 +138,12 @@ const WellnessAIChatbotScreen = ({ navigation }) => {
         throw new Error('Network response was not ok');
       }
 
+      // Keep the session id so follow-up messages continue the same conversation
+      const sessionId = response.headers.get('X-Session-Id');
+      if (sessionId) {
+        sessionIdRef.current = sessionId;
+      }
+
       // Get the response text
       const responseText = await response.text();
       